@@ -1,14 +1,12 @@
 import os
 import json
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_ollama.llms import OllamaLLM
+from .prompt_registry import prompt_registry
+from .retrieval import get_retrieval_index
 # from langchain_ollama import OllamaEmbeddings
 # from langchain_chroma import Chroma
 import logging
 import asyncio
 
-logging.basicConfig(level=logging.DEBUG)
-
 class Agent:
     def __init__(self, name, base_url, model):
         self.name = name
@@ -41,6 +39,10 @@ class Agent:
         #         logging.error(f"Error reinitializing Chroma DB: {str(e)}")
         #         raise"""
 
+        # langchain takes over a second to import, so it is only loaded once an agent is built
+        from langchain_core.prompts import ChatPromptTemplate
+        from langchain_ollama.llms import OllamaLLM
+
         try:
             self.llm = OllamaLLM(model=model, base_url=base_url)
             logging.info("OllamaLLM initialized successfully")
@@ -48,12 +50,7 @@ class Agent:
             logging.error(f"Error initializing OllamaLLM: {str(e)}")
             raise
 
-        self.template = """
-        Generate a detailed persona based on this input: {input_text}
-        
-        Include categories such as Name, Professional Summary, Goals, Qualifications and Education, Skills, Strengths, and Value Proposition.
-        Format the response as a JSON object.
-        """
+        self.template = prompt_registry.get('agent').user.format_string()
         self.prompt = ChatPromptTemplate.from_template(self.template)
         self.chain = self.prompt | self.llm
 
@@ -83,25 +80,18 @@ class Agent:
             logging.error(f"Error generating persona stream: {str(e)}")
             raise
 
-    # def add_to_db(self, content, filename):
-    #     try:
-    #         self.db.add_texts(texts=[content], metadatas=[{"source": filename}])
-    #         logging.info(f"Content added to Chroma DB: {filename}")
-    #     except Exception as e:
-    #         logging.error(f"Error adding content to Chroma DB: {str(e)}")
-    #         raise
-
-    # def update_chroma_db(self, content, filename):
-    #     try:
-    #         self.add_to_db(content, filename)
-    #         logging.info(f"Chroma DB updated for {filename}")
-    #     except Exception as e:
-    #         logging.error(f"Error updating Chroma DB for {filename}: {str(e)}")
+    def add_to_db(self, content, filename):
+        try:
+            added = get_retrieval_index().add('document', filename, content, replace=True)
+            logging.info(f"Indexed {added} chunks from {filename}")
+        except Exception as e:
+            logging.error(f"Error adding content to retrieval index: {str(e)}")
+            raise
 
-    # def get_relevant_documents(self, query, k=5):
-    #     try:
-    #         docs = self.db.similarity_search(query, k=k)
-    #         return [doc.page_content for doc in docs]
-    #     except Exception as e:
-    #         logging.error(f"Error retrieving relevant documents: {str(e)}")
-    #         raise
+    def get_relevant_documents(self, query, k=5):
+        """The k indexed chunks most relevant to query, for prompts that need context rather than whole documents."""
+        try:
+            return [result['text'] for result in get_retrieval_index().search(query, k=k)]
+        except Exception as e:
+            logging.error(f"Error retrieving relevant documents: {str(e)}")
+            raise
@@ -0,0 +1,381 @@
+# ASGI entrypoint: gunicorn backend.asgi:app -k uvicorn.workers.UvicornWorker
+import io
+import json
+import asyncio
+import logging
+import traceback
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.datastructures import MultiDict
+from werkzeug.formparser import FormDataParser
+from werkzeug.http import parse_options_header
+
+from .main import app as flask_app
+from .llm import astream_chat
+from .scheduler import SchedulerRejected
+from .ingest import UploadError
+from .generation import (
+    response_cache, lookup_cached_response, acollect_json,
+    build_persona_request, persona_result, apersona_events,
+    RECOMMENDATIONS_PARAMS, recommendations_cache_key, build_recommendations_messages, recommendations_result,
+    BULLETS_PARAMS, bullets_cache_key, build_bullets_messages, bullets_result, abullet_events, cached_bullet_events,
+    TAILOR_PARAMS, tailor_cache_key, build_tailor_messages,
+    BATCH_MAX_PARALLEL, batch_items, batch_summary,
+)
+from .streaming import sse_event
+from .speculation import speculator
+from .semantic_cache import semantic_cache
+from .log import begin_request, log_payload, LOG_VERBOSE_HEADER
+from . import metrics
+from .metrics import stage
+
+ALLOWED_ORIGINS = ['http://localhost:3000', 'https://tcard.vercel.app']
+
+# Everything without a native coroutine handler is served by the Flask app in a thread
+wsgi_app = WsgiToAsgi(flask_app)
+
+
+class Request:
+    """The parts of an ASGI HTTP request the generation handlers need."""
+
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.body = body
+        self.headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+        self.args = MultiDict(parse_qs(scope.get('query_string', b'').decode('latin-1')))
+        self.request_id = begin_request(self.headers)
+        self.timings = metrics.begin_request(scope.get('path'))
+        self.status = 500
+        # Progress of the response: once its headers are out an error can only end the body
+        self.started = False
+        self.finished = False
+
+    @property
+    def json(self):
+        mimetype, _ = parse_options_header(self.headers.get('content-type', ''))
+        if mimetype != 'application/json' and not mimetype.endswith('+json'):
+            return None
+        return json.loads(self.body)
+
+    @property
+    def form(self):
+        mimetype, options = parse_options_header(self.headers.get('content-type', ''))
+        _, form, _ = FormDataParser().parse(io.BytesIO(self.body), mimetype, len(self.body), options)
+        return form
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+def response_headers(request, content_type, extra=None):
+    headers = {'content-type': content_type}
+    origin = request.headers.get('origin')
+    if origin in ALLOWED_ORIGINS:
+        # Mirrors add_cors_headers in main.py
+        headers.update({
+            'access-control-allow-origin': origin,
+            'access-control-allow-credentials': 'true',
+            'access-control-allow-methods': 'GET, POST, PUT, PATCH, OPTIONS',
+            'access-control-allow-headers': f'Content-Type, Authorization, If-Match, If-None-Match, X-Request-ID, Idempotency-Key, {LOG_VERBOSE_HEADER}',
+            'access-control-expose-headers': 'Content-Type, Authorization, ETag, X-Request-ID, Server-Timing, Location',
+            'timing-allow-origin': origin,
+        })
+    headers['x-request-id'] = request.request_id
+    if request.timings is not None:
+        headers['server-timing'] = request.timings.server_timing()
+    headers.update(extra or {})
+    return [(k.encode('latin-1'), str(v).encode('latin-1')) for k, v in headers.items()]
+
+
+async def send_json(send, request, payload, status=200, extra=None):
+    with stage('serialize'):
+        body = json.dumps(payload).encode('utf-8')
+    request.status = status
+    request.started = True
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': response_headers(request, 'application/json', extra)})
+    request.finished = True
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_event_stream(send, request, events):
+    request.status = 200
+    request.started = True
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': response_headers(request, 'text/event-stream; charset=utf-8',
+                                            {'cache-control': 'no-cache', 'x-accel-buffering': 'no'})})
+    async for event in events:
+        await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+    request.finished = True
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def send_error(send, request, payload, status, extra=None):
+    """Send an error response, or end the body of one whose headers were already sent."""
+    if not request.started:
+        await send_json(send, request, payload, status, extra)
+    elif not request.finished:
+        request.finished = True
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+def wants_event_stream(request, settings):
+    if 'text/event-stream' in request.headers.get('accept', ''):
+        return True
+    if request.args.get('stream') in ('1', 'true'):
+        return True
+    return bool(settings.get('stream', False))
+
+
+async def generate_persona_stream(request, send):
+    with stage('parse'):
+        form = request.form
+        generation_settings = json.loads(form.get('generation_settings', '{}'))
+    logging.info("Received request for generate_persona_stream")
+    log_payload('persona.form', form.to_dict(flat=False))
+
+    with stage('prompt'):
+        # Off the event loop: an upload_id may need its text extracted first
+        messages, params, api_key = await asyncio.to_thread(build_persona_request, form, generation_settings)
+    deltas = astream_chat(messages=messages, api_key=api_key, route='persona', **params)
+
+    if wants_event_stream(request, generation_settings):
+        await send_event_stream(send, request, apersona_events(deltas))
+        return
+
+    generated_persona, parsed_data = await acollect_json(deltas)
+    log_payload('persona.response', generated_persona)
+    # Stores and indexes the persona, which writes to SQLite and disk
+    payload, status = await asyncio.to_thread(persona_result, generated_persona, parsed_data)
+    await send_json(send, request, payload, status)
+
+
+def _stored_response(cache_key, data, cache_control, route, speculative=False):
+    """(payload, X-Cache) of a stored response for the request, or (None, None).
+
+    Blocking, since the caches may be SQLite-backed; the handlers run it in a thread.
+    """
+    cached = lookup_cached_response(cache_key, data, cache_control)
+    if cached is not None:
+        return cached, 'HIT'
+    speculated = speculator.take(data, cache_control) if speculative else None
+    if speculated is not None:
+        response_cache.set(cache_key, speculated)
+        return speculated, 'SPECULATIVE'
+    similar = semantic_cache.lookup(route, data, cache_control)
+    if similar is not None:
+        return similar, 'SEMANTIC'
+    return None, None
+
+
+def _store_response(cache_key, route, data, payload):
+    response_cache.set(cache_key, payload)
+    semantic_cache.add(route, data, payload)
+
+
+async def _cached_generation(request, send, cache_key, data, generate, speculative=False, route=None):
+    """Serve from the cache or generate; True when a successful response was sent."""
+    cache_control = request.headers.get('cache-control', '')
+    stored, source = await asyncio.to_thread(_stored_response, cache_key, data, cache_control, route, speculative)
+    if stored is not None:
+        await send_json(send, request, stored, 200, {'x-cache': source})
+        return True
+    payload, status = await generate()
+    if status != 200:
+        await send_json(send, request, payload, status)
+        return False
+    await asyncio.to_thread(_store_response, cache_key, route, data, payload)
+    await send_json(send, request, payload, 200, {'x-cache': 'MISS'})
+    return True
+
+
+async def generate_star_recommendations(request, send):
+    with stage('parse'):
+        data = request.json
+
+    async def generate():
+        with stage('prompt'):
+            messages = build_recommendations_messages(data)
+        deltas = astream_chat(messages=messages, route='recommendations', **RECOMMENDATIONS_PARAMS)
+        return recommendations_result(*await acollect_json(deltas))
+
+    if await _cached_generation(request, send, recommendations_cache_key(data), data, generate, route='recommendations'):
+        await asyncio.to_thread(speculator.speculate, data)
+
+
+async def _collect_text(deltas):
+    return ''.join([delta async for delta in deltas])
+
+
+async def _replay(events):
+    for event in events:
+        yield event
+
+
+async def _stream_bullets(request, send, cache_key, data, route, build_messages, params, error_message,
+                          speculative=False):
+    """Serve a bullets or tailor request as SSE, one event per bullet as it completes."""
+    cache_control = request.headers.get('cache-control', '')
+    stored, _ = await asyncio.to_thread(_stored_response, cache_key, data, cache_control, route, speculative)
+    if stored is not None:
+        await send_event_stream(send, request, _replay(cached_bullet_events(stored)))
+        return
+    with stage('prompt'):
+        # Off the event loop: the tailor prompt may analyze a new job description, which writes to SQLite
+        messages = await asyncio.to_thread(build_messages, data)
+    deltas = astream_chat(messages=messages, route=route, **params)
+    await send_event_stream(send, request, abullet_events(deltas, cache_key, route, error_message, data))
+
+
+async def generate_bullets(request, send):
+    with stage('parse'):
+        data = request.json
+    log_payload('bullets.request', data)
+    if wants_event_stream(request, data):
+        await _stream_bullets(request, send, bullets_cache_key(data), data, 'bullets', build_bullets_messages,
+                              BULLETS_PARAMS, "Failed to parse generated bullets", speculative=True)
+        return
+
+    async def generate():
+        with stage('prompt'):
+            messages = build_bullets_messages(data)
+        deltas = astream_chat(messages=messages, route='bullets', **BULLETS_PARAMS)
+        generated_response = await _collect_text(deltas)
+        log_payload('bullets.response', generated_response)
+        return bullets_result(generated_response, "Failed to parse generated bullets")
+
+    await _cached_generation(request, send, bullets_cache_key(data), data, generate, speculative=True, route='bullets')
+
+
+async def tailor_bullets(request, send):
+    with stage('parse'):
+        data = request.json
+    log_payload('tailor.request', data)
+    if wants_event_stream(request, data):
+        await _stream_bullets(request, send, tailor_cache_key(data), data, 'tailor', build_tailor_messages,
+                              TAILOR_PARAMS, "Failed to parse tailored bullets")
+        return
+
+    async def generate():
+        with stage('prompt'):
+            messages = await asyncio.to_thread(build_tailor_messages, data)
+        deltas = astream_chat(messages=messages, route='tailor', **TAILOR_PARAMS)
+        generated_response = await _collect_text(deltas)
+        log_payload('tailor.response', generated_response)
+        return bullets_result(generated_response, "Failed to parse tailored bullets")
+
+    await _cached_generation(request, send, tailor_cache_key(data), data, generate, route='tailor')
+
+
+async def generate_batch_item(index, item, cache_control, semaphore):
+    try:
+        cache_key = bullets_cache_key(item)
+        stored, source = await asyncio.to_thread(_stored_response, cache_key, item, cache_control, 'bullets')
+        if stored is not None:
+            return {'index': index, 'cache': source, **stored}
+
+        async with semaphore:
+            deltas = astream_chat(messages=build_bullets_messages(item), route='batch', **BULLETS_PARAMS)
+            generated_response = await _collect_text(deltas)
+        payload, status = bullets_result(generated_response, "Failed to parse generated bullets")
+        if status != 200:
+            return {'index': index, **payload}
+        await asyncio.to_thread(_store_response, cache_key, 'bullets', item, payload)
+        return {'index': index, 'cache': 'MISS', **payload}
+    except SchedulerRejected as e:
+        return {'index': index, 'error': str(e), 'retry_after': e.retry_after}
+    except Exception as e:
+        logging.error(f"Error generating batch item {index}: {str(e)}")
+        return {'index': index, 'error': str(e)}
+
+
+async def generate_batch(items, cache_control):
+    semaphore = asyncio.Semaphore(BATCH_MAX_PARALLEL)
+    tasks = [
+        asyncio.ensure_future(generate_batch_item(index, item, cache_control, semaphore))
+        for index, item in enumerate(items)
+    ]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def batch_events(items, cache_control):
+    results = []
+    async for result in generate_batch(items, cache_control):
+        results.append(result)
+        yield sse_event('item', result)
+    yield sse_event('done', batch_summary(results))
+
+
+async def generate_bullets_batch(request, send):
+    data = request.json
+    try:
+        items = batch_items(data)
+    except ValueError as e:
+        await send_json(send, request, {"error": str(e)}, 400)
+        return
+
+    cache_control = 'no-cache' if data.get('regenerate') else request.headers.get('cache-control', '')
+
+    if wants_event_stream(request, data):
+        await send_event_stream(send, request, batch_events(items, cache_control))
+        return
+
+    results = sorted([result async for result in generate_batch(items, cache_control)], key=lambda result: result['index'])
+    await send_json(send, request, {'results': results, **batch_summary(results)})
+
+
+ROUTES = {
+    '/generate_persona_stream': generate_persona_stream,
+    '/api/star/recommendations': generate_star_recommendations,
+    '/api/star/bullets': generate_bullets,
+    '/api/star/bullets/batch': generate_bullets_batch,
+    '/api/star/tailor': tailor_bullets,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    handler = ROUTES.get(scope.get('path')) if scope['type'] == 'http' and scope['method'] == 'POST' else None
+    if handler is None:
+        await wsgi_app(scope, receive, send)
+        return
+
+    request = Request(scope, await read_body(receive))
+    try:
+        await handler(request, send)
+    except SchedulerRejected as e:
+        await send_error(send, request, {"error": str(e), "retry_after": e.retry_after}, e.status,
+                         {'retry-after': e.retry_after})
+    except UploadError as e:
+        await send_error(send, request, {"error": str(e)}, e.status)
+    except Exception as e:
+        logging.error(f"Error in {handler.__name__}: {str(e)}")
+        logging.error(traceback.format_exc())
+        await send_error(send, request, {"error": str(e)}, 500)
+    finally:
+        if request.timings is not None:
+            request.timings.finish(request.status)
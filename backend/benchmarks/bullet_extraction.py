@@ -0,0 +1,176 @@
+"""Fuzz and scaling check of the streaming bullet extractor against a corpus of malformed LLM output.
+
+    python -m backend.benchmarks.bullet_extraction                 # corpus, chunking fuzz, mutation fuzz, scaling
+    python -m backend.benchmarks.bullet_extraction --rounds 2000 --size 200000 --legacy
+
+bullet_corpus.json holds responses the bullets and tailor prompts have produced: code fences, prose around
+the JSON, trailing commas, truncation at max_tokens, Markdown and numbered lists, hyphens inside sentences.
+Each must give the same bullets however the stream is split into chunks, and the bullets returned while
+streaming must be the final list. Mutated copies must never fail with anything but ValueError. Pathological
+inputs are then timed at two sizes. The check exits non-zero if the cost per character grows with input size,
+which is what a quadratic pass looks like. --legacy times the old regex extraction on the same inputs.
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+
+from ..bullet_stream import StreamingBulletExtractor
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bullet_corpus.json')
+# Allowed growth in time per character between the small and the large input; linear is about 1
+LINEAR_SLACK = 3.0
+_FUZZ_CHARS = '{}[]"\'\n-•*,:\\ 1.'
+
+# Inputs that make backtracking or rescanning extractors quadratic, by name
+PATHOLOGICAL = {
+    'open braces': lambda n: '{' * n,
+    'brace pairs': lambda n: '{}' * (n // 2),
+    'deep arrays': lambda n: '{"bullets": ' + '[' * n,
+    'unterminated string': lambda n: '{"bullets": ["' + 'a' * n,
+    'escaped quotes': lambda n: '{"bullets": ["' + '\\"' * (n // 2),
+    'hyphens in one line': lambda n: 'word - ' * (n // 7),
+    'many short lines': lambda n: '- x\n' * (n // 4),
+    'whitespace after marker': lambda n: '- ' + ' ' * n + 'x',
+    'quotes': lambda n: '"' * n,
+}
+
+
+def legacy_extract(text):
+    """The extraction this module replaced, kept only to time it."""
+    match = re.search(r'\{[\s\S]*?\}(?=\s*$)', text.strip())
+    if match:
+        try:
+            return json.loads(match.group(0))
+        except json.JSONDecodeError:
+            pass
+    return re.findall(r'[-•]\s*([^\n]+)', text)
+
+
+def split(text, rng):
+    """text cut at random points into chunks of 1-12 characters, as a token stream arrives."""
+    chunks, i = [], 0
+    while i < len(text):
+        size = rng.randint(1, 12)
+        chunks.append(text[i:i + size])
+        i += size
+    return chunks
+
+
+def extract(chunks):
+    """(bullets returned while feeding plus any completed at close, final bullets or None)."""
+    extractor = StreamingBulletExtractor()
+    streamed = []
+    for chunk in chunks:
+        bullets = extractor.feed(chunk)
+        if extractor.reset:
+            streamed = []
+        streamed.extend(bullets)
+    try:
+        bullets = extractor.close()['bullets']
+    except ValueError:
+        return streamed, None
+    return streamed + bullets[len(streamed):], bullets
+
+
+def check_corpus(corpus, rounds, rng):
+    failures = []
+    for case in corpus:
+        for attempt in range(rounds):
+            chunks = [case['text']] if attempt == 0 else split(case['text'], rng)
+            streamed, bullets = extract(chunks)
+            if bullets != case['bullets']:
+                failures.append(f"{case['name']}: got {bullets} from chunks {chunks[:8]}...")
+                break
+            if bullets is not None and streamed != bullets:
+                failures.append(f"{case['name']}: streamed {streamed}, final {bullets}")
+                break
+    print(f"corpus: {len(corpus)} cases x {rounds} chunkings, {len(failures)} failures")
+    return failures
+
+
+def mutate(text, rng):
+    text = list(text)
+    for _ in range(rng.randint(1, 8)):
+        position = rng.randint(0, len(text))
+        operation = rng.random()
+        if operation < 0.4:
+            text.insert(position, rng.choice(_FUZZ_CHARS))
+        elif operation < 0.7:
+            del text[position:position + rng.randint(1, 20)]
+        else:
+            text[position:position] = text[position:position + rng.randint(1, 40)]
+    return ''.join(text)
+
+
+def check_mutations(corpus, rounds, rng):
+    failures = []
+    for _ in range(rounds):
+        text = mutate(rng.choice(corpus)['text'], rng)
+        try:
+            extract(split(text, rng))
+        except Exception as e:
+            failures.append(f"{type(e).__name__}: {e} on {text!r}")
+    print(f"mutations: {rounds} inputs, {len(failures)} unexpected errors")
+    return failures[:10]
+
+
+def best_time(run, text, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run(text)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def streamed(text):
+    extract([text[i:i + 4] for i in range(0, len(text), 4)])
+
+
+def check_scaling(size, legacy):
+    failures = []
+    small = max(size // 8, 1000)
+    print(f"{'input':<26}{'ns/char @' + str(small):>16}{'ns/char @' + str(size):>18}{'growth':>8}")
+    for name, make in PATHOLOGICAL.items():
+        costs = [best_time(streamed, make(n)) / n * 1e9 for n in (small, size)]
+        growth = costs[1] / costs[0]
+        print(f"{name:<26}{costs[0]:>16.0f}{costs[1]:>18.0f}{growth:>8.2f}")
+        if growth > LINEAR_SLACK:
+            failures.append(f"{name}: time per character grew {growth:.1f}x from {small} to {size} characters")
+    if legacy:
+        print('legacy regex extraction:')
+        for name, make in PATHOLOGICAL.items():
+            # The legacy pass is quadratic on several of these, so it is timed on far smaller inputs
+            costs = [best_time(legacy_extract, make(n), 1) / n * 1e9 for n in (1000, 8000)]
+            print(f"{name:<26}{costs[0]:>16.0f}{costs[1]:>18.0f}{costs[1] / costs[0]:>8.2f}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=200, help='Random chunkings per corpus case')
+    parser.add_argument('--mutations', type=int, default=5000)
+    parser.add_argument('--size', type=int, default=400000, help='Characters in the larger scaling input')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--legacy', action='store_true', help='Also time the regex extraction this replaced')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with open(CORPUS_PATH) as f:
+        corpus = json.load(f)
+    failures = check_corpus(corpus, args.rounds, rng)
+    failures += check_mutations(corpus, args.mutations, rng)
+    failures += check_scaling(args.size, args.legacy)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print('OK: corpus stable under chunking, no unexpected errors, linear on every pathological input')
+
+
+if __name__ == '__main__':
+    main()
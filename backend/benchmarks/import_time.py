@@ -0,0 +1,93 @@
+"""Import-time profile of backend.main, failing when cold start regresses past a budget.
+
+    python -m backend.benchmarks.import_time                  # best of 3 runs against the default budget
+    python -m backend.benchmarks.import_time --budget-ms 500 --top 20
+
+Exits non-zero when the import takes longer than the budget or pulls in a module that should
+only load on first use, so it can gate CI the same way a test would.
+"""
+import os
+import re
+import sys
+import argparse
+import tempfile
+import subprocess
+
+IMPORT_BUDGET_MS = float(os.getenv('IMPORT_BUDGET_MS', '750'))
+# Loaded on first use by providers.groq_sdk() and main.get_agent(), never at import
+DEFERRED_MODULES = ('groq', 'langchain_core', 'langchain_ollama', 'ollama', 'langsmith')
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def profile(module):
+    """[(name, depth, self_us, cumulative_us)] from one `python -X importtime` run in a clean directory."""
+    with tempfile.TemporaryDirectory() as directory:
+        # A scratch working directory keeps the stores the import creates out of the checkout
+        env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                cwd=directory, env=env, capture_output=True, text=True)
+    if result.returncode:
+        raise SystemExit(f"import {module} failed:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            rows.append((match.group(4), len(match.group(3)) // 2, int(match.group(1)), int(match.group(2))))
+    return rows
+
+
+def import_ms(rows, module):
+    return next(cumulative for name, _, _, cumulative in rows if name == module) / 1000
+
+
+def fastest(module, runs=3):
+    """The profile of the fastest of several runs, to damp noise."""
+    return min((profile(module) for _ in range(runs)), key=lambda rows: import_ms(rows, module))
+
+
+def failures(rows, module, budget_ms=IMPORT_BUDGET_MS):
+    """What is wrong with an import profile: deferred modules it loaded, or time over the budget."""
+    found = []
+    loaded = sorted({name.split('.')[0] for name, _, _, _ in rows} & set(DEFERRED_MODULES))
+    if loaded:
+        found.append(f"imported at startup but should load on first use: {', '.join(loaded)}")
+    total_ms = import_ms(rows, module)
+    if total_ms > budget_ms:
+        found.append(f"import took {total_ms:.1f} ms, over the {budget_ms:g} ms budget")
+    return found
+
+
+def report(rows, module, top):
+    total_ms = import_ms(rows, module)
+    print(f"import {module}: {total_ms:.1f} ms")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    # Direct imports of the module and the top-level packages they pulled in
+    shallow = [row for row in rows if row[1] <= 2 and row[0] != module]
+    for name, depth, self_us, cumulative in sorted(shallow, key=lambda row: -row[3])[:top]:
+        print(f"{cumulative / 1000:14.1f} {self_us / 1000:9.1f}  {'  ' * (depth - 1)}{name}")
+    return total_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--module', default='backend.main')
+    parser.add_argument('--budget-ms', type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument('--runs', type=int, default=3, help='The fastest run is reported, to damp noise')
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    best = fastest(args.module, args.runs)
+    report(best, args.module, args.top)
+
+    found = failures(best, args.module, args.budget_ms)
+    for failure in found:
+        print(f"FAIL: {failure}")
+    if found:
+        sys.exit(1)
+    print(f"OK: within the {args.budget_ms:g} ms budget")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,423 @@
+"""Load test of the generation endpoints against the stub LLM, compared with a stored baseline.
+
+    python -m backend.benchmarks.load                                   # every scenario, compared with baseline.json
+    python -m backend.benchmarks.load --scenarios bullets,tailor --concurrency 16 --requests 200
+    python -m backend.benchmarks.load --server wsgi --token-delay 0.005 --error-rate 0.05 --disconnect-rate 0.02
+    python -m backend.benchmarks.load --save-baseline                   # record this machine's numbers as the baseline
+    python -m backend.benchmarks.load --record --scenarios bullets      # capture a real Groq stream as a recording
+
+The stub (replaying backend/benchmarks/recordings) and the app each run in their own process, pointed at each
+other, and every scenario is driven by a fixed number of concurrent clients. Each request carries a unique payload
+and Cache-Control: no-cache, so the response cache and single-flight never answer in place of the upstream.
+Exits non-zero when throughput falls, or p95 latency or worker memory rises, by more than --tolerance against the
+baseline; baselines are only comparable between runs with the same settings on the same machine.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+
+import httpx
+
+from .stub_llm import RECORDINGS_DIR
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+# Relative growth in p95 latency or memory, or drop in throughput, tolerated before a run counts as a regression
+LOAD_TOLERANCE = float(os.getenv('LOAD_TOLERANCE', '0.25'))
+READY_TIMEOUT = 60
+MEMORY_SAMPLE_INTERVAL = 0.2
+
+
+def persona_payload(index):
+    return {'data': {
+        'name': f'Jordan Rivera {index}',
+        'experiences': 'Volunteer coordinator at a food bank; three years in retail; redesigned donation intake.',
+        'goals': 'Move into an operations coordinator role',
+        'generation_settings': json.dumps({'model': 'llama3-8b-8192', 'creativity': 0.5, 'realism': 0.5}),
+    }}
+
+
+def recommendations_payload(index):
+    return {'json': {
+        'company': f'Community Food Bank {index}', 'position': 'Volunteer Coordinator', 'industry': 'Nonprofit',
+        'situation': 'Holiday demand doubled while two staff were out.',
+        'task': 'Keep donation intake from falling behind.',
+        'actions': 'Built a tracking sheet and trained volunteers on a checklist.',
+        'results': 'Sorting time fell and waste dropped.',
+    }}
+
+
+def bullets_payload(index):
+    return {'json': {
+        'basic_info': {'company': f'Community Food Bank {index}', 'position': 'Volunteer Coordinator',
+                       'industry': ['Nonprofit']},
+        'star_content': recommendations_payload(index)['json'],
+    }}
+
+
+def tailor_payload(index):
+    return {'json': {
+        'basic_info': {'company': f'Community Food Bank {index}', 'position': 'Volunteer Coordinator',
+                       'industry': ['Nonprofit']},
+        'currentBullets': ['- Redesigned donation intake, cutting sorting time in half.',
+                           '- Trained 25 volunteers on a new intake checklist.'],
+        'targetPosition': {'title': 'Warehouse Operations Coordinator', 'company': 'Acme Logistics',
+                           'industry': 'Logistics', 'description': 'Inbound receiving, inventory accuracy, WMS.'},
+    }}
+
+
+# name: (path, payload for the index-th request)
+SCENARIOS = {
+    'persona': ('/generate_persona_stream', persona_payload),
+    'recommendations': ('/api/star/recommendations', recommendations_payload),
+    'bullets': ('/api/star/bullets', bullets_payload),
+    'tailor': ('/api/star/tailor', tailor_payload),
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(url, process):
+    deadline = time.monotonic() + READY_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f'{url} exited with status {process.returncode} before it was ready')
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f'{url} was not ready after {READY_TIMEOUT}s')
+
+
+def start_stub(args, env):
+    port = free_port()
+    config = {provider: {'first_token_delay': args.first_token_delay, 'token_delay': args.token_delay,
+                         'error_rate': args.error_rate, 'disconnect_rate': args.disconnect_rate}
+              for provider in ('groq', 'ollama')}
+    process = subprocess.Popen([sys.executable, '-m', 'backend.benchmarks.stub_llm', '--port', str(port),
+                                '--recordings', RECORDINGS_DIR, '--config', json.dumps(config)],
+                               env=env, stdout=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    wait_ready(f'{url}/api/tags', process)
+    return process, url
+
+
+def server_command(args, port):
+    bind = f'127.0.0.1:{port}'
+    if args.server == 'asgi':
+        return [sys.executable, '-m', 'uvicorn', 'backend.asgi:app', '--host', '127.0.0.1', '--port', str(port),
+                '--workers', str(args.workers), '--log-level', 'warning', '--no-access-log']
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        print('gunicorn is not installed; serving WSGI from one threaded werkzeug process instead', file=sys.stderr)
+        return [sys.executable, '-c', "import logging; logging.getLogger('werkzeug').setLevel(logging.WARNING); "
+                f"from backend.main import app; app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    return [sys.executable, '-m', 'gunicorn', '--preload', '--workers', str(args.workers), '--threads', str(args.threads),
+            '--bind', bind, '--log-level', 'warning', 'backend.main:create_app(preload=True)']
+
+
+def start_server(args, env, directory):
+    port = free_port()
+    process = subprocess.Popen(server_command(args, port), cwd=directory, env=env)
+    url = f'http://127.0.0.1:{port}'
+    wait_ready(f'{url}/api/ping', process)
+    return process, url
+
+
+def stop(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def process_tree(pid):
+    """pid and every descendant of it, from /proc; just [pid] where /proc is not available."""
+    children = {}
+    for entry in os.listdir('/proc') if os.path.isdir('/proc') else []:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces, so fields are counted from its closing parenthesis
+                parent = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, []))
+    return tree
+
+
+def rss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class MemorySampler:
+    """Peak resident memory of each process in a server's tree while a scenario runs."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.peaks = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='memory-sampler', daemon=True)
+
+    def sample(self):
+        for pid in process_tree(self.pid):
+            rss = rss_mb(pid)
+            if rss is not None:
+                self.peaks[pid] = max(self.peaks.get(pid, 0), rss)
+
+    def run(self):
+        while not self.stopped.wait(MEMORY_SAMPLE_INTERVAL):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self.sample()
+
+    def workers(self):
+        """Peak MiB per worker process; the server process itself when it has no children doing the work."""
+        workers = {pid: rss for pid, rss in self.peaks.items() if pid != self.pid}
+        # uvicorn and gunicorn masters only supervise; a multiprocessing helper is far smaller than any worker
+        largest = max(workers.values(), default=0)
+        workers = {pid: rss for pid, rss in workers.items() if rss >= largest / 2}
+        return workers or {pid: rss for pid, rss in self.peaks.items() if pid == self.pid}
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def drive(url, path, payload, count, concurrency, offset=0):
+    """Send count requests from concurrency closed-loop clients; returns [(seconds, status)]."""
+    results = []
+    lock = threading.Lock()
+    next_index = iter(range(offset, offset + count))
+    headers = {'Cache-Control': 'no-cache'}
+
+    def client():
+        with httpx.Client(base_url=url, timeout=300, headers=headers) as session:
+            while True:
+                with lock:
+                    index = next(next_index, None)
+                if index is None:
+                    return
+                started = time.perf_counter()
+                try:
+                    response = session.post(path, **payload(index))
+                    status = response.status_code
+                except httpx.HTTPError:
+                    status = 0
+                elapsed = time.perf_counter() - started
+                with lock:
+                    results.append((elapsed, status))
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def run_scenario(name, url, server_pid, args, offset):
+    path, payload = SCENARIOS[name]
+    drive(url, path, payload, args.warmup, min(args.concurrency, max(args.warmup, 1)), offset)
+    with MemorySampler(server_pid) as memory:
+        started = time.perf_counter()
+        results = drive(url, path, payload, args.requests, args.concurrency, offset + args.warmup)
+        elapsed = time.perf_counter() - started
+    latencies = [seconds * 1000 for seconds, status in results if status == 200]
+    errors = len(results) - len(latencies)
+    workers = memory.workers()
+    return {
+        'requests': len(results),
+        'errors': errors,
+        'error_rate': round(errors / len(results), 4) if results else 0,
+        'throughput_rps': round(len(latencies) / elapsed, 3),
+        'p50_ms': round(percentile(latencies, 0.5) or 0, 1),
+        'p95_ms': round(percentile(latencies, 0.95) or 0, 1),
+        'p99_ms': round(percentile(latencies, 0.99) or 0, 1),
+        'worker_rss_mb': [round(rss, 1) for _, rss in sorted(workers.items())],
+        'max_worker_rss_mb': round(max(workers.values(), default=0), 1),
+    }
+
+
+def settings(args):
+    return {
+        'server': args.server, 'workers': args.workers, 'threads': args.threads, 'concurrency': args.concurrency,
+        'requests': args.requests, 'first_token_delay': args.first_token_delay, 'token_delay': args.token_delay,
+        'error_rate': args.error_rate, 'disconnect_rate': args.disconnect_rate,
+    }
+
+
+def run(args):
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    stub, stub_url = start_stub(args, env)
+    env.update({
+        'GROQ_BASE_URL': stub_url, 'OLLAMA_BASE_URL': stub_url, 'GROQ_API_KEY': 'gsk_loadtest',
+        'OLLAMA_WARM_INTERVAL': '0', 'LOG_LEVEL': 'WARNING',
+    })
+    results = {}
+    try:
+        # A scratch working directory keeps the personas and caches the run creates out of the checkout
+        with tempfile.TemporaryDirectory() as directory:
+            server, url = start_server(args, env, directory)
+            try:
+                for offset, name in enumerate(args.scenarios):
+                    results[name] = run_scenario(name, url, server.pid, args, offset * 1_000_000)
+                    report_row(name, results[name])
+            finally:
+                stop(server)
+    finally:
+        stop(stub)
+    return {'settings': settings(args), 'machine': {'cpus': os.cpu_count(), 'python': platform.python_version()},
+            'scenarios': results}
+
+
+def report_header():
+    print(f"{'scenario':<16}{'req':>6}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  worker MiB")
+
+
+def report_row(name, result):
+    print(f"{name:<16}{result['requests']:>6}{result['errors']:>6}{result['throughput_rps']:>9.2f}"
+          f"{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}  "
+          f"{', '.join(f'{rss:.0f}' for rss in result['worker_rss_mb'])}", flush=True)
+
+
+def compare(current, baseline, tolerance):
+    """Regressions of current against baseline, as messages; empty when within tolerance."""
+    if baseline.get('settings') != current['settings']:
+        print('note: baseline was recorded with different settings, comparing anyway')
+    regressions = []
+    for name, result in current['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base:
+            continue
+        if result['throughput_rps'] < base['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {result['throughput_rps']:.2f} rps, baseline {base['throughput_rps']:.2f}")
+        if result['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['p95_ms']:.0f} ms, baseline {base['p95_ms']:.0f}")
+        if base['max_worker_rss_mb'] and result['max_worker_rss_mb'] > base['max_worker_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{name}: worker memory {result['max_worker_rss_mb']:.0f} MiB, baseline {base['max_worker_rss_mb']:.0f}")
+        if result['error_rate'] > base['error_rate'] + tolerance / 10:
+            regressions.append(f"{name}: error rate {result['error_rate']:.1%}, baseline {base['error_rate']:.1%}")
+    return regressions
+
+
+def record(names, directory):
+    """Capture one real generation per scenario, as the provider streamed it, into directory as recordings."""
+    from werkzeug.datastructures import MultiDict
+    from .. import generation
+    from ..llm import stream_chat
+
+    matches = {recording['name']: recording['match'] for recording in map(_read_recording, names)}
+    for name in names:
+        payload = SCENARIOS[name][1](0)
+        if name == 'persona':
+            form = MultiDict(payload['data'])
+            messages, params, api_key = generation.build_persona_request(form, json.loads(form['generation_settings']))
+            chunks = list(stream_chat(messages=messages, api_key=api_key, route=name, **params))
+        else:
+            messages = getattr(generation, f'build_{name}_messages')(payload['json'])
+            params = getattr(generation, f'{name.upper()}_PARAMS')
+            chunks = list(stream_chat(messages=messages, route=name, **params))
+        with open(os.path.join(directory, f'{name}.json'), 'w') as f:
+            json.dump({'name': name, 'match': matches[name], 'chunks': chunks}, f, indent=0)
+            f.write('\n')
+        print(f'recorded {name}: {len(chunks)} chunks')
+
+
+def _read_recording(name):
+    with open(os.path.join(RECORDINGS_DIR, f'{name}.json')) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), type=lambda value: value.split(','))
+    parser.add_argument('--server', choices=('asgi', 'wsgi'), default='asgi')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8, help='Threads per gunicorn worker')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=40, help='Measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=4, help='Unmeasured requests per scenario before measuring')
+    parser.add_argument('--first-token-delay', type=float, default=0.1)
+    parser.add_argument('--token-delay', type=float, default=0.002)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--disconnect-rate', type=float, default=0.0)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=LOAD_TOLERANCE)
+    parser.add_argument('--save-baseline', action='store_true', help='Write this run to --baseline instead of comparing')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    parser.add_argument('--record', action='store_true', help='Record real provider streams into the recordings directory')
+    args = parser.parse_args()
+
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    if args.record:
+        record(args.scenarios, RECORDINGS_DIR)
+        return
+
+    report_header()
+    current = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(current, f, indent=2)
+            f.write('\n')
+        print(f'baseline written to {args.baseline}')
+        return
+    if not os.path.exists(args.baseline):
+        print(f'no baseline at {args.baseline}; run with --save-baseline to record one')
+        return
+    with open(args.baseline) as f:
+        regressions = compare(current, json.load(f), args.tolerance)
+    for regression in regressions:
+        print(f'FAIL: {regression}')
+    if regressions:
+        sys.exit(1)
+    print(f'OK: within {args.tolerance:.0%} of the baseline')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Peak memory of listing every persona: the old jsonify'd list against the streamed endpoint.
+
+    python -m backend.benchmarks.persona_listing --personas 100000
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+from ..persona_store import PersonaStore
+
+TAG_SECTIONS = [
+    'qualificationsAndEducation', 'skills', 'goals', 'strengths',
+    'lifeExperiences', 'valueProposition', 'nextSteps', 'interests',
+]
+
+
+def make_persona(index):
+    persona = {'name': f'Persona {index}', 'summary': 'Adaptable organizer with a record of leading volunteer teams. ' * 2}
+    for section in TAG_SECTIONS:
+        persona[section] = [f'{section} tag {tag}, supporting detail' for tag in range(12)]
+    return persona
+
+
+def seed(store, count):
+    for index in range(count):
+        store.put(f'persona-{index:07d}', make_persona(index))
+        if index % 1000 == 999:
+            store.flush()
+    store.flush()
+
+
+def measure(label, run):
+    tracemalloc.start()
+    started = time.perf_counter()
+    size = run()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<28} peak {peak / 2**20:8.1f} MiB  {elapsed:6.2f}s  {size / 2**20:8.1f} MiB out")
+
+
+def list_all(store):
+    # What get_all_personas used to do: one list, one json.dumps
+    return len(json.dumps([{'id': persona_id, **persona} for persona_id, persona in store.all()]))
+
+
+def stream_ndjson(store, fields=None):
+    return sum(len(json.dumps({'id': persona_id, **persona}) + '\n')
+               for _, persona_id, persona in store.scan(fields=fields))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--personas', type=int, default=100000)
+    parser.add_argument('--db', help='Reuse an existing database instead of seeding a temporary one')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.db or os.path.join(directory, 'personas.sqlite')
+        store = PersonaStore(path=path)
+        if not args.db:
+            started = time.perf_counter()
+            seed(store, args.personas)
+            print(f"Seeded {args.personas} personas in {time.perf_counter() - started:.1f}s")
+
+        measure('full list (before)', lambda: list_all(store))
+        measure('ndjson stream', lambda: stream_ndjson(store))
+        measure('ndjson fields=name,summary', lambda: stream_ndjson(store, ['name', 'summary']))
+
+
+if __name__ == '__main__':
+    main()
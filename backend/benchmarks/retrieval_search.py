@@ -0,0 +1,89 @@
+"""Search latency of the retrieval index at a given number of chunks.
+
+    python -m backend.benchmarks.retrieval_search --chunks 100000
+"""
+import time
+import random
+import argparse
+import tempfile
+
+import numpy as np
+
+from ..retrieval import RetrievalIndex, RETRIEVAL_CHUNK_WORDS, RETRIEVAL_CHUNK_OVERLAP
+
+DOMAIN_WORDS = (
+    'logistics coordinator volunteer budget schedule relocation training supervised team family readiness '
+    'group events inventory customer service retail sales nursing patient care teaching classroom curriculum '
+    'software python data analysis spreadsheet reporting grant writing fundraising community outreach social '
+    'media marketing payroll accounting bookkeeping compliance safety deployment base housing childcare '
+    'tutoring mentoring leadership conflict resolution project management procurement vendor contracts'
+).split()
+# Word frequencies follow Zipf's law: a few filler words appear everywhere and content words, like the
+# domain words the queries use, sit in the long middle of the distribution
+VOCABULARY = [f'term{number}' for number in range(20000)]
+for position, word in enumerate(DOMAIN_WORDS):
+    VOCABULARY.insert(50 + position * 20, word)
+WEIGHTS = [1.0 / (rank + 1) for rank in range(len(VOCABULARY))]
+# Documents appended per transaction while building the index
+BATCH = 50
+
+QUERIES = [
+    'logistics coordinator inventory procurement',
+    'volunteer leadership family readiness group',
+    'python data analysis reporting',
+    'patient care nursing compliance',
+    'grant writing fundraising community outreach',
+]
+
+
+def make_document(rng, words):
+    return ' '.join(rng.choices(VOCABULARY, WEIGHTS, k=words))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chunks', type=int, default=100000)
+    parser.add_argument('--chunks-per-document', type=int, default=20)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--dir', help='Keep the index in this directory (reused if it already has enough chunks)')
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    words = args.chunks_per_document * (RETRIEVAL_CHUNK_WORDS - RETRIEVAL_CHUNK_OVERLAP) + RETRIEVAL_CHUNK_OVERLAP
+    with tempfile.TemporaryDirectory() as scratch:
+        directory = args.dir or scratch
+        index = RetrievalIndex(directory=directory)
+        started = time.perf_counter()
+        chunks = index.stats()['chunks']
+        document = chunks // args.chunks_per_document
+        while chunks < args.chunks:
+            batch = [('benchmark', str(document + offset), make_document(rng, words)) for offset in range(BATCH)]
+            chunks += index.add_many(batch)
+            document += BATCH
+        print(f"Indexed {index.stats()['chunks']} chunks in {time.perf_counter() - started:.1f}s")
+
+        # A fresh instance maps the files without reading them, like a newly started worker
+        started = time.perf_counter()
+        index = RetrievalIndex(directory=directory)
+        print(f"Opened index in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+        index.search(QUERIES[0], k=5)
+        latencies = []
+        for query_number in range(args.queries):
+            started = time.perf_counter()
+            index.search(QUERIES[query_number % len(QUERIES)], k=5)
+            latencies.append((time.perf_counter() - started) * 1000)
+        latencies = np.array(latencies)
+        print(f"search k=5: p50 {np.percentile(latencies, 50):.2f}ms  p99 {np.percentile(latencies, 99):.2f}ms")
+
+        latencies = []
+        for query_number in range(args.queries):
+            started = time.perf_counter()
+            index.search(QUERIES[query_number % len(QUERIES)], k=5, source='benchmark', source_id=str(query_number % document))
+            latencies.append((time.perf_counter() - started) * 1000)
+        latencies = np.array(latencies)
+        print(f"search within one document: p50 {np.percentile(latencies, 50):.2f}ms  p99 {np.percentile(latencies, 99):.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,413 @@
+"""Local stand-in for the Groq and Ollama HTTP APIs, with failure modes that can be switched at runtime.
+
+    python -m backend.benchmarks.stub_llm --port 8808      # serve; point GROQ_BASE_URL and OLLAMA_BASE_URL here
+    python -m backend.benchmarks.stub_llm --check          # run the provider failover checks against it
+
+    python -m backend.benchmarks.stub_llm --recordings backend/benchmarks/recordings --config '{"groq": {"token_delay": 0.002}}'
+
+Behaviour is changed by POSTing to /stub/config, e.g. {"groq": {"status": 429, "retry_after": 5}}; each
+provider takes status, retry_after, first_token_delay, token_delay, error_rate (share of calls answered with
+error_status) and disconnect_rate (share of streams cut off halfway), and "reply" sets the generated text.
+With --recordings, a call whose messages contain a recording's "match" text replays that recording's chunks
+instead of the reply, one chunk per token.
+"""
+import os
+import glob
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = 'Hello from the {provider} stub, streaming one word at a time.'
+RECORDINGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recordings')
+
+
+def default_config():
+    provider = {'status': 200, 'retry_after': None, 'first_token_delay': 0.0, 'token_delay': 0.0,
+                'error_rate': 0.0, 'error_status': 500, 'disconnect_rate': 0.0}
+    return {'groq': dict(provider), 'ollama': dict(provider), 'reply': DEFAULT_REPLY}
+
+
+def load_recordings(directory):
+    """[{'name', 'match', 'chunks'}] from every *.json recording in directory."""
+    recordings = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        with open(path) as f:
+            recordings.append(json.load(f))
+    return recordings
+
+
+class StubState:
+    def __init__(self, recordings=()):
+        self.lock = threading.Lock()
+        self.recordings = list(recordings)
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.config = default_config()
+            self.counts = {'groq': 0, 'ollama': 0, 'warm': 0}
+            self.injected = {'errors': 0, 'disconnects': 0}
+            self.replayed = {}
+            self.last_request = {}
+
+    def configure(self, changes):
+        with self.lock:
+            for key, value in changes.items():
+                if isinstance(value, dict):
+                    self.config[key].update(value)
+                else:
+                    self.config[key] = value
+
+    def _chunks(self, provider, body):
+        text = '\n'.join(str(message.get('content', '')) for message in body.get('messages') or [])
+        for recording in self.recordings:
+            if recording['match'] in text:
+                self.replayed[recording['name']] = self.replayed.get(recording['name'], 0) + 1
+                return recording['chunks']
+        words = self.config['reply'].replace('{provider}', provider).split(' ')
+        return [word + ' ' for word in words[:-1]] + words[-1:]
+
+    def begin(self, provider, body):
+        """The provider's config for this call, with injected faults decided, and the chunks to stream."""
+        with self.lock:
+            self.counts[provider] += 1
+            self.last_request[provider] = body
+            config = dict(self.config[provider])
+            if config['status'] == 200 and random.random() < config['error_rate']:
+                config['status'] = config['error_status']
+                self.injected['errors'] += 1
+            config['disconnect'] = config['status'] == 200 and random.random() < config['disconnect_rate']
+            if config['disconnect']:
+                self.injected['disconnects'] += 1
+            return config, self._chunks(provider, body)
+
+    def stats(self):
+        with self.lock:
+            return {'counts': dict(self.counts), 'injected': dict(self.injected), 'replayed': dict(self.replayed),
+                    'config': self.config, 'last_request': self.last_request}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def _chunk(self, data):
+        data = data.encode()
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+    def _refuse(self, provider, config):
+        if config['status'] == 200:
+            return False
+        headers = {'Retry-After': config['retry_after']} if config['retry_after'] else {}
+        if provider == 'groq':
+            payload = {'error': {'message': f"stub status {config['status']}", 'type': 'stub_error'}}
+        else:
+            payload = {'error': f"stub status {config['status']}"}
+        self._json(config['status'], payload, headers)
+        return True
+
+    def _tokens(self, chunks, config):
+        time.sleep(config['first_token_delay'])
+        for index, chunk in enumerate(chunks):
+            if index:
+                time.sleep(config['token_delay'])
+            yield chunk
+
+    def _streamed(self, chunks, config):
+        """True once every chunk is out; False when the stream is being cut off to simulate a dropped connection."""
+        if config['disconnect'] and chunks > 0:
+            self.close_connection = True
+            return False
+        return True
+
+    def do_GET(self):
+        if self.path == '/stub/stats':
+            self._json(200, self.state.stats())
+        elif self.path == '/api/tags':
+            self._json(200, {'models': [{'name': 'stub'}]})
+        else:
+            self._json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        body = self._body()
+        if self.path == '/stub/config':
+            self.state.configure(body)
+            self._json(200, self.state.stats()['config'])
+        elif self.path == '/stub/reset':
+            self.state.reset()
+            self._json(200, {})
+        elif self.path == '/openai/v1/chat/completions':
+            self._groq(body)
+        elif self.path == '/api/chat':
+            self._ollama(body)
+        elif self.path == '/api/generate':
+            # An empty generate only loads the model, which is what keep-warm pings send
+            with self.state.lock:
+                self.state.counts['warm'] += 1
+                self.state.last_request['warm'] = body
+            self._json(200, {'model': body.get('model'), 'response': '', 'done': True})
+        else:
+            self._json(404, {'error': 'not found'})
+
+    def _groq(self, body):
+        config, chunks = self.state.begin('groq', body)
+        if self._refuse('groq', config):
+            return
+        base = {'id': 'chatcmpl-stub', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                'model': body.get('model')}
+        if not body.get('stream'):
+            text = ''.join(self._tokens(chunks, config))
+            self._json(200, {**base, 'object': 'chat.completion', 'choices': [
+                {'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}]})
+            return
+        self._start_chunked('text/event-stream')
+        cut = len(chunks) // 2 if config['disconnect'] else len(chunks)
+        for token in self._tokens(chunks[:cut], config):
+            chunk = {**base, 'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]}
+            self._chunk(f'data: {json.dumps(chunk)}\n\n')
+        if not self._streamed(cut, config):
+            return
+        # Groq reports the call's usage on the final chunk; the stub counts one token per chunk
+        usage = {'prompt_tokens': 0, 'completion_tokens': cut, 'total_tokens': cut}
+        final = {**base, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}],
+                 'x_groq': {'id': 'req_stub', 'usage': usage}}
+        self._chunk(f'data: {json.dumps(final)}\n\n')
+        self._chunk('data: [DONE]\n\n')
+        self._end_chunked()
+
+    def _ollama(self, body):
+        config, chunks = self.state.begin('ollama', body)
+        if self._refuse('ollama', config):
+            return
+        self._start_chunked('application/x-ndjson')
+        cut = len(chunks) // 2 if config['disconnect'] else len(chunks)
+        for token in self._tokens(chunks[:cut], config):
+            self._chunk(json.dumps({'model': body.get('model'), 'message': {'role': 'assistant', 'content': token},
+                                    'done': False}) + '\n')
+        if not self._streamed(cut, config):
+            return
+        self._chunk(json.dumps({'model': body.get('model'), 'message': {'role': 'assistant', 'content': ''},
+                                'done': True, 'done_reason': 'stop', 'eval_count': cut}) + '\n')
+        self._end_chunked()
+
+
+def serve(host='127.0.0.1', port=0, recordings=()):
+    """Start the stub in a background thread and return (server, base_url)."""
+    handler = type('Handler', (StubHandler,), {'state': StubState(recordings)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='stub-llm', daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}'
+
+
+# Names of the cases check() runs, in order
+CHECK_CASES = ('healthy', 'rate limited', 'down', 'slow', 'exhausted', 'bad request', 'weighted', 'async',
+               'async chat', 'keep warm', 'replay', 'injected faults', 'usage')
+
+
+def check(names=CHECK_CASES):
+    """Exercise routing, failover and the circuit breaker against the stub; raises AssertionError on failure."""
+    server, url = serve(recordings=load_recordings(RECORDINGS_DIR))
+    state = server.RequestHandlerClass.state
+    # Providers read these at import, so set them before importing
+    os.environ.update({
+        'GROQ_BASE_URL': url, 'OLLAMA_BASE_URL': url, 'GROQ_API_KEY': 'stub', 'LLM_PROVIDERS': 'groq,ollama',
+        'LLM_BREAKER_FAILURES': '3', 'LLM_BREAKER_COOLDOWN': '1', 'LLM_SLOW_FIRST_TOKEN': '0.3',
+        'OLLAMA_WARM_INTERVAL': '0', 'LLM_SINGLE_FLIGHT': '0',
+    })
+    from ..providers import ProviderRouter, ProviderError, ProvidersUnavailable
+    request = {'messages': [{'role': 'user', 'content': 'hi'}], 'model': 'llama3-8b-8192',
+               'temperature': 0.5, 'max_tokens': 64, 'top_p': 1}
+
+    def run(router, route='persona'):
+        return ''.join(router.stream(route, request))
+
+    def case(name, body):
+        state.reset()
+        body(ProviderRouter())
+        print(f'ok  {name}')
+
+    def healthy(router):
+        assert 'groq stub' in run(router)
+        assert state.counts == {'groq': 1, 'ollama': 0, 'warm': 0}, state.counts
+
+    def rate_limited(router):
+        state.configure({'groq': {'status': 429, 'retry_after': 1}})
+        assert 'ollama stub' in run(router)
+        # Retry-After opens the circuit at once, so the next call skips Groq entirely
+        assert 'ollama stub' in run(router)
+        assert state.counts['groq'] == 1, state.counts
+        assert router.providers['groq'].breaker.state == 'open'
+        state.configure({'groq': {'status': 200, 'retry_after': None}})
+        time.sleep(1.1)
+        assert 'groq stub' in run(router)
+        assert router.providers['groq'].breaker.state == 'closed'
+
+    def down(router):
+        state.configure({'groq': {'status': 503}})
+        for _ in range(5):
+            assert 'ollama stub' in run(router)
+        assert state.counts['groq'] == 3, state.counts
+        assert router.stats()['failovers'] == 3
+
+    def slow(router):
+        state.configure({'groq': {'first_token_delay': 0.4}})
+        for _ in range(3):
+            assert 'groq stub' in run(router)
+        assert router.providers['groq'].breaker.state == 'open'
+        assert 'ollama stub' in run(router)
+        assert router.providers['groq'].stats()['slow'] == 3
+
+    def exhausted(router):
+        state.configure({'groq': {'status': 500}, 'ollama': {'status': 500}})
+        try:
+            run(router)
+        except ProvidersUnavailable as e:
+            assert e.status == 503
+        else:
+            raise AssertionError('expected ProvidersUnavailable')
+
+    def bad_request(router):
+        state.configure({'groq': {'status': 400}})
+        try:
+            run(router)
+        except ProviderError as e:
+            assert e.status == 400 and not e.retryable
+        else:
+            raise AssertionError('expected ProviderError')
+        assert state.counts['ollama'] == 0, state.counts
+
+    def weighted(router):
+        router.route_weights = {'tailor': {'groq': 0, 'ollama': 1}}
+        assert 'ollama stub' in run(router, 'tailor')
+        assert 'groq stub' in run(router, 'persona')
+
+    def asynchronous(router):
+        state.configure({'groq': {'status': 503}})
+
+        async def collect():
+            return ''.join([delta async for delta in await router.astream('bullets', request)])
+        assert 'ollama stub' in asyncio.run(collect())
+
+    def async_chat(router):
+        # The whole path the ASGI app streams through: admission, single-flight and the module's router
+        from .. import llm
+        state.configure({'groq': {'status': 503}})
+
+        async def collect():
+            return ''.join([delta async for delta in llm.astream_chat(route='bullets', **request)])
+        assert 'ollama stub' in asyncio.run(collect())
+
+    def keep_warm(router):
+        ollama = router.providers['ollama']
+        router.route_weights = {'persona': {'groq': 0, 'ollama': 1}}
+        run(router)
+        assert state.last_request['ollama']['keep_alive'] == ollama.keep_alive
+        ollama.warm()
+        assert state.counts['warm'] == 1
+
+    def replay(router):
+        recording = next(recording for recording in state.recordings if recording['name'] == 'tailor')
+        replayed = {**request, 'messages': [{'role': 'system', 'content': f"You are an {recording['match']}."}]}
+        assert ''.join(router.stream('tailor', replayed)) == ''.join(recording['chunks'])
+        assert state.replayed == {'tailor': 1}, state.replayed
+
+    def injected(router):
+        state.configure({'groq': {'error_rate': 1, 'error_status': 503}})
+        assert 'ollama stub' in run(router)
+        assert state.injected['errors'] == 1, state.injected
+        # A stream cut off after its first token cannot fail over, so the caller sees the error
+        state.configure({'groq': {'error_rate': 0}, 'ollama': {'disconnect_rate': 1}})
+        router.route_weights = {'persona': {'groq': 0, 'ollama': 1}}
+        try:
+            run(router)
+        except Exception:
+            pass
+        else:
+            raise AssertionError('expected the cut-off stream to raise')
+        assert state.injected['disconnects'] == 1, state.injected
+
+    def usage(router):
+        # Both providers hand back their own completion count, which is what sizes max_tokens
+        from .. import llm
+        for weights in ({'groq': 1, 'ollama': 0}, {'groq': 0, 'ollama': 1}):
+            router.route_weights = {'persona': weights}
+            reported = {}
+            chunks = list(router.stream('persona', request, usage=reported))
+            assert reported == {'completion_tokens': len(chunks), 'finish_reason': 'stop'}, reported
+
+            async def collect():
+                reported = {}
+                chunks = [delta async for delta in await router.astream('persona', request, usage=reported)]
+                return reported, len(chunks)
+            reported, count = asyncio.run(collect())
+            assert reported == {'completion_tokens': count, 'finish_reason': 'stop'}, reported
+        ''.join(llm.stream_chat(route='usage', **request))
+        assert len(llm.prompt_budget.routes['usage'].completions) == 1
+
+    cases = {'healthy': healthy, 'rate limited': rate_limited, 'down': down, 'slow': slow, 'exhausted': exhausted,
+             'bad request': bad_request, 'weighted': weighted, 'async': asynchronous, 'async chat': async_chat,
+             'keep warm': keep_warm, 'replay': replay, 'injected faults': injected,
+             'usage': usage}
+    try:
+        for name in names:
+            case(name, cases[name])
+    finally:
+        server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8808)
+    parser.add_argument('--check', nargs='*', metavar='CASE', help='Run the failover checks (all, or those named) and exit')
+    parser.add_argument('--recordings', help='Directory of recorded streams to replay')
+    parser.add_argument('--config', default='{}', help='Initial /stub/config body, as JSON')
+    args = parser.parse_args()
+    if args.check is not None:
+        check(args.check or CHECK_CASES)
+        return
+    server, url = serve(args.host, args.port, load_recordings(args.recordings) if args.recordings else ())
+    server.RequestHandlerClass.state.configure(json.loads(args.config))
+    print(f'Stub LLM server on {url}', flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
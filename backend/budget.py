@@ -0,0 +1,142 @@
+import os
+import re
+import json
+import math
+import logging
+import threading
+from collections import deque
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding('cl100k_base')
+except Exception:  # optional: fall back to the regex estimate below
+    _encoding = None
+
+# Observed completions kept per route, and how many are needed before adapting
+BUDGET_WINDOW = int(os.getenv('BUDGET_WINDOW', '200'))
+BUDGET_MIN_SAMPLES = int(os.getenv('BUDGET_MIN_SAMPLES', '20'))
+BUDGET_PERCENTILE = float(os.getenv('BUDGET_PERCENTILE', '99'))
+# Multiplier over the observed percentile, so typical outputs are never cut off
+BUDGET_HEADROOM = float(os.getenv('BUDGET_HEADROOM', '1.25'))
+BUDGET_FLOOR = int(os.getenv('BUDGET_FLOOR', '256'))
+
+MODEL_CONTEXT = {
+    'llama3-8b-8192': 8192,
+    'llama3-70b-8192': 8192,
+    'llama-3.1-8b-instant': 131072,
+    'llama-3.1-70b-versatile': 131072,
+    'mixtral-8x7b-32768': 32768,
+    'gemma2-9b-it': 8192,
+}
+DEFAULT_CONTEXT = 8192
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text: str) -> int:
+    """Local token count; exact with tiktoken installed, otherwise a close estimate."""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    # Words map to ~1 token per 4 characters, punctuation to one token each
+    return sum(max(1, math.ceil(len(piece) / 4)) for piece in _TOKEN_PATTERN.findall(text))
+
+
+def count_message_tokens(messages) -> int:
+    # Each chat message carries a few tokens of role/formatting overhead
+    return sum(count_tokens(message['content']) + 4 for message in messages)
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class RouteBudget:
+    def __init__(self):
+        self.completions = deque(maxlen=BUDGET_WINDOW)
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.truncated = 0
+        self.last_max_tokens = None
+
+
+class PromptBudget:
+    """Per-route completion-length tracking that sizes max_tokens from observed output.
+
+    Only completion counts the provider reports are used for sizing. The local count is an estimate (and
+    not the llama tokenizer even with tiktoken), so a route with no reported counts keeps its ceiling.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.lock = threading.Lock()
+
+    def _route(self, route):
+        budget = self.routes.get(route)
+        if budget is None:
+            budget = self.routes[route] = RouteBudget()
+        return budget
+
+    def max_tokens_for(self, route, ceiling, model, prompt_tokens):
+        """max_tokens for the next call: observed percentile plus headroom, within ceiling and context."""
+        with self.lock:
+            budget = self._route(route)
+            max_tokens = ceiling
+            if len(budget.completions) >= BUDGET_MIN_SAMPLES:
+                observed = _percentile(budget.completions, BUDGET_PERCENTILE)
+                max_tokens = min(ceiling, max(BUDGET_FLOOR, int(observed * BUDGET_HEADROOM)))
+            context = MODEL_CONTEXT.get(model, DEFAULT_CONTEXT)
+            max_tokens = max(1, min(max_tokens, context - prompt_tokens))
+            budget.last_max_tokens = max_tokens
+            return max_tokens
+
+    def record(self, route, prompt_tokens, completion_tokens, max_tokens, reported=False, finish_reason=None):
+        """Record one finished call.
+
+        reported marks completion_tokens as the provider's own count rather than a local estimate. Outputs
+        the provider stopped for length, or that reached max_tokens, count as truncated.
+        """
+        if finish_reason is not None:
+            truncated = finish_reason == 'length'
+        else:
+            truncated = completion_tokens >= max_tokens
+        with self.lock:
+            budget = self._route(route)
+            if reported:
+                # A truncated output needed at least the cap, which pushes the next one up
+                budget.completions.append(max(completion_tokens, max_tokens) if truncated else completion_tokens)
+            budget.requests += 1
+            budget.prompt_tokens += prompt_tokens
+            budget.completion_tokens += completion_tokens
+            if truncated:
+                budget.truncated += 1
+        logging.info(
+            f"Token usage route={route} prompt={prompt_tokens} completion={completion_tokens} "
+            f"max_tokens={max_tokens} reported={reported}"
+        )
+
+    def stats(self):
+        with self.lock:
+            report = {}
+            for route, budget in self.routes.items():
+                completions = list(budget.completions)
+                report[route] = {
+                    'requests': budget.requests,
+                    'prompt_tokens': budget.prompt_tokens,
+                    'completion_tokens': budget.completion_tokens,
+                    'truncated': budget.truncated,
+                    'last_max_tokens': budget.last_max_tokens,
+                    'completion_p50': _percentile(completions, 50) if completions else None,
+                    'completion_p99': _percentile(completions, 99) if completions else None,
+                    'completion_max': max(completions) if completions else None,
+                }
+            return report
+
+    def dump(self, path):
+        """Write the current stats as JSON for offline tuning."""
+        with open(path, 'w') as f:
+            json.dump(self.stats(), f, indent=2)
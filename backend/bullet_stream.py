@@ -0,0 +1,121 @@
+import re
+
+from .json_stream import StreamingJSONParser
+
+# A list marker at the start of a line: "-", "*" or "•", or "1." / "1)"; the model sometimes quotes the whole line
+_MARKER = re.compile(r'"?(?:[-*]\s+|•\s*|\d{1,2}[.)]\s+)')
+
+
+def clean_bullet(text: str) -> str:
+    """A bullet as the endpoints return it: unquoted and starting with "- "."""
+    text = text.strip().replace('\\"', '"').replace('"', '')
+    return text if text.startswith('-') else f"- {text}"
+
+
+class StreamingBulletExtractor:
+    """Pulls resume bullets out of LLM output as it streams, in one linear pass.
+
+    Two readings run side by side over the same chunks: a StreamingJSONParser looking
+    for a {"bullets": [...]} object, and a line scanner collecting list items that start
+    a line. Once a JSON object has begun, its "bullets" array wins and each element is
+    returned by ``feed`` as soon as its string closes; before that, every completed
+    list line is returned. Hyphens inside a sentence are never taken for bullets.
+
+    When a "bullets" array turns up after list lines were already returned, the JSON
+    reading supersedes them: ``reset`` is set on that call to ``feed``, and the bullets
+    it returns start the list over from the first JSON bullet.
+    """
+
+    def __init__(self):
+        self.json = StreamingJSONParser()
+        self.line = []
+        self.line_bullets = []
+        # How many of each reading's bullets feed has already returned
+        self.emitted_json = 0
+        self.emitted_lines = 0
+        self.reset = False
+
+    def feed(self, chunk: str) -> list:
+        """Consume a chunk and return the bullets it completed."""
+        self.reset = False
+        self._feed_json(chunk)
+        start = 0
+        while True:
+            end = chunk.find('\n', start)
+            if end < 0:
+                self.line.append(chunk[start:])
+                break
+            self.line.append(chunk[start:end])
+            self._end_line()
+            start = end + 1
+        return self._new_bullets()
+
+    def close(self) -> dict:
+        """Finish and return {"bullets": [...]}; raises ValueError when the output held no bullets."""
+        self._end_line()
+        self.json.close()
+        bullets = self._json_bullets()
+        if bullets is None:
+            bullets = self.line_bullets
+            if not bullets:
+                raise ValueError("No valid bullet points found in response")
+        return {"bullets": bullets}
+
+    def _feed_json(self, chunk):
+        start = 0
+        while start < len(chunk):
+            self.json.feed(chunk, start)
+            if not self.json.done or self._bullet_list() is not None:
+                return
+            # An object without bullets ("{Company}", a note to the user) is not the answer; look past it
+            start = self.json.consumed
+            self.json = StreamingJSONParser()
+            self.emitted_json = 0
+
+    def _end_line(self):
+        line = ''.join(self.line).strip()
+        self.line = []
+        match = _MARKER.match(line)
+        if match is None:
+            return
+        text = line[match.end():]
+        if line.startswith('"'):
+            text = text.rstrip(',').rstrip()
+        if text.strip('" '):
+            self.line_bullets.append(clean_bullet(text))
+
+    def _bullet_list(self):
+        """The JSON object's "bullets" array as parsed so far, or None."""
+        root = self.json.partial
+        if isinstance(root, dict) and isinstance(root.get('bullets'), list):
+            return root['bullets']
+        return None
+
+    def _json_bullets(self):
+        found = self._bullet_list()
+        if found is None:
+            return None
+        return [clean_bullet(bullet) for bullet in found if isinstance(bullet, str)]
+
+    def _new_bullets(self):
+        if self.json.partial is not None:
+            found = self._bullet_list()
+            if found is None:
+                return []
+            if self.emitted_lines:
+                # Only an object with a bullets array survives to close(), so the line bullets are gone for good
+                self.reset = True
+                self.emitted_lines = 0
+            items = found[self.emitted_json:]
+            self.emitted_json = len(found)
+            return [clean_bullet(bullet) for bullet in items if isinstance(bullet, str)]
+        items = self.line_bullets[self.emitted_lines:]
+        self.emitted_lines = len(self.line_bullets)
+        return items
+
+
+def extract_bullets(text: str) -> dict:
+    """{"bullets": [...]} from a complete LLM response; raises ValueError when it held none."""
+    extractor = StreamingBulletExtractor()
+    extractor.feed(text)
+    return extractor.close()
@@ -0,0 +1,189 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+RESPONSE_CACHE_BACKEND = os.getenv('RESPONSE_CACHE_BACKEND', 'memory')
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '86400'))
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '1024'))
+RESPONSE_CACHE_PATH = os.getenv('RESPONSE_CACHE_PATH', os.path.join('user_data', 'response_cache.sqlite'))
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_fields(value):
+    """Canonicalize request input so cosmetic whitespace differences share a cache entry."""
+    if isinstance(value, str):
+        return _WHITESPACE.sub(' ', value).strip()
+    if isinstance(value, dict):
+        return {k: normalize_fields(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize_fields(v) for v in value]
+    return value
+
+
+def make_cache_key(endpoint: str, params: dict, fields: dict) -> str:
+    """Content hash of an endpoint, its sampling params and its normalized input."""
+    canonical = json.dumps(
+        {'endpoint': endpoint, 'params': params, 'fields': normalize_fields(fields)},
+        sort_keys=True,
+        separators=(',', ':'),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class MemoryCacheBackend:
+    """In-process LRU with per-entry expiry."""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (time.time() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SQLiteCacheBackend:
+    """On-disk LRU shared by every worker on the host."""
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, max_entries=RESPONSE_CACHE_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS response_cache ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS response_cache_accessed ON response_cache (accessed_at)')
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._conn()
+        row = conn.execute('SELECT value, expires_at FROM response_cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if row[1] < now:
+            conn.execute('DELETE FROM response_cache WHERE key = ?', (key,))
+            conn.commit()
+            return None
+        conn.execute('UPDATE response_cache SET accessed_at = ? WHERE key = ?', (now, key))
+        conn.commit()
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        conn = self._conn()
+        now = time.time()
+        conn.execute(
+            'INSERT OR REPLACE INTO response_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+            (key, json.dumps(value), now + ttl, now)
+        )
+        conn.execute(
+            'DELETE FROM response_cache WHERE key IN ('
+            'SELECT key FROM response_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        )
+        conn.commit()
+
+    def __len__(self):
+        return self._conn().execute('SELECT COUNT(*) FROM response_cache').fetchone()[0]
+
+
+class ResponseCache:
+    """Cache of parsed LLM responses with hit/miss accounting."""
+
+    def __init__(self, backend, ttl=RESPONSE_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            logging.error(f"Response cache read failed: {str(e)}")
+            value = None
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def peek(self, key):
+        """Like get, without counting toward the hit rate."""
+        try:
+            return self.backend.get(key)
+        except Exception as e:
+            logging.error(f"Response cache read failed: {str(e)}")
+            return None
+
+    def set(self, key, value):
+        try:
+            self.backend.set(key, value, self.ttl)
+        except Exception as e:
+            logging.error(f"Response cache write failed: {str(e)}")
+
+    def record_bypass(self):
+        with self.lock:
+            self.bypasses += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'entries': len(self.backend),
+            'hits': self.hits,
+            'misses': self.misses,
+            'bypasses': self.bypasses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+def create_response_cache():
+    """Build the response cache selected by RESPONSE_CACHE_BACKEND."""
+    if RESPONSE_CACHE_BACKEND == 'sqlite':
+        return ResponseCache(SQLiteCacheBackend())
+    if RESPONSE_CACHE_BACKEND != 'memory':
+        logging.warning(f"Unknown RESPONSE_CACHE_BACKEND {RESPONSE_CACHE_BACKEND!r}, using memory")
+    return ResponseCache(MemoryCacheBackend())
@@ -0,0 +1,456 @@
+import os
+import json
+import time
+import asyncio
+import logging
+
+from werkzeug.datastructures import MultiDict
+
+from .cache import create_response_cache, make_cache_key
+from .semantic_cache import semantic_cache
+from .json_stream import StreamingJSONParser
+from .bullet_stream import StreamingBulletExtractor, extract_bullets
+from .streaming import sse_event
+from .prompt_registry import prompt_registry
+from .persona_store import PersonaStore
+from .ingest import UploadStore, UPLOAD_MAX_PROMPT_CHARS
+from .retrieval import get_retrieval_index
+from .jd_analysis import get_jd_analyzer
+from .log import log_payload
+from .metrics import record_stage, stage
+from .jobs import JobStore, JobRunner, JobFailed
+from .llm import stream_chat
+
+# Parsed responses of the /api/star/* endpoints, keyed by content hash
+response_cache = create_response_cache()
+
+# Generated personas, shared by every worker on the host
+persona_store = PersonaStore()
+
+# Uploaded resumes and their extracted text, content-addressed under user_data/uploads
+upload_store = UploadStore()
+
+# Queued persona generations, run by each worker's job threads (or processes) and followed over SSE
+job_store = JobStore()
+job_runner = JobRunner(job_store)
+
+# Uploads longer than this contribute their most relevant chunks to the prompt instead of the whole text
+RETRIEVAL_WHOLE_DOCUMENT_CHARS = int(os.getenv('RETRIEVAL_WHOLE_DOCUMENT_CHARS', '4000'))
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', '6'))
+DEFAULT_RESUME_QUERY = 'work experience skills education achievements goals'
+
+
+def index_document(source, source_id, text):
+    """Add a document to the retrieval index; indexing problems never fail the request."""
+    try:
+        get_retrieval_index().add(source, source_id, text)
+    except Exception as e:
+        logging.error(f"Failed to index {source} {source_id}: {str(e)}")
+
+
+def upload_prompt_text(upload_id, query):
+    """An upload's text for a prompt: whole when short, otherwise its chunks most relevant to query."""
+    text = upload_store.text(upload_id)
+    if len(text) <= RETRIEVAL_WHOLE_DOCUMENT_CHARS:
+        return text
+    index_document('upload', upload_id, text)
+    results = get_retrieval_index().search(query or DEFAULT_RESUME_QUERY, k=RETRIEVAL_TOP_K, source='upload', source_id=upload_id)
+    if not results:
+        return text[:UPLOAD_MAX_PROMPT_CHARS]
+    # Back in document order so the model reads the excerpts as the resume presents them
+    return '\n...\n'.join(result['text'] for result in sorted(results, key=lambda result: result['id']))[:UPLOAD_MAX_PROMPT_CHARS]
+
+
+def persona_text(persona):
+    return '\n'.join(
+        f"{key}: {', '.join(map(str, value)) if isinstance(value, list) else value}" for key, value in persona.items()
+    )
+
+RECOMMENDATIONS_PARAMS = {"model": "llama3-8b-8192", "temperature": 0.7, "max_tokens": 4000, "top_p": 0.8}
+BULLETS_PARAMS = {"model": "llama3-8b-8192", "temperature": 0.7, "max_tokens": 2000, "top_p": 0.8}
+# Lower temperature for more focused output
+TAILOR_PARAMS = {"model": "llama3-8b-8192", "temperature": 0.5, "max_tokens": 2000, "top_p": 0.7}
+
+# Per-request fan-out of /api/star/bullets/batch
+BATCH_MAX_PARALLEL = int(os.getenv('BATCH_MAX_PARALLEL', '4'))
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '20'))
+
+
+def lookup_cached_response(cache_key, data, cache_control=''):
+    """Return a cached response body, unless the client asked to regenerate."""
+    if 'no-cache' in cache_control or (data or {}).get('regenerate'):
+        response_cache.record_bypass()
+        return None
+    return response_cache.get(cache_key)
+
+
+def collect_json(deltas):
+    """Drain a delta stream, parsing JSON as it arrives; return (raw text, parsed object or None)."""
+    parser = StreamingJSONParser()
+    generated = ''
+    # Parsing is interleaved with generation, so only the parser's own share is timed as extraction
+    parsing = 0.0
+    for delta in deltas:
+        generated += delta
+        began = time.perf_counter()
+        parser.feed(delta)
+        parsing += time.perf_counter() - began
+    began = time.perf_counter()
+    parsed = parser.close()
+    record_stage('extract', parsing + time.perf_counter() - began)
+    return generated, parsed
+
+
+async def acollect_json(deltas):
+    """Async counterpart of collect_json."""
+    parser = StreamingJSONParser()
+    generated = ''
+    parsing = 0.0
+    async for delta in deltas:
+        generated += delta
+        began = time.perf_counter()
+        parser.feed(delta)
+        parsing += time.perf_counter() - began
+    began = time.perf_counter()
+    parsed = parser.close()
+    record_stage('extract', parsing + time.perf_counter() - began)
+    return generated, parsed
+
+
+def build_persona_request(form, generation_settings):
+    """Build the persona chat messages, sampling params and API key from the submitted form."""
+    input_text = "\n".join([
+        f"{key}: {', '.join(form.getlist(key)) if '[]' in key else form.get(key)}"
+        for key in form.keys() if key not in ('generation_settings', 'upload_id')
+    ])
+    if form.get('upload_id'):
+        # An uploaded resume stands in for pasting it into the form
+        resume = upload_prompt_text(form.get('upload_id'), input_text)
+        input_text = f"{input_text}\nresume: {resume}" if input_text else f"resume: {resume}"
+
+    log_payload('persona.input_text', input_text)
+
+    api_key = generation_settings.get('api_key') or os.environ.get("GROQ_API_KEY")
+    model = generation_settings.get('model', 'llama3-8b-8192')
+    creativity = float(generation_settings.get('creativity', 0.5))
+    realism = float(generation_settings.get('realism', 0.5))
+    custom_prompt = generation_settings.get('default_prompt', '')
+
+    messages = prompt_registry.get('persona').messages(input_text=input_text)
+    input_prompt = messages[-1]['content']
+
+    log_payload('persona.prompt', input_prompt)
+    logging.info(f"Using model: {model}")
+
+    params = {"model": model, "temperature": creativity, "max_tokens": 7000, "top_p": realism}
+    return messages, params, api_key
+
+
+def persona_result(generated_persona, parsed_data):
+    """Store a finished persona generation and return its response body and status."""
+    if parsed_data is None:
+        logging.error(f"Failed to parse generated persona. Raw response: {generated_persona}")
+        return {"error": "Failed to parse generated persona", "raw_response": generated_persona}, 500
+    persona_id = persona_store.create(parsed_data)
+    if isinstance(parsed_data, dict):
+        index_document('persona', persona_id, persona_text(parsed_data))
+    return {"persona": parsed_data, "id": persona_id}, 200
+
+
+def persona_events(deltas):
+    """Relay persona tokens as SSE, with a section event whenever a top-level member closes."""
+    parser = StreamingJSONParser()
+    generated_persona = ''
+    try:
+        for delta in deltas:
+            generated_persona += delta
+            yield sse_event('token', {'text': delta})
+            for key, value in parser.feed(delta):
+                yield sse_event('section', {'name': key, 'value': value})
+    except Exception as e:
+        yield _persona_error_event(e)
+        return
+    yield _persona_final_event(generated_persona, parser.close())
+
+
+async def apersona_events(deltas):
+    """Async counterpart of persona_events."""
+    parser = StreamingJSONParser()
+    generated_persona = ''
+    try:
+        async for delta in deltas:
+            generated_persona += delta
+            yield sse_event('token', {'text': delta})
+            for key, value in parser.feed(delta):
+                yield sse_event('section', {'name': key, 'value': value})
+    except Exception as e:
+        yield _persona_error_event(e)
+        return
+    # Storing and indexing the persona writes to SQLite and disk, so it runs off the event loop
+    yield await asyncio.to_thread(_persona_final_event, generated_persona, parser.close())
+
+
+def persona_job(payload, job):
+    """Run a queued persona generation, logging each section as it completes; returns the response body."""
+    form = MultiDict(payload['form'])
+    generation_settings = json.loads(form.get('generation_settings', '{}'))
+    messages, params, api_key = build_persona_request(form, generation_settings)
+    parser = StreamingJSONParser()
+    generated_persona = ''
+    for delta in stream_chat(messages=messages, api_key=api_key, route='persona', **params):
+        generated_persona += delta
+        job.report(chars=len(generated_persona))
+        for key, value in parser.feed(delta):
+            job.emit('section', {'name': key, 'value': value})
+    log_payload('persona.response', generated_persona)
+    result, status = persona_result(generated_persona, parser.close())
+    if status != 200:
+        raise JobFailed(result)
+    return result
+
+
+def _persona_error_event(e):
+    error = {'error': str(e)}
+    retry_after = getattr(e, 'retry_after', None)
+    if retry_after is not None:
+        error['retry_after'] = retry_after
+    else:
+        logging.exception(f"Error streaming persona: {str(e)}")
+    return sse_event('error', error)
+
+
+def _persona_final_event(generated_persona, parsed_data):
+    payload, status = persona_result(generated_persona, parsed_data)
+    if status != 200:
+        return sse_event('error', payload)
+    return sse_event('persona', payload)
+
+
+def recommendations_cache_key(data):
+    return make_cache_key('/api/star/recommendations', {**RECOMMENDATIONS_PARAMS, 'prompt_version': prompt_registry.version('recommendations')}, {
+        key: data.get(key) for key in ('company', 'position', 'industry', 'situation', 'task', 'actions', 'results')
+    })
+
+
+def build_recommendations_messages(data):
+    """Chat messages asking for STAR recommendations on the submitted experience."""
+    return prompt_registry.get('recommendations').messages(
+        company=data.get('company'),
+        position=data.get('position'),
+        industry=data.get('industry'),
+        situation=data.get('situation'),
+        task=data.get('task'),
+        actions=data.get('actions'),
+        results=data.get('results'),
+    )
+
+
+def recommendations_result(generated_response, parsed_data):
+    """Response body and status for a finished recommendations generation."""
+    if parsed_data is None:
+        logging.error(f"Failed to parse recommendations. Raw response: {generated_response}")
+        return {"error": "Failed to parse recommendations"}, 500
+    return {"recommendations": parsed_data}, 200
+
+
+def _industry_str(basic_info):
+    # Fix industry field handling
+    industry = basic_info.get('industry', [])
+    return ', '.join(industry) if isinstance(industry, list) else str(industry)
+
+
+def bullets_cache_key(data):
+    return make_cache_key('/api/star/bullets', {**BULLETS_PARAMS, 'prompt_version': prompt_registry.version('bullets')}, {
+        'basic_info': data.get('basic_info', {}),
+        'star_content': data.get('star_content', {})
+    })
+
+
+def build_bullets_messages(data):
+    """Chat messages asking for resume bullets from one STAR experience."""
+    # Extract STAR content and basic info
+    basic_info = data.get('basic_info', {})
+    star_content = data.get('star_content', {})
+    industry_str = _industry_str(basic_info)
+
+    messages = prompt_registry.get('bullets').messages(
+        company=basic_info.get('company', ''),
+        position=basic_info.get('position', ''),
+        industry=industry_str,
+        situation=star_content.get('situation', ''),
+        task=star_content.get('task', ''),
+        actions=star_content.get('actions', ''),
+        results=star_content.get('results', ''),
+    )
+
+    log_payload('bullets.prompt', messages[-1]['content'])
+
+    return messages
+
+
+def bullets_result(generated_response, error_message="Failed to parse generated bullets"):
+    """Response body and status for a finished bullets or tailor generation."""
+    try:
+        with stage('extract'):
+            return parse_bullets_response(generated_response), 200
+    except ValueError as e:
+        logging.error(f"Parsing error: {str(e)}")
+        return {
+            "error": error_message,
+            "raw_response": generated_response
+        }, 500
+
+
+def bullet_events(deltas, cache_key, route, error_message="Failed to parse generated bullets", data=None):
+    """Relay each bullet as SSE as soon as it is complete, then the full list, which is cached.
+
+    A "reset" event tells the client to drop the bullets shown so far: list lines came
+    first and a JSON object that replaces them followed.
+    """
+    extractor = StreamingBulletExtractor()
+    generated_response = ''
+    sent = 0
+    parsing = 0.0
+    try:
+        for delta in deltas:
+            generated_response += delta
+            began = time.perf_counter()
+            bullets = extractor.feed(delta)
+            parsing += time.perf_counter() - began
+            if extractor.reset:
+                yield sse_event('reset', {})
+                sent = 0
+            for bullet in bullets:
+                yield sse_event('bullet', {'index': sent, 'text': bullet})
+                sent += 1
+    except Exception as e:
+        yield _bullets_error_event(e)
+        return
+    yield from _bullets_final_events(extractor, generated_response, sent, parsing, cache_key, route, error_message, data)
+
+
+async def abullet_events(deltas, cache_key, route, error_message="Failed to parse generated bullets", data=None):
+    """Async counterpart of bullet_events."""
+    extractor = StreamingBulletExtractor()
+    generated_response = ''
+    sent = 0
+    parsing = 0.0
+    try:
+        async for delta in deltas:
+            generated_response += delta
+            began = time.perf_counter()
+            bullets = extractor.feed(delta)
+            parsing += time.perf_counter() - began
+            if extractor.reset:
+                yield sse_event('reset', {})
+                sent = 0
+            for bullet in bullets:
+                yield sse_event('bullet', {'index': sent, 'text': bullet})
+                sent += 1
+    except Exception as e:
+        yield _bullets_error_event(e)
+        return
+    # The final events store the response in the caches, which may write to SQLite
+    final_events = await asyncio.to_thread(
+        list, _bullets_final_events(extractor, generated_response, sent, parsing, cache_key, route, error_message, data)
+    )
+    for event in final_events:
+        yield event
+
+
+def cached_bullet_events(payload):
+    """The events bullet_events would have sent, for a cached response."""
+    for index, bullet in enumerate(payload.get('bullets', [])):
+        yield sse_event('bullet', {'index': index, 'text': bullet})
+    yield sse_event('bullets', {**payload, 'cache': 'HIT'})
+
+
+def _bullets_error_event(e):
+    error = {'error': str(e)}
+    retry_after = getattr(e, 'retry_after', None)
+    if retry_after is not None:
+        error['retry_after'] = retry_after
+    else:
+        logging.exception(f"Error streaming bullets: {str(e)}")
+    return sse_event('error', error)
+
+
+def _bullets_final_events(extractor, generated_response, sent, parsing, cache_key, route, error_message, data):
+    log_payload('bullets.response', generated_response)
+    began = time.perf_counter()
+    try:
+        payload = extractor.close()
+    except ValueError as e:
+        logging.error(f"Parsing error: {str(e)}")
+        yield sse_event('error', {"error": error_message, "raw_response": generated_response})
+        return
+    finally:
+        record_stage('extract', parsing + time.perf_counter() - began)
+    # A last line without a trailing newline only completes here
+    for index, bullet in enumerate(payload['bullets'][sent:], sent):
+        yield sse_event('bullet', {'index': index, 'text': bullet})
+    response_cache.set(cache_key, payload)
+    semantic_cache.add(route, data, payload)
+    yield sse_event('bullets', {**payload, 'cache': 'MISS'})
+
+
+def batch_items(data):
+    """Validate a /api/star/bullets/batch body and return its list of items."""
+    items = (data or {}).get('items')
+    if not isinstance(items, list) or not items:
+        raise ValueError("'items' must be a non-empty list of {basic_info, star_content} objects")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise ValueError(f"At most {BATCH_MAX_ITEMS} items can be generated in one batch")
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError("Each batch item must be an object with basic_info and star_content")
+    return items
+
+
+def batch_summary(results):
+    failed = sum(1 for result in results if 'error' in result)
+    return {'succeeded': len(results) - failed, 'failed': failed}
+
+
+def tailor_cache_key(data):
+    return make_cache_key('/api/star/tailor', {**TAILOR_PARAMS, 'prompt_version': prompt_registry.version('tailor')}, {
+        'basic_info': data.get('basic_info', {}),
+        'currentBullets': data.get('currentBullets', []),
+        'targetPosition': data.get('targetPosition', {})
+    })
+
+
+def build_tailor_messages(data):
+    """Chat messages asking to tailor existing bullets to a target position."""
+    # Extract all necessary data
+    basic_info = data.get('basic_info', {})
+    current_bullets = data.get('currentBullets', [])
+    target_position = data.get('targetPosition', {})
+    industry_str = _industry_str(basic_info)
+    # The distilled keywords of the posting, analyzed once per description, stand in for the whole text
+    keywords = [keyword['term'] for keyword in get_jd_analyzer().analyze(target_position.get('description', ''))['keywords']]
+
+    messages = prompt_registry.get('tailor').messages(
+        target_title=target_position.get('title', ''),
+        target_company=target_position.get('company', ''),
+        target_industry=target_position.get('industry', ''),
+        target_keywords=', '.join(keywords) or 'Not provided',
+        instructions=target_position.get('instructions', 'No special instructions provided'),
+        company=basic_info.get('company', ''),
+        position=basic_info.get('position', ''),
+        industry=industry_str,
+        current_bullets=current_bullets,
+    )
+
+    log_payload('tailor.prompt', messages[-1]['content'])
+
+    return messages
+
+
+def parse_bullets_response(response_text: str) -> dict:
+    """Parse the LLM response for bullet points."""
+    try:
+        return extract_bullets(response_text)
+    except ValueError as e:
+        logging.error(f"Error parsing bullets: {str(e)}")
+        raise ValueError(f"Failed to parse bullets: {str(e)}")
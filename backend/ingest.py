@@ -0,0 +1,244 @@
+import os
+import re
+import shutil
+import hashlib
+import logging
+import zipfile
+import tempfile
+import threading
+import subprocess
+from xml.etree import ElementTree
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import pypdf
+except ImportError:  # optional: PDF uploads are refused without it
+    pypdf = None
+
+UPLOAD_DIR = os.getenv('UPLOAD_DIR', os.path.join('user_data', 'uploads'))
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Extraction runs in separate processes so a pathological document cannot stall or crash a worker
+UPLOAD_EXTRACT_WORKERS = int(os.getenv('UPLOAD_EXTRACT_WORKERS', '2'))
+UPLOAD_EXTRACT_TIMEOUT = float(os.getenv('UPLOAD_EXTRACT_TIMEOUT', '20'))
+# Characters of an upload included in a prompt
+UPLOAD_MAX_PROMPT_CHARS = int(os.getenv('UPLOAD_MAX_PROMPT_CHARS', '20000'))
+
+ALLOWED_EXTENSIONS = {'txt', 'pdf', 'doc', 'docx'}
+
+_UPLOAD_ID = re.compile(r'^[0-9a-f]{64}$')
+_WORD_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+class UploadError(ValueError):
+    """An upload that was refused or whose text could not be extracted."""
+
+    def __init__(self, message, status=422):
+        super().__init__(message)
+        self.status = status
+
+
+class UploadNotFound(UploadError):
+    def __init__(self, upload_id):
+        super().__init__(f"Upload {upload_id!r} not found", 404)
+
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def sniff_kind(head: bytes) -> str:
+    """Document type from its leading bytes; the client's filename is not trusted for this."""
+    if head.startswith(b'%PDF'):
+        return 'pdf'
+    if head.startswith(b'PK\x03\x04'):
+        return 'docx'
+    if head.startswith(b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'):
+        return 'doc'
+    return 'txt'
+
+
+def _extract_txt(path):
+    with open(path, 'rb') as f:
+        raw = f.read()
+    for encoding in ('utf-8-sig', 'utf-16'):
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return raw.decode('latin-1')
+
+
+def _extract_docx(path):
+    with zipfile.ZipFile(path) as archive:
+        root = ElementTree.fromstring(archive.read('word/document.xml'))
+    paragraphs = []
+    for paragraph in root.iter(f'{_WORD_NAMESPACE}p'):
+        paragraphs.append(''.join(node.text or '' for node in paragraph.iter(f'{_WORD_NAMESPACE}t')))
+    return '\n'.join(paragraphs)
+
+
+def _extract_pdf(path):
+    if pypdf is None:
+        raise UploadError("PDF uploads require the pypdf package")
+    reader = pypdf.PdfReader(path)
+    return '\n'.join(page.extract_text() or '' for page in reader.pages)
+
+
+def _extract_doc(path):
+    if shutil.which('antiword'):
+        return subprocess.run(['antiword', path], capture_output=True, check=True, timeout=UPLOAD_EXTRACT_TIMEOUT).stdout.decode('utf-8', 'replace')
+    # Without antiword, recover the UTF-16 text runs that Word 97-2003 stores its body in
+    with open(path, 'rb') as f:
+        raw = f.read()
+    runs = re.findall(rb'(?:[\x20-\x7e\r\n\t]\x00){4,}', raw)
+    return '\n'.join(run.decode('utf-16-le').strip() for run in runs)
+
+
+EXTRACTORS = {'txt': _extract_txt, 'docx': _extract_docx, 'pdf': _extract_pdf, 'doc': _extract_doc}
+
+
+def extract_text(path, kind):
+    """Plain text of a stored document. Runs inside the extraction process pool."""
+    text = EXTRACTORS[kind](path)
+    # Collapse the runs of blank lines and trailing spaces extractors leave behind
+    text = re.sub(r'[ \t]+\n', '\n', text.replace('\r\n', '\n').replace('\r', '\n'))
+    return re.sub(r'\n{3,}', '\n\n', text).strip()
+
+
+class UploadStore:
+    """Content-addressed uploads under UPLOAD_DIR with their extracted text cached by hash."""
+
+    def __init__(self, directory=UPLOAD_DIR, max_bytes=UPLOAD_MAX_BYTES,
+                 workers=UPLOAD_EXTRACT_WORKERS, timeout=UPLOAD_EXTRACT_TIMEOUT):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.timeout = timeout
+        self.pool = None
+        self.pool_pid = None
+        self.lock = threading.Lock()
+        self.stored = 0
+        self.deduplicated = 0
+        self.extracted = 0
+        self.text_hits = 0
+        for name in ('blobs', 'text', 'tmp'):
+            os.makedirs(os.path.join(directory, name), exist_ok=True)
+
+    def _blob_path(self, upload_id):
+        return os.path.join(self.directory, 'blobs', upload_id[:2], upload_id)
+
+    def _text_path(self, upload_id):
+        return os.path.join(self.directory, 'text', upload_id[:2], upload_id + '.txt')
+
+    def save(self, stream, filename):
+        """Copy stream to the store a chunk at a time and return (upload_id, size, deduplicated)."""
+        if not allowed_file(filename or ''):
+            raise UploadError(f"Unsupported file type; allowed: {', '.join(sorted(ALLOWED_EXTENSIONS))}", 400)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.directory, 'tmp'))
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadError(f"Upload exceeds {self.max_bytes} bytes", 413)
+                    digest.update(chunk)
+                    out.write(chunk)
+            if not size:
+                raise UploadError("Upload is empty", 400)
+            upload_id = digest.hexdigest()
+            blob_path = self._blob_path(upload_id)
+            deduplicated = os.path.exists(blob_path)
+            if not deduplicated:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                os.replace(tmp_path, blob_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        with self.lock:
+            self.stored += 1
+            self.deduplicated += deduplicated
+        return upload_id, size, deduplicated
+
+    def _executor(self):
+        # Caller holds self.lock
+        if self.pool is None or self.pool_pid != os.getpid():
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+            self.pool_pid = os.getpid()
+        return self.pool
+
+    def _kill_pool(self, pool):
+        """Stop a pool whose worker is stuck; the next extraction starts a fresh one."""
+        with self.lock:
+            if self.pool is pool:
+                self.pool = None
+        # The executor has no public way to stop a running task, so terminate its processes directly
+        for process in list(getattr(pool, '_processes', {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _extract(self, blob_path, kind, retry=True):
+        with self.lock:
+            pool = self._executor()
+        future = pool.submit(extract_text, blob_path, kind)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            self._kill_pool(pool)
+            raise UploadError(f"Text extraction timed out after {self.timeout:g}s")
+        except BrokenProcessPool:
+            # Another request's timeout killed this pool underneath us
+            with self.lock:
+                if self.pool is pool:
+                    self.pool = None
+            if not retry:
+                raise UploadError("Text extraction failed")
+            return self._extract(blob_path, kind, retry=False)
+
+    def text(self, upload_id):
+        """Extracted text of an upload, computed at most once per distinct content."""
+        if not _UPLOAD_ID.match(upload_id or ''):
+            raise UploadNotFound(upload_id)
+        text_path = self._text_path(upload_id)
+        if os.path.exists(text_path):
+            with self.lock:
+                self.text_hits += 1
+            with open(text_path, encoding='utf-8') as f:
+                return f.read()
+        blob_path = self._blob_path(upload_id)
+        if not os.path.exists(blob_path):
+            raise UploadNotFound(upload_id)
+        with open(blob_path, 'rb') as f:
+            kind = sniff_kind(f.read(8))
+        try:
+            text = self._extract(blob_path, kind)
+        except UploadError:
+            raise
+        except Exception as e:
+            logging.error(f"Failed to extract text from upload {upload_id}: {str(e)}")
+            raise UploadError(f"Could not extract text from the {kind} file")
+        if not text:
+            raise UploadError("No text found in the uploaded document")
+        os.makedirs(os.path.dirname(text_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.directory, 'tmp'))
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, text_path)
+        with self.lock:
+            self.extracted += 1
+        return text
+
+    def stats(self):
+        with self.lock:
+            return {
+                'stored': self.stored,
+                'deduplicated': self.deduplicated,
+                'extracted': self.extracted,
+                'text_hits': self.text_hits,
+            }
@@ -0,0 +1,326 @@
+import os
+import re
+import json
+import math
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+from .cache import normalize_fields
+from .retrieval import STOPWORDS
+
+JD_ANALYSIS_DB_PATH = os.getenv('JD_ANALYSIS_DB_PATH', os.path.join('user_data', 'jd_analysis.sqlite'))
+# Analyses kept in each worker in front of the database, and in the database before the least recently used go
+JD_ANALYSIS_CACHE_SIZE = int(os.getenv('JD_ANALYSIS_CACHE_SIZE', '256'))
+JD_ANALYSIS_MAX_ENTRIES = int(os.getenv('JD_ANALYSIS_MAX_ENTRIES', '5000'))
+# Keywords kept per job description; the tailor prompt gets these instead of the description itself
+JD_KEYWORDS = int(os.getenv('JD_KEYWORDS', '30'))
+# Part of the description hash, so stored analyses are redone when the extraction below changes
+JD_ANALYZER_VERSION = '2'
+
+# Words that appear in nearly every job posting and name no skill
+JD_STOPWORDS = STOPWORDS | frozenset('''
+    about above across after against all also along am amp among and/or any apply applicants applicant
+    applications are around able ability abilities background based being benefits best between both
+    building but can candidate candidates collaborate company could daily day demonstrated desired do does
+    duties each eligible employer employment environment equal etc excellent excited exciting experience
+    experienced exposure familiar familiarity field following fast fast-paced full good great growing ensure
+    help highly how ideal if include includes including individual into job join just key knowledge least
+    level like looking make may meet more most motivated must need needs new nice not opportunity other our
+    out over paced passion passionate per plus position preferred proficiency proficient proven
+    qualifications qualified related relevant required requirements responsibilities responsible role
+    scheduled seeking should skills so some strong such team than them these they through time title
+    toward type understanding up us use used using various via we well what when where which while who
+    within without work working would write writing year years you your
+'''.split())
+
+# Verbs that open list items ("build dashboards", "maintain pipelines"); as a noun one can still end a
+# phrase, as in "product design"
+LEADING_VERBS = frozenset('''
+    analyze answer build builds create define deliver design develop drive identify implement improve lead
+    maintain manage own partner perform provide run support translate
+'''.split())
+# Adjectives that qualify a skill without naming one; never the first or last word of a keyword
+MODIFIERS = frozenset('''
+    advanced basic complex cross-functional effective hands-on high large modern multiple scalable senior
+    junior solid weekly
+'''.split())
+
+# Words, keeping the punctuation skill names carry: c++, c#, node.js, ci/cd, a/b
+_TOKEN = re.compile(r"[a-z0-9][a-z0-9+#./-]*[a-z0-9+#]|[a-z0-9]")
+# Sentence and list-item boundaries; keyphrases never span them
+_BOUNDARY = re.compile(r"[\n;:!?•()\[\]|,]|\.(?:\s|$)|\s[-–—]\s")
+_SUFFIXES = ('ings', 'ing', 'ed', 'es', 's')
+MAX_PHRASE_WORDS = 3
+# Phrases get this much more weight per extra word, since each occurs far less often than its words
+PHRASE_BOOST = 1.5
+
+SELECT_ANALYSIS = 'SELECT analysis FROM analyses WHERE hash = ?'
+TOUCH_ANALYSIS = 'UPDATE analyses SET used_at = ? WHERE hash = ?'
+
+
+def tokenize(text):
+    return [token.rstrip('./-') for token in _TOKEN.findall(text.lower())]
+
+
+def stem(word):
+    """Strip one inflection so "manage", "managing", "managed" and "manages" match; short words stay whole."""
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+            word = word[:-len(suffix)]
+            break
+    return word[:-1] if word.endswith('e') and len(word) >= 5 else word
+
+
+def stems(term):
+    return tuple(stem(word) for word in term.split())
+
+
+def description_hash(text):
+    canonical = normalize_fields(text or '').lower()
+    return hashlib.sha256(f'{JD_ANALYZER_VERSION}\0{canonical}'.encode('utf-8')).hexdigest()
+
+
+def candidate_terms(text):
+    """Term counts: every content word, and the 2-3 word runs of content words inside one sentence.
+
+    A term never starts with a leading verb or starts or ends with a modifier, so "write sql
+    queries" and "scalable data pipelines" count as "sql queries" and "data pipelines".
+    """
+    counts = Counter()
+    for sentence in _BOUNDARY.split(text.lower()):
+        run = []
+        for token in tokenize(sentence) + [None]:
+            # A token needs a letter: "3+" and "2024" name no skill
+            if token is not None and len(token) > 1 and token not in JD_STOPWORDS and re.search('[a-z]', token):
+                run.append(token)
+                continue
+            for start in range(len(run)):
+                if run[start] in LEADING_VERBS or run[start] in MODIFIERS:
+                    continue
+                for length in range(1, min(MAX_PHRASE_WORDS, len(run) - start) + 1):
+                    if run[start + length - 1] not in MODIFIERS:
+                        counts[' '.join(run[start:start + length])] += 1
+            run = []
+    return counts
+
+
+def rank_terms(counts, document_frequency, documents):
+    """(term, score) by TF-IDF, with document frequencies over every job description analyzed so far."""
+    idf = {}
+
+    def word_idf(word):
+        if word not in idf:
+            idf[word] = math.log((documents + 1) / (document_frequency.get(word, 0) + 1)) + 1
+        return idf[word]
+
+    def word_score(word):
+        return (1 + math.log(counts[word])) * word_idf(word)
+
+    scored = []
+    for term, count in counts.items():
+        words = term.split()
+        # A three-word run seen once is usually boilerplate ("highly motivated individual"), not a skill
+        if len(words) == MAX_PHRASE_WORDS and count < 2:
+            continue
+        # A phrase ranks by how much its words matter to the posting, and more when it recurs
+        weight = (1 + math.log(count)) * sum(word_score(word) for word in words) / len(words)
+        scored.append((term, weight * PHRASE_BOOST ** (len(words) - 1)))
+    scored.sort(key=lambda item: (-item[1], item[0]))
+    return scored
+
+
+def select_keywords(scored, counts, limit=JD_KEYWORDS):
+    """The top terms, leaving out a phrase every occurrence of which is inside a longer one already chosen.
+
+    Single words always stay: a posting asking for "etl pipelines" still asks for "etl".
+    """
+    chosen = []
+    for term, score in scored:
+        if len(chosen) == limit:
+            break
+        if len(term.split()) > 1 and any(len(other.split()) > len(term.split()) and f' {term} ' in f' {other} ' and counts[term] <= counts[other]
+               for other, _ in chosen):
+            continue
+        chosen.append((term, score))
+    top = chosen[0][1] if chosen else 1.0
+    return [{'term': term, 'weight': round(score / top, 4), 'count': counts[term]} for term, score in chosen]
+
+
+class JDAnalyzer:
+    """Job description keywords, analyzed once per distinct description and shared by every worker.
+
+    Each new description also adds its words to the document frequencies that later analyses
+    weigh terms by, so words every posting uses sink below the ones that set a posting apart.
+    """
+
+    def __init__(self, path=JD_ANALYSIS_DB_PATH, cache_size=JD_ANALYSIS_CACHE_SIZE, max_entries=JD_ANALYSIS_MAX_ENTRIES):
+        self.path = path
+        self.cache_size = cache_size
+        self.max_entries = max_entries
+        self.local = threading.local()
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS analyses ('
+            'hash TEXT PRIMARY KEY, analysis TEXT NOT NULL, created_at REAL NOT NULL, used_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS analyses_used_at ON analyses (used_at)')
+        # The empty term counts the descriptions themselves
+        conn.execute('CREATE TABLE IF NOT EXISTS document_frequency (term TEXT PRIMARY KEY, df INTEGER NOT NULL)')
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def analyze(self, description):
+        """{"hash", "keywords": [{"term", "weight", "count"}], "terms"} for a job description."""
+        key = description_hash(description)
+        with self.lock:
+            analysis = self.cache.get(key)
+            if analysis is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return analysis
+        conn = self._conn()
+        row = conn.execute(SELECT_ANALYSIS, (key,)).fetchone()
+        if row is not None:
+            conn.execute(TOUCH_ANALYSIS, (time.time(), key))
+            analysis = json.loads(row[0])
+            hit = True
+        else:
+            analysis, hit = self._analyze(conn, key, description or '')
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.cache[key] = analysis
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return analysis
+
+    def _analyze(self, conn, key, description):
+        counts = candidate_terms(description)
+        words = sorted({word for term in counts for word in term.split()})
+        # One writer at a time, so two workers analyzing the same posting count it once
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(SELECT_ANALYSIS, (key,)).fetchone()
+            if row is not None:
+                conn.execute('COMMIT')
+                return json.loads(row[0]), True
+            conn.executemany(
+                'INSERT INTO document_frequency (term, df) VALUES (?, 1) ON CONFLICT(term) DO UPDATE SET df = df + 1',
+                [('',)] + [(word,) for word in words]
+            )
+            frequency = {}
+            for start in range(0, len(words) + 1, 500):
+                batch = ([''] + words)[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                frequency.update(conn.execute(
+                    f'SELECT term, df FROM document_frequency WHERE term IN ({placeholders})', batch
+                ).fetchall())
+            documents = frequency.pop('', 1)
+            analysis = {
+                'hash': key,
+                'keywords': select_keywords(rank_terms(counts, frequency, documents), counts),
+                'terms': len(counts),
+                'documents': documents,
+            }
+            now = time.time()
+            conn.execute('INSERT INTO analyses (hash, analysis, created_at, used_at) VALUES (?, ?, ?, ?)',
+                         (key, json.dumps(analysis), now, now))
+            conn.execute(
+                'DELETE FROM analyses WHERE hash IN (SELECT hash FROM analyses ORDER BY used_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return analysis, False
+
+    def stats(self):
+        analyses = self._conn().execute('SELECT COUNT(*) FROM analyses').fetchone()[0]
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'analyses': analyses,
+                'cached': len(self.cache),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+def keyword_coverage(keywords, bullets):
+    """How many of a description's keywords the bullets contain, weighted and per bullet.
+
+    Keywords and bullets are compared as sets of stemmed words: a bullet covers a keyword when
+    it contains every word of it, in any order. All bullet-keyword pairs are scored in one
+    matrix product of bullet word presence against keyword word membership.
+    """
+    vocabulary = {}
+    keyword_stems = [stems(keyword['term']) for keyword in keywords]
+    for words in keyword_stems:
+        for word in words:
+            vocabulary.setdefault(word, len(vocabulary))
+    membership = np.zeros((len(keywords), len(vocabulary)), dtype=np.int32)
+    for row, words in enumerate(keyword_stems):
+        membership[row, [vocabulary[word] for word in set(words)]] = 1
+    presence = np.zeros((len(bullets), len(vocabulary)), dtype=np.int32)
+    for row, bullet in enumerate(bullets):
+        columns = {vocabulary[word] for word in map(stem, tokenize(bullet)) if word in vocabulary}
+        presence[row, list(columns)] = 1
+    matches = (presence @ membership.T) == membership.sum(axis=1)
+    weights = np.array([keyword['weight'] for keyword in keywords], dtype=np.float64)
+    covered = matches.any(axis=0)
+    total = weights.sum()
+    return {
+        'coverage': float(covered.mean()) if len(keywords) else 0.0,
+        'weighted_coverage': float(weights[covered].sum() / total) if total else 0.0,
+        'matched': [
+            {**keywords[column], 'bullets': np.nonzero(matches[:, column])[0].tolist()}
+            for column in np.nonzero(covered)[0].tolist()
+        ],
+        'missing': [keywords[column] for column in np.nonzero(~covered)[0].tolist()],
+        'bullets': [
+            {
+                'index': row,
+                'keywords': [keywords[column]['term'] for column in np.nonzero(matches[row])[0].tolist()],
+                'weighted_coverage': float(weights[matches[row]].sum() / total) if total else 0.0,
+            }
+            for row in range(len(bullets))
+        ],
+    }
+
+
+# Built on first use by get_jd_analyzer(), so importing the app creates nothing on disk
+jd_analyzer = None
+jd_analyzer_lock = threading.Lock()
+
+
+def get_jd_analyzer():
+    """The shared job description analyzer, opened the first time something needs it."""
+    global jd_analyzer
+    if jd_analyzer is None:
+        with jd_analyzer_lock:
+            if jd_analyzer is None:
+                jd_analyzer = JDAnalyzer()
+    return jd_analyzer
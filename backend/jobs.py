@@ -0,0 +1,450 @@
+"""Background jobs: a SQLite-backed queue shared by every worker on the host, and the pool that runs it.
+
+    python -m backend.jobs --workers 2      # run jobs in their own service, with JOB_EXECUTOR=external in the app
+
+A job is queued with its payload and claimed by a worker under a lease the worker keeps renewing. If that
+worker dies, the lease lapses and the job is claimed again, so queued and interrupted jobs survive restarts.
+Everything a job reports is appended to its event log, which /jobs/<id>/events replays from any point.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import signal
+import sqlite3
+import logging
+import argparse
+import importlib
+import threading
+import multiprocessing
+from contextlib import contextmanager
+
+from .scheduler import SchedulerRejected
+from .streaming import sse_event
+from .log import request_context
+
+JOBS_DB_PATH = os.getenv('JOBS_DB_PATH', os.path.join('user_data', 'jobs.sqlite'))
+# thread: worker threads in each app process; process: child processes of each app process;
+# external: none in the app, jobs run under `python -m backend.jobs`
+JOB_EXECUTOR = os.getenv('JOB_EXECUTOR', 'thread')
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+# Finished jobs, with their results and events, are kept this long
+JOB_RESULT_TTL = float(os.getenv('JOB_RESULT_TTL', '86400'))
+# A running job whose worker has not renewed its lease for this long is handed to another worker
+JOB_LEASE = float(os.getenv('JOB_LEASE', '60'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+# How often idle workers and event followers look for work queued by other processes
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '0.5'))
+# Progress is written at most this often; it also keeps proxies from closing quiet event streams
+JOB_PROGRESS_INTERVAL = 1.0
+JOB_KEEPALIVE = 15
+SWEEP_INTERVAL = 60
+
+# kind: "module:function" run with (payload, job); imported on first use so child processes can resolve them too
+JOB_HANDLERS = {
+    'persona': 'backend.generation:persona_job',
+}
+TERMINAL = ('done', 'failed')
+
+CLAIM_JOB = (
+    "SELECT id, kind, payload, attempts FROM jobs WHERE (status = 'queued' AND available_at <= ?) "
+    "OR (status = 'running' AND lease_until < ?) ORDER BY created_at LIMIT 1"
+)
+INSERT_EVENT = (
+    'INSERT INTO job_events (job_id, seq, event, data) '
+    'SELECT ?, COALESCE(MAX(seq), 0) + 1, ?, ? FROM job_events WHERE job_id = ?'
+)
+
+
+class JobFailed(Exception):
+    """A job that ran to completion without a usable result; payload is reported as its error."""
+
+    def __init__(self, payload):
+        super().__init__(payload.get('error', 'Job failed'))
+        self.payload = payload
+
+
+class JobStore:
+    """Jobs and their event logs in one SQLite file, safe to share between processes."""
+
+    def __init__(self, path=JOBS_DB_PATH, ttl=JOB_RESULT_TTL, lease=JOB_LEASE, max_attempts=JOB_MAX_ATTEMPTS):
+        self.path = path
+        self.ttl = ttl
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, payload TEXT, result TEXT, error TEXT, '
+            'progress TEXT, attempts INTEGER NOT NULL DEFAULT 0, idempotency_key TEXT UNIQUE, '
+            'created_at REAL NOT NULL, updated_at REAL NOT NULL, available_at REAL NOT NULL, '
+            'lease_until REAL, expires_at REAL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, available_at)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS job_events ('
+            'job_id TEXT NOT NULL, seq INTEGER NOT NULL, event TEXT NOT NULL, data TEXT NOT NULL, '
+            'PRIMARY KEY (job_id, seq))'
+        )
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            # isolation_level=None: transactions are explicit, so claiming can take the write lock up front
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def submit(self, kind, payload, idempotency_key=None):
+        """Queue a job and return its id; a repeated idempotency key returns the job it first created."""
+        conn = self._conn()
+        if idempotency_key:
+            row = conn.execute('SELECT id FROM jobs WHERE idempotency_key = ?', (idempotency_key,)).fetchone()
+            if row:
+                return row[0]
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        try:
+            conn.execute(
+                'INSERT INTO jobs (id, kind, status, payload, idempotency_key, created_at, updated_at, available_at) '
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), idempotency_key, now, now, now)
+            )
+        except sqlite3.IntegrityError:
+            # Another request with the same key got there first
+            return conn.execute('SELECT id FROM jobs WHERE idempotency_key = ?', (idempotency_key,)).fetchone()[0]
+        self.add_event(job_id, 'status', {'status': 'queued'})
+        return job_id
+
+    def get(self, job_id):
+        """The job's public state, or None if it does not exist or has expired."""
+        row = self._conn().execute(
+            'SELECT id, kind, status, result, error, progress, attempts, created_at, updated_at, expires_at '
+            'FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+        if row is None or (row[9] is not None and row[9] < time.time()):
+            return None
+        job = {'id': row[0], 'kind': row[1], 'status': row[2], 'attempts': row[6],
+               'created_at': row[7], 'updated_at': row[8], 'progress': json.loads(row[5]) if row[5] else {}}
+        if row[3] is not None:
+            job['result'] = json.loads(row[3])
+        if row[4] is not None:
+            job['error'] = json.loads(row[4])
+        return job
+
+    @contextmanager
+    def _transaction(self):
+        """The thread's connection inside BEGIN IMMEDIATE, committed together or rolled back."""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def claim(self):
+        """Take the oldest runnable job, or one whose worker's lease lapsed; returns (id, kind, payload, attempt)."""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(CLAIM_JOB, (now, now)).fetchone()
+            if row is None:
+                return None
+            job_id, kind, payload, attempts = row
+            exhausted = attempts >= self.max_attempts
+            if exhausted:
+                self._finish(conn, job_id, 'failed', error={'error': f'Gave up after {attempts} attempts'})
+            else:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, updated_at = ? "
+                    'WHERE id = ?', (now + self.lease, now, job_id)
+                )
+        if exhausted:
+            return self.claim()
+        return job_id, kind, json.loads(payload), attempts + 1
+
+    def add_event(self, job_id, event, data):
+        self._conn().execute(INSERT_EVENT, (job_id, event, json.dumps(data), job_id))
+
+    def events(self, job_id, after=0):
+        """[(seq, event, data)] logged for the job after seq."""
+        rows = self._conn().execute(
+            'SELECT seq, event, data FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq', (job_id, after)
+        ).fetchall()
+        return [(seq, event, json.loads(data)) for seq, event, data in rows]
+
+    def report_progress(self, job_id, progress):
+        now = time.time()
+        self._conn().execute(
+            'UPDATE jobs SET progress = ?, updated_at = ?, lease_until = ? WHERE id = ?',
+            (json.dumps(progress), now, now + self.lease, job_id)
+        )
+
+    def renew(self, job_ids):
+        if job_ids:
+            self._conn().executemany('UPDATE jobs SET lease_until = ? WHERE id = ?',
+                                     [(time.time() + self.lease, job_id) for job_id in job_ids])
+
+    def _finish(self, conn, job_id, status, result=None, error=None):
+        """Mark a job done or failed and log its final event; the caller holds a transaction on conn.
+
+        Both land in one commit, so a follower that sees the final status also sees the final event.
+        """
+        now = time.time()
+        # The payload can carry the caller's API key; it is not needed once the job can no longer run
+        conn.execute(
+            'UPDATE jobs SET status = ?, result = ?, error = ?, payload = NULL, lease_until = NULL, '
+            'updated_at = ?, expires_at = ? WHERE id = ?',
+            (status, None if result is None else json.dumps(result), None if error is None else json.dumps(error),
+             now, now + self.ttl, job_id)
+        )
+        conn.execute(INSERT_EVENT, (job_id, 'persona' if status == 'done' else 'error',
+                                    json.dumps(result if status == 'done' else error), job_id))
+
+    def complete(self, job_id, result):
+        with self._transaction() as conn:
+            self._finish(conn, job_id, 'done', result=result)
+
+    def fail(self, job_id, error):
+        with self._transaction() as conn:
+            self._finish(conn, job_id, 'failed', error=error)
+
+    def retry(self, job_id, delay, error):
+        """Put a job back on the queue after delay seconds, unless it is out of attempts."""
+        with self._transaction() as conn:
+            attempts = conn.execute('SELECT attempts FROM jobs WHERE id = ?', (job_id,)).fetchone()[0]
+            if attempts >= self.max_attempts:
+                self._finish(conn, job_id, 'failed', error=error)
+                return
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', available_at = ?, lease_until = NULL, updated_at = ? WHERE id = ?",
+                (now + delay, now, job_id)
+            )
+            event = {'status': 'queued', 'retry_after': delay, **error}
+            conn.execute(INSERT_EVENT, (job_id, 'status', json.dumps(event), job_id))
+
+    def sweep(self):
+        """Delete jobs, and their events, whose results have expired."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute('DELETE FROM job_events WHERE job_id IN (SELECT id FROM jobs WHERE expires_at < ?)', (now,))
+        return conn.execute('DELETE FROM jobs WHERE expires_at < ?', (now,)).rowcount
+
+    def stats(self):
+        rows = self._conn().execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        return dict(rows)
+
+
+class Job:
+    """What a handler sees of the job it runs: its id and a way to report progress."""
+
+    def __init__(self, store, job_id, attempt):
+        self.store = store
+        self.id = job_id
+        self.attempt = attempt
+        self.reported_at = 0.0
+        self.progress = {}
+
+    def emit(self, event, data):
+        """Append an event to the job's log, where every follower of the job will see it."""
+        self.store.add_event(self.id, event, data)
+
+    def report(self, **progress):
+        """Record progress; written at most once every JOB_PROGRESS_INTERVAL, which also renews the lease."""
+        self.progress.update(progress)
+        now = time.monotonic()
+        if now - self.reported_at >= JOB_PROGRESS_INTERVAL:
+            self.reported_at = now
+            self.store.report_progress(self.id, self.progress)
+
+
+def resolve_handler(kind):
+    module, _, function = JOB_HANDLERS[kind].partition(':')
+    return getattr(importlib.import_module(module), function)
+
+
+class JobRunner:
+    """Runs queued jobs in this process's worker threads, started on first use and again after a fork."""
+
+    def __init__(self, store, executor=JOB_EXECUTOR, workers=JOB_WORKERS):
+        self.store = store
+        self.executor = executor
+        self.workers = workers
+        self.pid = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.active = set()
+        self.processes = []
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+
+    def ensure_started(self):
+        if self.executor == 'external' or self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.active = set()
+            if self.executor == 'process':
+                self._start_processes()
+            else:
+                self.start_threads()
+
+    def start_threads(self):
+        for index in range(self.workers):
+            threading.Thread(target=self._work, name=f'job-worker-{index}', daemon=True).start()
+        threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True).start()
+
+    def _start_processes(self):
+        # spawn, not fork: a forked child would inherit this process's locks and connection pools mid-use
+        context = multiprocessing.get_context('spawn')
+        self.processes = [
+            context.Process(target=run_worker_process, args=(self.store.path, os.getpid()), name=f'job-worker-{index}',
+                            daemon=True)
+            for index in range(self.workers)
+        ]
+        for process in self.processes:
+            process.start()
+
+    def notify(self):
+        """Wake an idle worker in this process for a job just queued."""
+        self.wakeup.set()
+
+    def _work(self):
+        swept_at = 0.0
+        while not self.stopping.is_set():
+            try:
+                if time.monotonic() - swept_at > SWEEP_INTERVAL:
+                    swept_at = time.monotonic()
+                    self.store.sweep()
+                claimed = self.store.claim()
+            except sqlite3.Error as e:
+                logging.error(f"Job queue unavailable: {str(e)}")
+                claimed = None
+            if claimed is None:
+                self.wakeup.wait(JOB_POLL_INTERVAL)
+                self.wakeup.clear()
+                continue
+            self.run(*claimed)
+
+    def _heartbeat(self):
+        while not self.stopping.wait(self.store.lease / 3):
+            try:
+                self.store.renew(list(self.active))
+            except sqlite3.Error as e:
+                logging.error(f"Failed to renew job leases: {str(e)}")
+
+    def run(self, job_id, kind, payload, attempt):
+        request_context.set({'request_id': job_id, 'payloads': None})
+        job = Job(self.store, job_id, attempt)
+        self.active.add(job_id)
+        try:
+            if attempt > 1:
+                # Anything a client kept from the interrupted attempt is about to be reported again
+                job.emit('restart', {'attempt': attempt})
+            job.emit('status', {'status': 'running', 'attempt': attempt})
+            result = resolve_handler(kind)(payload, job)
+            if job.progress:
+                self.store.report_progress(job_id, job.progress)
+            self.store.complete(job_id, result)
+            self.completed += 1
+        except SchedulerRejected as e:
+            self.retried += 1
+            self.store.retry(job_id, e.retry_after, {'error': str(e)})
+        except JobFailed as e:
+            self.failed += 1
+            self.store.fail(job_id, e.payload)
+        except Exception as e:
+            logging.exception(f"Job {job_id} failed: {str(e)}")
+            self.failed += 1
+            self.store.fail(job_id, {'error': str(e)})
+        finally:
+            self.active.discard(job_id)
+            request_context.set({})
+
+    def stats(self):
+        return {
+            'executor': self.executor,
+            'workers': self.workers,
+            'running_here': len(self.active),
+            'completed': self.completed,
+            'failed': self.failed,
+            'retried': self.retried,
+            'jobs': self.store.stats(),
+        }
+
+
+def follow(store, job_id, after=0, poll_interval=JOB_POLL_INTERVAL, keepalive=JOB_KEEPALIVE):
+    """SSE frames for a job's events after seq, then live ones, until the job finishes.
+
+    Each event carries its seq as the SSE id, so a browser that reconnects with Last-Event-ID resumes
+    where it left off. Progress is sent whenever it changes but is not part of the log.
+    """
+    progress = None
+    quiet_since = time.monotonic()
+    while True:
+        job = store.get(job_id)
+        if job is None:
+            yield sse_event('error', {'error': 'Job not found or expired'})
+            return
+        for seq, event, data in store.events(job_id, after):
+            after = seq
+            quiet_since = time.monotonic()
+            yield sse_event(event, data, event_id=seq)
+        if job['status'] in TERMINAL:
+            # The final event was committed in the same transaction as the status, so it has just been sent
+            return
+        if job['progress'] != progress:
+            progress = job['progress']
+            yield sse_event('progress', progress)
+        elif time.monotonic() - quiet_since > keepalive:
+            quiet_since = time.monotonic()
+            yield ': keep-alive\n\n'
+        time.sleep(poll_interval)
+
+
+def run_worker_process(path, parent_pid, threads=1):
+    """Entry point of a JOB_EXECUTOR=process worker; exits when the app process that started it is gone."""
+    from .log import configure_logging
+    configure_logging()
+    runner = JobRunner(JobStore(path), executor='thread', workers=threads)
+    runner.ensure_started()
+    while os.getppid() == parent_pid:
+        time.sleep(1)
+    runner.stopping.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=JOB_WORKERS)
+    parser.add_argument('--db', default=JOBS_DB_PATH)
+    args = parser.parse_args()
+    from .log import configure_logging
+    configure_logging()
+    runner = JobRunner(JobStore(args.db), executor='thread', workers=args.workers)
+    runner.ensure_started()
+    logging.info(f"Running jobs from {args.db} with {args.workers} workers")
+    # Jobs still running at shutdown are picked up again once their leases lapse
+    signal.signal(signal.SIGTERM, lambda *_: runner.stopping.set())
+    try:
+        while not runner.stopping.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
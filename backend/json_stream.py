@@ -0,0 +1,193 @@
+import json
+import re
+
+_STRING_STOP = {
+    '"': re.compile(r'["\\]'),
+    "'": re.compile(r"['\\]"),
+}
+_ESCAPES = {'"': '"', "'": "'", '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+_LITERALS = {'true': True, 'false': False, 'null': None, 'True': True, 'False': False, 'None': None}
+_DELIMITERS = set('{}[],:"\'') | set(' \t\r\n')
+
+
+class StreamingJSONParser:
+    """Push-based JSON parser for LLM output that tolerates common formatting defects.
+
+    Text is fed in arbitrary chunks and consumed in a single linear pass. Anything
+    before the first '{' (prose, code fences) and after the root object closes is
+    ignored. Trailing or missing commas, single-quoted strings, unquoted keys and
+    Python-style literals are accepted. The object tree is built in place, so
+    ``partial`` can be read at any time, and ``feed`` returns each top-level member
+    as soon as its value is complete.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.done = False
+        self.stack = []
+        self.completed = []
+        # Index in the last chunk where parsing stopped; short of its length once the root object has closed
+        self.consumed = 0
+        # String/bare-word state carried across chunk boundaries
+        self.quote = None
+        self.string_parts = []
+        self.escape = None
+        self.word = []
+
+    @property
+    def partial(self):
+        """The object tree parsed so far (shared, not a copy)."""
+        return self.root
+
+    def feed(self, chunk: str, start: int = 0) -> list:
+        """Consume a chunk from start on and return the (key, value) root members it completed."""
+        self.completed = []
+        i, n = start, len(chunk)
+        while i < n and not self.done:
+            if self.quote is not None:
+                i = self._consume_string(chunk, i)
+                continue
+            ch = chunk[i]
+            if self.word and ch in _DELIMITERS:
+                self._end_word()
+            if not self.stack and self.root is None:
+                if ch == '{':
+                    self._open({})
+            elif ch == '{':
+                self._open({})
+            elif ch == '[':
+                self._open([])
+            elif ch in '}]':
+                self._close()
+            elif ch == ',':
+                self._comma()
+            elif ch == ':':
+                frame = self.stack[-1]
+                if frame[1] == 'colon':
+                    frame[1] = 'value'
+            elif ch in '"\'':
+                self.quote = ch
+                self.string_parts = []
+            elif ch not in ' \t\r\n`':
+                self.word.append(ch)
+            i += 1
+        self.consumed = i
+        return self.completed
+
+    def close(self):
+        """Finish parsing and return the root object, or None if it never closed."""
+        if self.word:
+            self._end_word()
+        return self.root if self.done else None
+
+    def _consume_string(self, chunk, i):
+        n = len(chunk)
+        if self.escape is not None:
+            i = self._consume_escape(chunk, i)
+            if self.escape is not None:
+                return i
+        match = _STRING_STOP[self.quote].search(chunk, i)
+        if match is None:
+            self.string_parts.append(chunk[i:])
+            return n
+        j = match.start()
+        self.string_parts.append(chunk[i:j])
+        if chunk[j] == '\\':
+            self.escape = ''
+            return j + 1
+        self.quote = None
+        self._value(''.join(self.string_parts), is_string=True)
+        return j + 1
+
+    def _consume_escape(self, chunk, i):
+        n = len(chunk)
+        while i < n:
+            self.escape += chunk[i]
+            i += 1
+            head = self.escape[0]
+            if head == 'u':
+                if len(self.escape) < 5:
+                    continue
+                try:
+                    self.string_parts.append(chr(int(self.escape[1:], 16)))
+                except ValueError:
+                    self.string_parts.append(self.escape)
+            else:
+                self.string_parts.append(_ESCAPES.get(head, head))
+            self.escape = None
+            break
+        return i
+
+    def _end_word(self):
+        word = ''.join(self.word)
+        self.word = []
+        frame = self.stack[-1] if self.stack else None
+        if frame is not None and isinstance(frame[0], dict) and frame[1] in ('key', 'comma'):
+            self._value(word, is_string=True)
+            return
+        if word in _LITERALS:
+            self._value(_LITERALS[word])
+            return
+        try:
+            self._value(json.loads(word))
+        except ValueError:
+            self._value(word)
+
+    def _comma(self):
+        frame = self.stack[-1]
+        if isinstance(frame[0], dict):
+            frame[1] = 'key'
+        else:
+            frame[1] = 'value'
+
+    def _attach(self, value, is_string=False):
+        """Place a value in the current container; return False if it was consumed as a key."""
+        if not self.stack:
+            return True
+        frame = self.stack[-1]
+        container, state = frame[0], frame[1]
+        if isinstance(container, list):
+            container.append(value)
+            frame[1] = 'comma'
+            return True
+        if state in ('key', 'comma'):
+            frame[2] = value if is_string else json.dumps(value)
+            frame[1] = 'colon'
+            return False
+        if frame[2] is None:
+            # Value with no key; nothing sensible to attach it to
+            return False
+        container[frame[2]] = value
+        frame[1] = 'comma'
+        return True
+
+    def _value(self, value, is_string=False):
+        if self._attach(value, is_string):
+            self._completed(value)
+
+    def _completed(self, value):
+        depth = len(self.stack)
+        if depth == 0:
+            self.done = True
+        elif depth == 1 and isinstance(self.stack[0][0], dict):
+            self.completed.append((self.stack[0][2], value))
+
+    def _open(self, container):
+        if self.root is None:
+            self.root = container
+        elif not self._attach(container):
+            container = {} if isinstance(container, dict) else []
+        self.stack.append([container, 'key' if isinstance(container, dict) else 'value', None])
+
+    def _close(self):
+        if not self.stack:
+            return
+        container = self.stack.pop()[0]
+        self._completed(container)
+
+
+def parse_json_text(text: str):
+    """Parse the first JSON object found in a complete LLM response, or return None."""
+    parser = StreamingJSONParser()
+    parser.feed(text)
+    return parser.close()
@@ -0,0 +1,136 @@
+import os
+import time
+
+from .providers import ProviderRouter, client_key, get_groq_client, get_async_groq_client
+from .singleflight import SingleFlight, AsyncSingleFlight, flight_key
+from .scheduler import AdmissionScheduler
+from .budget import PromptBudget, count_tokens, count_message_tokens
+from .metrics import observe_upstream, observe_completion, set_model
+
+# Identical concurrent generations share one upstream stream unless disabled
+LLM_SINGLE_FLIGHT = os.getenv('LLM_SINGLE_FLIGHT', '1') == '1'
+single_flight = SingleFlight()
+async_single_flight = AsyncSingleFlight()
+
+# Every upstream generation in this worker is admitted through here
+scheduler = AdmissionScheduler()
+# Observed completion lengths per route, used to size max_tokens
+prompt_budget = PromptBudget()
+# Chooses Groq or the local Ollama model for each call and fails over between them
+router = ProviderRouter()
+
+
+def _admission(route, messages, model, max_tokens):
+    """Prompt size and the adaptive max_tokens for a call; max_tokens passed in is the ceiling."""
+    prompt_tokens = count_message_tokens(messages)
+    return prompt_tokens, prompt_budget.max_tokens_for(route, max_tokens, model, prompt_tokens)
+
+
+def _start_stream(route, messages, model, temperature, max_tokens, top_p, api_key, admission=None):
+    prompt_tokens, max_tokens = _admission(route, messages, model, max_tokens)
+    queued = time.perf_counter()
+    ticket = scheduler.acquire(route, client_key(api_key), prompt_tokens + max_tokens, admission)
+    started = time.perf_counter()
+    observe_upstream(route, model, 'queue', started - queued)
+    request = dict(messages=messages, model=model, temperature=temperature, max_tokens=max_tokens, top_p=top_p)
+    usage = {}
+    try:
+        # Returns once the provider has produced its first delta
+        deltas = router.stream(route, request, api_key, usage)
+    except BaseException:
+        ticket.release()
+        raise
+    ttft = time.perf_counter() - started
+    observe_upstream(route, model, 'ttft', ttft)
+    return _finish_call(ticket, route, model, prompt_tokens, max_tokens, started, ttft, deltas, usage)
+
+
+def _record_usage(route, prompt_tokens, max_tokens, completion, usage):
+    """Record a finished call's tokens, preferring the provider's count to the local estimate."""
+    reported = usage.get('completion_tokens')
+    completion_tokens = reported if reported is not None else count_tokens(''.join(completion))
+    prompt_budget.record(route, prompt_tokens, completion_tokens, max_tokens,
+                         reported=reported is not None, finish_reason=usage.get('finish_reason'))
+    return completion_tokens
+
+
+def _finish_call(ticket, route, model, prompt_tokens, max_tokens, started, ttft, deltas, usage):
+    """Relay deltas, then free the scheduler slot and record token usage and timings."""
+    completion = []
+    try:
+        for delta in deltas:
+            completion.append(delta)
+            yield delta
+    finally:
+        ticket.release()
+    completion_tokens = _record_usage(route, prompt_tokens, max_tokens, completion, usage)
+    observe_completion(route, model, ttft, time.perf_counter() - started, completion_tokens)
+
+
+def stream_chat(messages, model, temperature, max_tokens, top_p, api_key=None, route=None):
+    """Return an iterator over the text deltas of a streamed chat completion.
+
+    The call waits for admission by the scheduler under the route's priority and is
+    served by whichever provider the router picks for the route.
+    Concurrent calls with the same prompt and sampling params attach to a single
+    upstream generation and all receive the same deltas.
+    """
+    api_key = api_key or os.environ.get("GROQ_API_KEY")
+    set_model(model)
+    request = dict(messages=messages, model=model, temperature=temperature, max_tokens=max_tokens, top_p=top_p)
+    if not LLM_SINGLE_FLIGHT:
+        return _start_stream(route=route, api_key=api_key, **request)
+    key = flight_key(api_key=client_key(api_key), **request)
+    # Shared with the flight, so a more urgent caller joining it while it is queued moves it up
+    admission = scheduler.admission(route)
+    return single_flight.stream(
+        key, lambda: _start_stream(route=route, api_key=api_key, admission=admission, **request), admission
+    )
+
+
+async def _astart_stream(route, messages, model, temperature, max_tokens, top_p, api_key, admission=None):
+    prompt_tokens, max_tokens = _admission(route, messages, model, max_tokens)
+    queued = time.perf_counter()
+    ticket = await scheduler.acquire_async(route, client_key(api_key), prompt_tokens + max_tokens, admission)
+    started = time.perf_counter()
+    observe_upstream(route, model, 'queue', started - queued)
+    request = dict(messages=messages, model=model, temperature=temperature, max_tokens=max_tokens, top_p=top_p)
+    usage = {}
+    try:
+        deltas = await router.astream(route, request, api_key, usage)
+    except BaseException:
+        ticket.release()
+        raise
+    ttft = time.perf_counter() - started
+    observe_upstream(route, model, 'ttft', ttft)
+    return _afinish_call(ticket, route, model, prompt_tokens, max_tokens, started, ttft, deltas, usage)
+
+
+async def _afinish_call(ticket, route, model, prompt_tokens, max_tokens, started, ttft, deltas, usage):
+    completion = []
+    try:
+        async for delta in deltas:
+            completion.append(delta)
+            yield delta
+    finally:
+        ticket.release()
+    completion_tokens = _record_usage(route, prompt_tokens, max_tokens, completion, usage)
+    observe_completion(route, model, ttft, time.perf_counter() - started, completion_tokens)
+
+
+def astream_chat(messages, model, temperature, max_tokens, top_p, api_key=None, route=None):
+    """Async counterpart of stream_chat; returns an async iterator over text deltas."""
+    api_key = api_key or os.environ.get("GROQ_API_KEY")
+    set_model(model)
+    request = dict(messages=messages, model=model, temperature=temperature, max_tokens=max_tokens, top_p=top_p)
+    admission = scheduler.admission(route)
+    start = lambda: _astart_stream(route=route, api_key=api_key, admission=admission, **request)
+    if not LLM_SINGLE_FLIGHT:
+        return _lazy_astream(start)
+    key = flight_key(api_key=client_key(api_key), **request)
+    return async_single_flight.stream(key, start, admission)
+
+
+async def _lazy_astream(start):
+    async for delta in await start():
+        yield delta
@@ -0,0 +1,215 @@
+import os
+import re
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+import traceback
+import contextvars
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# json for log collectors, text for reading in a terminal
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+# Records waiting for the writer thread; when full, new records are dropped rather than blocking a request
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+# Longest message written for an ordinary record
+LOG_MAX_CHARS = int(os.getenv('LOG_MAX_CHARS', '2000'))
+# Share of requests whose prompts, form data and model output are logged without opting in
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', '0'))
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv('LOG_PAYLOAD_MAX_CHARS', '1000'))
+# A request sending this header gets its payloads logged in full (up to LOG_VERBOSE_MAX_CHARS)
+LOG_VERBOSE_HEADER = os.getenv('LOG_VERBOSE_HEADER', 'X-Debug-Log')
+# When set, the header's value must match it; otherwise any of 1/true/payloads turns verbose logging on
+LOG_VERBOSE_TOKEN = os.getenv('LOG_VERBOSE_TOKEN')
+LOG_VERBOSE_MAX_CHARS = int(os.getenv('LOG_VERBOSE_MAX_CHARS', '100000'))
+
+REDACTED = '[REDACTED]'
+_SECRET_PATTERNS = [
+    # Groq and OpenAI-style keys wherever they appear
+    re.compile(r'\b(?:gsk|sk)_[A-Za-z0-9]{8,}'),
+    re.compile(r'(?i)\bBearer\s+[A-Za-z0-9._~+/-]+=*'),
+    # "api_key": "...", api_key=..., including inside JSON that was itself serialized into a string
+    re.compile(r'(?i)((?:api[_-]?key|authorization|password|secret|token)\\*"?\s*[:=]\s*\\*"?(?:Bearer\s+)?)[^"\\\s,}&]+'),
+]
+# Attributes every LogRecord has; anything else on a record came from extra= and is written as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+request_context = contextvars.ContextVar('request_context', default={})
+payload_logger = logging.getLogger('backend.payloads')
+
+_handler = None
+_lock = threading.Lock()
+
+
+def _env_secrets():
+    return [value for name, value in os.environ.items()
+            if value and len(value) >= 8 and re.search(r'(?i)(api_key|secret|token|password)', name)]
+
+
+def redact(text):
+    """text with API keys, bearer tokens and secret-looking fields masked."""
+    for secret in _env_secrets():
+        text = text.replace(secret, REDACTED)
+    text = _SECRET_PATTERNS[0].sub(REDACTED, text)
+    text = _SECRET_PATTERNS[1].sub(f'Bearer {REDACTED}', text)
+    return _SECRET_PATTERNS[2].sub(lambda match: match.group(1) + REDACTED, text)
+
+
+def truncate(text, limit):
+    if limit and len(text) > limit:
+        return f"{text[:limit]}... [{len(text) - limit} more chars]"
+    return text
+
+
+def _sampled():
+    return LOG_PAYLOAD_SAMPLE_RATE > 0 and random.random() < LOG_PAYLOAD_SAMPLE_RATE
+
+
+def begin_request(headers):
+    """Start the logging context of one request from its headers; returns its request id.
+
+    Sampling is decided here, once per request, so a sampled request logs its prompt and response together.
+    """
+    request_id = (headers.get('X-Request-ID') or headers.get('x-request-id') or uuid.uuid4().hex[:16])[:64]
+    flag = headers.get(LOG_VERBOSE_HEADER) or headers.get(LOG_VERBOSE_HEADER.lower()) or ''
+    if LOG_VERBOSE_TOKEN:
+        verbose = flag == LOG_VERBOSE_TOKEN
+    else:
+        verbose = flag.lower() in ('1', 'true', 'payloads')
+    payloads = 'verbose' if verbose else ('sampled' if _sampled() else None)
+    request_context.set({'request_id': request_id, 'payloads': payloads})
+    return request_id
+
+
+def log_payload(kind, payload):
+    """Log a prompt, form or model response if this request opted in or was sampled.
+
+    The decision is made before anything is serialized, so unlogged payloads cost nothing.
+    """
+    context = request_context.get()
+    mode = context['payloads'] if 'payloads' in context else ('sampled' if _sampled() else None)
+    if mode is None:
+        return
+    limit = LOG_VERBOSE_MAX_CHARS if mode == 'verbose' else LOG_PAYLOAD_MAX_CHARS
+    payload_logger.info(kind, extra={'payload': payload, 'payload_limit': limit})
+
+
+class ContextFilter(logging.Filter):
+    """Stamps records with the request id on the calling thread, before they cross the queue."""
+
+    def filter(self, record):
+        record.request_id = request_context.get().get('request_id')
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with secrets redacted and long text truncated."""
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': truncate(redact(record.getMessage()), LOG_MAX_CHARS),
+        }
+        if record.request_id:
+            entry['request_id'] = record.request_id
+        for key, value in vars(record).items():
+            if key in _RECORD_ATTRIBUTES or key in entry or key in ('request_id', 'payload_limit'):
+                continue
+            entry[key] = value
+        if 'payload' in entry:
+            payload = entry['payload']
+            text = payload if isinstance(payload, str) else json.dumps(payload, default=str)
+            entry['payload'] = truncate(redact(text), getattr(record, 'payload_limit', LOG_PAYLOAD_MAX_CHARS))
+        if record.exc_info:
+            entry['exc'] = redact(''.join(traceback.format_exception(*record.exc_info)))
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        message = truncate(redact(record.getMessage()), LOG_MAX_CHARS)
+        payload = getattr(record, 'payload', None)
+        if payload is not None:
+            text = payload if isinstance(payload, str) else json.dumps(payload, default=str)
+            message = f"{message}: {truncate(redact(text), getattr(record, 'payload_limit', LOG_PAYLOAD_MAX_CHARS))}"
+        line = f"{self.formatTime(record)} {record.levelname} {record.name} [{record.request_id or '-'}] {message}"
+        if record.exc_info:
+            line += '\n' + redact(''.join(traceback.format_exception(*record.exc_info)))
+        return line
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Hands records to a writer thread without formatting them and never blocks when it falls behind."""
+
+    def __init__(self, output, size=LOG_QUEUE_SIZE):
+        super().__init__(queue.Queue(size))
+        self.output = output
+        self.size = size
+        self.dropped = 0
+        self.listener = None
+        self.pid = None
+        self.start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        if self.pid == os.getpid():
+            return
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            # A forked worker inherits the queue but not the parent's writer thread
+            self.queue = queue.Queue(self.size)
+            self.listener = QueueListener(self.queue, self.output, respect_handler_level=False)
+            self.listener.start()
+            self.pid = os.getpid()
+
+    def prepare(self, record):
+        # Formatting, redaction and serialization all happen on the writer thread
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        if self.listener is not None and self.pid == os.getpid():
+            self.listener.stop()
+
+
+def configure_logging(level=LOG_LEVEL, stream=None):
+    """Route all logging through a bounded queue to one writer thread; safe to call more than once."""
+    global _handler
+    with _lock:
+        if _handler is not None:
+            return
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(TextFormatter() if LOG_FORMAT == 'text' else JsonFormatter())
+        _handler = DroppingQueueHandler(output)
+        _handler.addFilter(ContextFilter())
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_handler)
+        root.setLevel(level)
+        # Client libraries log every HTTP request they make; only their problems are worth a line
+        for name in ('httpx', 'httpcore', 'groq', 'urllib3'):
+            logging.getLogger(name).setLevel(max(logging.WARNING, root.level))
+        atexit.register(_handler.stop)
+
+
+def logging_stats():
+    return {
+        'queued': _handler.queue.qsize() if _handler else 0,
+        'dropped': _handler.dropped if _handler else 0,
+        'payload_sample_rate': LOG_PAYLOAD_SAMPLE_RATE,
+    }
@@ -1,5 +1,5 @@
 # app.py
-from flask import Flask, request, jsonify, Response, stream_with_context
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import os
@@ -8,13 +8,41 @@ from datetime import datetime
 # import sqlite3
 from dotenv import load_dotenv
 from .agent import Agent
+from .llm import stream_chat, single_flight, scheduler, prompt_budget, router
+from .providers import groq_sdk
+from .scheduler import SchedulerRejected
+from .json_stream import parse_json_text
+from .generation import (
+    response_cache, persona_store, upload_store, job_store, job_runner, index_document, lookup_cached_response, collect_json,
+    build_persona_request, persona_result, persona_events,
+    RECOMMENDATIONS_PARAMS, recommendations_cache_key, build_recommendations_messages, recommendations_result,
+    BULLETS_PARAMS, bullets_cache_key, build_bullets_messages, bullets_result, bullet_events, cached_bullet_events,
+    TAILOR_PARAMS, tailor_cache_key, build_tailor_messages,
+    BATCH_MAX_PARALLEL, batch_items, batch_summary,
+    parse_bullets_response,
+)
+from .streaming import sse_event
+from .jobs import JOB_HANDLERS, follow as follow_job
+from .speculation import speculator
+from .semantic_cache import semantic_cache
+from .jd_analysis import get_jd_analyzer, keyword_coverage
+from .prompt_registry import prompt_registry
+from .persona_store import PreconditionFailed
+from .patch import PatchError, apply_json_patch, apply_merge_patch
+from .ingest import UploadError
+from .retrieval import get_retrieval_index
+from .log import configure_logging, begin_request, log_payload, logging_stats, LOG_VERBOSE_HEADER
+from . import metrics
+from .metrics import stage
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import contextvars
 import logging
 import threading
 from queue import Queue
-from groq import Groq
 # import chromadb
 # from chromadb.config import Settings
 import re
+import base64
 import shutil
 import uuid
 # from sqlalchemy import create_engine
@@ -25,7 +53,7 @@ import traceback
 
 load_dotenv('.env.local')
 
-logging.basicConfig(level=logging.DEBUG)
+configure_logging()
 
 OLLAMA_BASE_URL = os.getenv('OLLAMA_BASE_URL')
 MODEL_NAME = os.getenv('MODEL_NAME', 'llama3')  # Add a default value
@@ -35,7 +63,6 @@ BASE_DIR = 'user_data'
 # DB_PATH = os.path.join(BASE_DIR, 'local_db.sqlite')
 
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
-ALLOWED_EXTENSIONS = {'txt', 'pdf', 'doc', 'docx'}
 
 # Clear existing Chroma database
 # if os.path.exists(CHROMA_DIR):
@@ -52,72 +79,115 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 # engine = create_engine(f'sqlite:///{DB_PATH}')
 # db_session = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
 
-# Create an event loop
-loop = asyncio.get_event_loop()
-
-# Use the event loop to create the agent
-agent = loop.run_until_complete(Agent.create("MainAgent", OLLAMA_BASE_URL, MODEL_NAME))
+# Built on first use by get_agent(); constructing it pulls in langchain
+agent = None
+agent_lock = threading.Lock()
 
 app = Flask(__name__)
 
+
+def get_agent():
+    """The shared Ollama agent, created the first time something needs it."""
+    global agent
+    if agent is None:
+        with agent_lock:
+            if agent is None:
+                agent = Agent("MainAgent", OLLAMA_BASE_URL, MODEL_NAME)
+    return agent
+
+
+def create_app(preload=False):
+    """The configured app. preload=True loads the slow-to-import SDKs up front, for gunicorn --preload.
+
+    Importing this module stays cheap: the Groq SDK and langchain are imported on first use. Under
+    --preload the master process loads them once instead and forked workers share those pages
+    copy-on-write, so no worker pays for the imports or holds its own copy.
+    """
+    if preload:
+        groq_sdk()
+        get_agent()
+    return app
+
 # Configure CORS at application level
 CORS(app, 
      resources={r"/*": {
          "origins": ["http://localhost:3000", "https://tcard.vercel.app"],
-         "methods": ["GET", "POST", "OPTIONS"],
-         "allow_headers": ["Content-Type", "Authorization"],
-         "expose_headers": ["Content-Type", "Authorization"],
+         "methods": ["GET", "POST", "PUT", "PATCH", "OPTIONS"],
+         "allow_headers": ["Content-Type", "Authorization", "If-Match", "If-None-Match", "X-Request-ID", "Idempotency-Key", LOG_VERBOSE_HEADER],
+         "expose_headers": ["Content-Type", "Authorization", "ETag", "X-Request-ID", "Server-Timing", "Location"],
          "supports_credentials": True,
          "max_age": 600  # Cache preflight requests for 10 minutes
      }})
 
+@app.before_request
+def start_request_logging():
+    g.request_id = begin_request(request.headers)
+    g.timings = metrics.begin_request(request.path if request.method == 'POST' else None)
+    # Queued jobs resume as soon as a restarted worker sees its first request
+    job_runner.ensure_started()
+
 # Add CORS headers to all responses
 @app.after_request
 def add_cors_headers(response):
+    response.headers['X-Request-ID'] = g.get('request_id', '')
+    timings = g.get('timings')
+    if timings is not None:
+        # Streamed responses only carry the stages finished before the first byte
+        response.headers['Server-Timing'] = timings.server_timing()
+        response.call_on_close(lambda: timings.finish(response.status_code))
     origin = request.headers.get('Origin')
     if origin in ['http://localhost:3000', 'https://tcard.vercel.app']:
         response.headers['Access-Control-Allow-Origin'] = origin
         response.headers['Access-Control-Allow-Credentials'] = 'true'
-        response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
-        response.headers['Access-Control-Expose-Headers'] = 'Content-Type, Authorization'
+        response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, PATCH, OPTIONS'
+        response.headers['Access-Control-Allow-Headers'] = f'Content-Type, Authorization, If-Match, If-None-Match, X-Request-ID, Idempotency-Key, {LOG_VERBOSE_HEADER}'
+        response.headers['Access-Control-Expose-Headers'] = 'Content-Type, Authorization, ETag, X-Request-ID, Server-Timing, Location'
+        response.headers['Timing-Allow-Origin'] = origin
     return response
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 # app.config['db_session'] = db_session
 
-# In-memory storage for personas
-personas = {}
-
 def extract_json(text):
-    # Find the first occurrence of '{' and the last occurrence of '}'
-    start = text.find('{')
-    end = text.rfind('}')
-    
-    if start != -1 and end != -1:
-        # Extract the JSON-like string
-        json_str = text[start:end+1]
-        
-        # Remove any leading/trailing whitespace
-        json_str = json_str.strip()
-        
-        # Attempt to parse the JSON
-        try:
-            return json.loads(json_str)
-        except json.JSONDecodeError:
-            # If parsing fails, attempt to fix common issues
-            # Replace single quotes with double quotes
-            json_str = json_str.replace("'", '"')
-            
-            # Ensure all keys are properly quoted
-            json_str = re.sub(r'(\w+)(?=\s*:)', r'"\1"', json_str)
-            
-            # Try parsing again
-            try:
-                return json.loads(json_str)
-            except json.JSONDecodeError:
-                return None
-    return None
+    """Parse the JSON object embedded in a complete LLM response, or return None."""
+    return parse_json_text(text)
+
+def wants_event_stream(settings):
+    """Whether the client asked for Server-Sent Events instead of a single JSON body."""
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        return True
+    if request.args.get('stream') in ('1', 'true'):
+        return True
+    return bool(settings.get('stream', False))
+
+def cached_lookup(cache_key, data):
+    return lookup_cached_response(cache_key, data, request.headers.get('Cache-Control', ''))
+
+def semantic_lookup(route, data):
+    return semantic_cache.lookup(route, data, request.headers.get('Cache-Control', ''))
+
+def rejected_response(e):
+    """429/503 with Retry-After for a call the scheduler would not admit."""
+    response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+    response.status_code = e.status
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+def event_stream(events):
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def timed_jsonify(payload):
+    with stage('serialize'):
+        return jsonify(payload)
+
+def cache_response(payload, status):
+    response = timed_jsonify(payload)
+    response.headers['X-Cache'] = status
+    return response
 
 @app.route('/generate_persona_stream', methods=['POST', 'OPTIONS'])
 def generate_persona_stream():
@@ -129,198 +199,241 @@ def generate_persona_stream():
         return response
 
     try:
-        data = request.form.to_dict(flat=False)
-        # Convert the dictionary to a MultiDict
-        multi_data = MultiDict(data)
+        app.logger.info("Received request for generate_persona_stream")
+        with stage('parse'):
+            form = request.form
+            generation_settings = json.loads(form.get('generation_settings', '{}'))
+        log_payload('persona.form', form.to_dict(flat=False))
 
-        input_text = "\n".join([
-            f"{key}: {', '.join(multi_data.getlist(key)) if '[]' in key else multi_data.get(key)}"
-            for key in multi_data.keys() if key != 'generation_settings'
-        ])
+        with stage('prompt'):
+            messages, params, api_key = build_persona_request(form, generation_settings)
 
-        app.logger.info("Received request for generate_persona_stream")
-        app.logger.info(f"Received data: {data}")
-        
-        app.logger.info(f"Constructed input text: {input_text}")
-        
-        generation_settings = json.loads(data.get('generation_settings', '{}'))
-        
-        api_key = generation_settings.get('api_key') or os.environ.get("GROQ_API_KEY")
-        model = generation_settings.get('model', 'llama3-8b-8192')
-        creativity = float(generation_settings.get('creativity', 0.5))
-        realism = float(generation_settings.get('realism', 0.5))
-        custom_prompt = generation_settings.get('default_prompt', '')
-        
-        system_prompt = """You are an Employment Readiness Professional Counselor, Mental Therapist, and Behavioral Analyst. Your task is to create a comprehensive profile card for job seekers, extracting and inferring as much valuable information as possible from their experiences and goals. Generate an extensive list of tags for each section, being concise yet insightful. Dig deep like a behavioral therapist would, uncovering hidden strengths, skills, and potential. Use the following format, aiming for at least 10-15 tags per section:
-
-- Name: [Full Name]
-- Summary: [A creative and insightful 2-3 sentence summary highlighting unique qualities and potential. Avoid using "profile" or their name.]
-
-</PersonalInfo>
-<QualificationsAndEducation>
-- [Relevant qualification/certification], [Key aspect]
-- [Educational background], [Notable achievement/skill gained]
-- [Additional training/course], [Practical application]
-...
-</QualificationsAndEducation>
-<Skills>
-- [Technical skill], [Proficiency level], [Practical application]
-- [Soft skill], [Context where developed], [Potential use in target field]
-- [Transferable skill], [Origin], [Relevance to career goals]
-...
-</Skills>
-<Goals>
-- [Career goal], [Motivation behind it], [Potential impact]
-- [Personal development goal], [Relevance to career], [Action plan]
-- [Learning objective], [Expected outcome], [Timeline]
-...
-</Goals>
-<Strengths>
-- [Core strength], [Evidence from experiences], [Potential application]
-- [Character trait], [How it manifests], [Value in target career]
-- [Unique strength], [Origin story], [Competitive advantage]
-...
-</Strengths>
-<LifeExperiences>
-- [Significant experience], [Skills developed], [Lessons learned]
-- [Challenge faced], [How overcome], [Personal growth]
-- [Unique life event], [Impact on worldview], [Relevance to career goals]
-...
-</LifeExperiences>
-<ValueProposition>
-- [Key value], [Supporting evidence], [Benefit to employer]
-- [Unique selling point], [What sets them apart], [Industry relevance]
-- [Personal mission], [Alignment with career goals], [Potential impact]
-...
-</ValueProposition>
-<NextSteps>
-- [Immediate action item], [Expected outcome], [Timeline]
-- [Medium-term goal], [Steps to achieve], [Potential obstacles]
-- [Long-term aspiration], [Milestones], [Resources needed]
-...
-</NextSteps>
-
-Be extremely thorough and creative in extracting and inferring information. Each tag should be concise yet packed with meaning. Draw connections between experiences, skills, and career goals. Highlight unique combinations of skills or experiences that could set the candidate apart."""
-
-        input_prompt = f"""
-Create a professional profile card for a job seeker using the following information. Be creative and insightful in extracting relevant skills, traits, and potential connections from their current experiences to their new career goals:
-{input_text}
-IMPORTANT: Your entire response must be a single, valid JSON object. Do not include any text outside of the JSON structure. Use the following structure, ensuring all keys and values are properly quoted:
-{{
-  "name": "Full Name",
-  "summary": "A creative and insightful 2-3 sentence summary",
-  "qualificationsAndEducation": [
-    "Relevant qualification/certification, Key aspect",
-    "Educational background, Notable achievement/skill gained",
-    "Additional training/course, Practical application"
-  ],
-  "skills": [
-    "Technical skill, Proficiency level, Practical application",
-    "Soft skill, Context where developed, Potential use in target field",
-    "Transferable skill, Origin, Relevance to career goals"
-  ],
-  "goals": [
-    "Career goal, Motivation behind it, Potential impact",
-    "Personal development goal, Relevance to career, Action plan",
-    "Learning objective, Expected outcome, Timeline"
-  ],
-  "strengths": [
-    "Core strength, Evidence from experiences, Potential application",
-    "Character trait, How it manifests, Value in target career",
-    "Unique strength, Origin story, Competitive advantage"
-  ],
-  "lifeExperiences": [
-    "Significant experience, Skills developed, Lessons learned",
-    "Challenge faced, How overcome, Personal growth",
-    "Unique life event, Impact on worldview, Relevance to career goals"
-  ],
-  "valueProposition": [
-    "Key value, Supporting evidence, Benefit to employer",
-    "Unique selling point, What sets them apart, Industry relevance",
-    "Personal mission, Alignment with career goals, Potential impact"
-  ],
-  "nextSteps": [
-    "Immediate action item, Expected outcome, Timeline",
-    "Medium-term goal, Steps to achieve, Potential obstacles",
-    "Long-term aspiration, Milestones, Resources needed"
-  ]
-}}
-Ensure all relevant information is included and formatted appropriately. If a section lacks direct information, creatively infer potential points based on the overall profile. Focus on highlighting the most transferable and relevant qualities for the person's career goals. You may include more than three items per section if needed.
-"""
-
-        app.logger.info(f"Constructed input prompt: {input_prompt}")
-
-        client = Groq(api_key=api_key)
-        app.logger.info(f"Using API key: {api_key[:5]}...{api_key[-5:]}")
-        app.logger.info(f"Using model: {model}")
-
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": input_prompt
-                }
-            ],
-            model=model,
-            temperature=creativity,
-            max_tokens=7000,
-            top_p=realism,
-            stream=True
-        )
-
-        generated_persona = ''
-        for chunk in chat_completion:
-            if chunk.choices[0].delta.content is not None:
-                generated_persona += chunk.choices[0].delta.content
-
-        app.logger.info(f"Generated persona: {generated_persona[:500]}...")  # Log first 500 characters
-
-        parsed_data = extract_json(generated_persona)
-        
-        if parsed_data is None:
-            logging.error(f"Failed to parse generated persona. Raw response: {generated_persona}")
-            return jsonify({"error": "Failed to parse generated persona", "raw_response": generated_persona}), 500
-
-        return jsonify({"persona": parsed_data})
+        deltas = stream_chat(messages=messages, api_key=api_key, route='persona', **params)
+
+        if wants_event_stream(generation_settings):
+            return Response(
+                stream_with_context(persona_events(deltas)),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+
+        generated_persona, parsed_data = collect_json(deltas)
 
+        log_payload('persona.response', generated_persona)
+
+        payload, status = persona_result(generated_persona, parsed_data)
+        return timed_jsonify(payload), status
+
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    except SchedulerRejected as e:
+        return rejected_response(e)
     except Exception as e:
         logging.error(f"Error in generate_persona_stream: {str(e)}")
         logging.error(traceback.format_exc())
         return jsonify({"error": str(e)}), 500
 
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue a persona generation and answer at once; the form is the one /generate_persona_stream takes."""
+    try:
+        kind = request.args.get('kind', 'persona')
+        if kind not in JOB_HANDLERS:
+            return jsonify({"error": f"Unknown job kind: {kind}"}), 400
+        form = request.form
+        log_payload('jobs.form', form.to_dict(flat=False))
+        # A retried POST with the same key gets the job the first one queued
+        job_id = job_store.submit(kind, {'form': form.to_dict(flat=False)}, request.headers.get('Idempotency-Key'))
+        job_runner.notify()
+        job = job_store.get(job_id)
+        response = jsonify({**job, 'status_url': f'/jobs/{job_id}', 'events_url': f'/jobs/{job_id}/events'})
+        response.status_code = 202
+        response.headers['Location'] = f'/jobs/{job_id}'
+        return response
+    except Exception as e:
+        logging.error(f"Error in submit_job: {str(e)}")
+        logging.error(traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Follow a job over SSE; a reconnecting EventSource resumes after its Last-Event-ID."""
+    if job_store.get(job_id) is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+    try:
+        after = int(request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0)
+    except ValueError:
+        return jsonify({"error": "Last-Event-ID must be an integer"}), 400
+    return event_stream(follow_job(job_store, job_id, after))
+
+@app.route('/api/uploads', methods=['POST'])
+def upload_document():
+    """Store a resume and extract its text; the returned upload_id can replace pasted text in persona generation.
+
+    Send either multipart form data with a `file` field, or the raw document as the body with ?filename=.
+    """
+    try:
+        if request.mimetype == 'multipart/form-data':
+            file = request.files.get('file')
+            if file is None or not file.filename:
+                return jsonify({'error': 'No file provided'}), 400
+            filename, stream = secure_filename(file.filename), file.stream
+        else:
+            # Raw bodies are read straight off the socket, so nothing is buffered beyond one chunk
+            filename, stream = secure_filename(request.args.get('filename', '')), request.stream
+
+        upload_id, size, deduplicated = upload_store.save(stream, filename)
+        text = upload_store.text(upload_id)
+        index_document('upload', upload_id, text)
+        return jsonify({
+            'upload_id': upload_id,
+            'filename': filename,
+            'bytes': size,
+            'characters': len(text),
+            'deduplicated': deduplicated,
+        })
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        app.logger.error(f"Error in upload_document: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/get_persona/<persona_id>', methods=['GET'])
 def get_persona(persona_id):
     try:
-        persona_data = personas.get(persona_id)
+        persona_data, etag = persona_store.get_with_etag(persona_id)
         if persona_data:
-            return jsonify(persona_data)
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                response = jsonify(persona_data)
+            response.set_etag(etag)
+            return response
         else:
             return jsonify({'error': 'Persona not found'}), 404
     except Exception as e:
         app.logger.error(f"Error in get_persona: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/update_persona/<persona_id>', methods=['PUT'])
+def patched_persona(document):
+    # A patch may replace the whole document ("path": ""), but a persona must stay an object
+    if not isinstance(document, dict):
+        raise PatchError("A patched persona must be a JSON object")
+    return document
+
+def persona_change(mimetype, body):
+    """The edit a request body describes, chosen by its Content-Type."""
+    if mimetype == 'application/json-patch+json':
+        return lambda persona: patched_persona(apply_json_patch(persona, body))
+    if mimetype == 'application/merge-patch+json':
+        if not isinstance(body, dict):
+            raise PatchError("A merge patch for a persona must be an object")
+        return lambda persona: apply_merge_patch(persona, body)
+    # Plain JSON keeps the original shallow update
+    if not isinstance(body, dict):
+        raise PatchError("Request body must be a JSON object")
+    return lambda persona: {**persona, **body}
+
+@app.route('/update_persona/<persona_id>', methods=['PUT', 'PATCH'])
 def update_persona(persona_id):
+    """Apply a shallow update, RFC 6902 JSON Patch or RFC 7396 merge patch, optionally guarded by If-Match."""
     try:
-        data = request.json
-        if persona_id in personas:
-            personas[persona_id].update(data)
-            return jsonify({'message': 'Persona updated successfully'})
-        else:
+        if_match = request.if_match if 'If-Match' in request.headers else None
+        change = persona_change(request.mimetype, request.get_json(force=True))
+        result = persona_store.modify(persona_id, change, if_match)
+        if result is None:
             return jsonify({'error': 'Persona not found'}), 404
+        response = jsonify({'message': 'Persona updated successfully'})
+        response.set_etag(result[1])
+        return response
+    except PreconditionFailed as e:
+        response = jsonify({'error': str(e)})
+        response.status_code = 412
+        response.set_etag(e.etag)
+        return response
+    except PatchError as e:
+        return jsonify({'error': str(e)}), 422
     except Exception as e:
         app.logger.error(f"Error in update_persona: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+PERSONA_PAGE_SIZE = int(os.getenv('PERSONA_PAGE_SIZE', '100'))
+PERSONA_MAX_PAGE_SIZE = int(os.getenv('PERSONA_MAX_PAGE_SIZE', '1000'))
+FIELD_NAME = re.compile(r'^\w+$')
+
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(str(position).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    if not cursor:
+        return 0
+    try:
+        return int(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode())
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+def persona_listing_args():
+    """Cursor position, page size (None for everything) and projected fields of a listing request."""
+    after = decode_cursor(request.args.get('cursor'))
+    limit = None
+    if 'limit' in request.args or 'cursor' in request.args:
+        try:
+            limit = int(request.args.get('limit', PERSONA_PAGE_SIZE))
+        except ValueError:
+            raise ValueError('limit must be an integer')
+        limit = max(1, min(limit, PERSONA_MAX_PAGE_SIZE))
+    fields = None
+    if request.args.get('fields'):
+        fields = [field.strip() for field in request.args['fields'].split(',') if field.strip()]
+        invalid = [field for field in fields if not FIELD_NAME.match(field)]
+        if invalid:
+            raise ValueError(f"Invalid field names: {', '.join(invalid)}")
+        # The id is always returned
+        fields = [field for field in fields if field != 'id']
+    return after, limit, fields
+
+def json_array(records):
+    """Encode records as one JSON array, a record at a time."""
+    yield '['
+    for index, record in enumerate(records):
+        yield (',' if index else '') + json.dumps(record)
+    yield ']'
+
 @app.route('/get_all_personas', methods=['GET'])
 def get_all_personas():
+    """List personas; ?limit/&cursor paginate, ?fields= projects, ?format=ndjson streams one record per line."""
     try:
-        return jsonify([{'id': id, **data} for id, data in personas.items()])
+        try:
+            after, limit, fields = persona_listing_args()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        ndjson = request.args.get('format') == 'ndjson' or 'application/x-ndjson' in request.headers.get('Accept', '')
+        rows = persona_store.scan(after, None if limit is None else limit + 1, fields)
+
+        if limit is not None:
+            # A page is bounded, so read one extra row to learn whether another page follows
+            rows = list(rows)
+            next_cursor = encode_cursor(rows[limit - 1][0]) if len(rows) > limit else None
+            records = [{'id': persona_id, **persona} for _, persona_id, persona in rows[:limit]]
+            if not ndjson:
+                return jsonify({'personas': records, 'next_cursor': next_cursor})
+            headers = {'X-Next-Cursor': next_cursor} if next_cursor else {}
+            return Response((json.dumps(record) + '\n' for record in records),
+                            mimetype='application/x-ndjson', headers=headers)
+
+        records = ({'id': persona_id, **persona} for _, persona_id, persona in rows)
+        if ndjson:
+            return Response(stream_with_context(json.dumps(record) + '\n' for record in records),
+                            mimetype='application/x-ndjson')
+        return Response(stream_with_context(json_array(records)), mimetype='application/json')
     except Exception as e:
         app.logger.error(f"Error in get_all_personas: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -336,175 +449,35 @@ def generate_star_recommendations():
         return jsonify({'status': 'success'})
 
     try:
-        data = request.json
-        
-        system_prompt = """You are an employment readiness provider specialist, behavioral therapist, and expert-level HR professional. Your task is to analyze provided content structured in the STAR (Situation, Task, Action, Result) format and create efficient, impactful, cumulative feedback for each section. This feedback should be presented in JSON format with 6-9 carefully prioritized recommendations per section, only if they truly add significant value. If the input is already high quality, the LLM should refrain from unnecessary suggestions and indicate that no major changes are needed.
-
-Key Guidelines:
-
-Prioritize High-Impact Feedback: Focus on the most effective, high-value suggestions that will greatly enhance the STAR response.
-Cumulative Improvement: Each recommendation must build on the previous one, creating a progressive series of enhancements.
-Avoid Generic Feedback: Do not use templated examples from the prompt unless they are relevant to the content provided.
-Content-Relevant Feedback: Ensure all examples and suggestions directly relate to the provided user input. If an example from the prompt applies, use it; otherwise, create specific, relevant examples.
-Limit to Valuable Suggestions: Only provide recommendations that significantly improve the content. If no further impactful improvements can be made, indicate that feedback is complete for that section.
-Output Structure: For each section (Situation, Task, Action, Result), create a JSON array with each recommendation containing:
-
-Title: A concise title summarizing the recommendation.
-Subtitle: An explanation of why this recommendation enhances the content.
-Original Content: The provided content for that STAR section.
-Examples: Two cumulative examples showing how the recommendation improves the content, with the core changes highlighted in bold. Only focus on the work experiences 
-Format Example:
-
-{
-  "situation": [
-    {
-      "title": "Principle: Specificity",
-      "subtitle": "Provide detailed context to highlight why the situation is significant and who it affects. This ensures the reader understands the stakes involved and the environment in which the action took place.",
-      "original_content": "Ruffian Corp was struggling to reach their goals of 20 million per store",
-      "examples": [
-        {
-          "example_1": "Ruffian Corp was struggling to hit their target of $20 million per store, **increasing pressure on store managers to cut costs** (added resulting effect).",
-          "example_2": "Ruffian Corp struggled to meet the $20 million per store target due to **inefficiencies and rising costs, straining store managers to find solutions** (included reasons and resulting impact)."
-        }
-      ]
-    },
-    {
-      "title": "Principle: Stakeholder Details",
-      "subtitle": "Include relevant stakeholders to show the complexity of the situation and accountability. This adds depth and clarifies who is involved or impacted by the challenge.",
-      "original_content": "Ruffian Corp was struggling to reach their goals of 20 million per store",
-      "examples": [
-        {
-          "example_1": "Ruffian Corp's $20 million per store goal challenged **store and regional managers to reassess budgets** (added key stakeholders).",
-          "example_2": "Ruffian Corp’s goal put **store managers, finance teams, and supply chain staff** under pressure to collaborate on cost-saving measures (included more stakeholders for depth)."
-        }
-      ]
-    }
-  ],
-  "task": [
-    {
-      "title": "Principle: Clarify Responsibility",
-      "subtitle": "Clearly define what your role entailed and how it was connected to the overall goal. This makes your contribution and accountability clear.",
-      "original_content": "I was responsible for overseeing the project.",
-      "examples": [
-        {
-          "example_1": "I was responsible for **leading a cross-functional team to meet project milestones** (clarified role and action).",
-          "example_2": "I was responsible for **coordinating a team of 10 to align with strategic goals** (added team detail and alignment)."
-        }
-      ]
-    },
-    {
-      "title": "Principle: Impact Linkage",
-      "subtitle": "Connect your task to broader organizational or project objectives to demonstrate the importance of your work in the larger context.",
-      "original_content": "I was responsible for overseeing the project.",
-      "examples": [
-        {
-          "example_1": "I led a team to ensure milestones were met, **aligning with annual growth targets** (linked task to organizational goals).",
-          "example_2": "I oversaw the project to contribute to a **15% efficiency boost** (added specific target linkage)."
-        }
-      ]
-    }
-  ],
-  "action": [
-    {
-      "title": "Principle: Specific Steps",
-      "subtitle": "Detail specific actions to show your active involvement and the effort you put into achieving results.",
-      "original_content": "I led the project team and made sure everything ran smoothly.",
-      "examples": [
-        {
-          "example_1": "I **scheduled weekly meetings and addressed roadblocks** to maintain progress (added specific actions).",
-          "example_2": "I **created detailed plans and assigned tasks** to adhere to timelines (included task assignment)."
-        }
-      ]
-    },
-    {
-      "title": "Principle: Demonstrate Leadership",
-      "subtitle": "Showcase leadership by emphasizing how you took the initiative or guided the team effectively.",
-      "original_content": "I led the project team and made sure everything ran smoothly.",
-      "examples": [
-        {
-          "example_1": "I **initiated an agile workflow**, boosting productivity by 20% (highlighted leadership and impact).",
-          "example_2": "I **coordinated cross-department efforts** to resolve issues quickly (showcased proactive leadership)."
-        }
-      ]
-    }
-  ],
-  "result": [
-    {
-      "title": "Principle: Quantify Success",
-      "subtitle": "Use specific numbers to illustrate the impact of your efforts. This adds credibility and demonstrates measurable achievement.",
-      "original_content": "The project was successful and met expectations.",
-      "examples": [
-        {
-          "example_1": "The project led to a **15% reduction in production time and 10% cost savings** (added specific metrics).",
-          "example_2": "The project improved **customer satisfaction by 25% and reduced delays by 20%** (added additional impact metrics)."
-        }
-      ]
-    },
-    {
-      "title": "Principle: Long-Term Impact",
-      "subtitle": "Demonstrate how your work had lasting effects or benefits to show that the impact was sustainable.",
-      "original_content": "The project was successful and met expectations.",
-      "examples": [
-        {
-          "example_1": "The project set a standard, **increasing company-wide efficiency by 10% over six months** (mentioned long-term benefit).",
-          "example_2": "The framework enabled future projects to achieve **faster timelines** (emphasized replicable success)."
-        }
-      ]
-    }
-  ]
-}
-
-"""
-
-        input_prompt = f"""Given the following user-provided STAR experience, format it into the STAR structure and provide detailed, high-value feedback as JSON arrays. Each section should include between 6-9 impactful recommendations that build cumulatively from one to the next. Only include suggestions if they provide significant value. If a section is already well-developed, note that further changes aren't necessary.
-
-Each recommendation should include:
-
-Title (brief, summarizing the main idea)
-Subtitle (explaining why it adds value)
-Original Content (the user’s initial input)
-Examples showing cumulative improvements with key changes highlighted.
-Focus on efficiency and impact. If a recommendation won't significantly improve the content, do not include it.
-
-Input Data:
-
-Company: {data.get('company')}
-Position: {data.get('position')}
-Industry: {data.get('industry')}
-
-Situation: {data.get('situation')}
-Task: {data.get('task')}
-Action: {data.get('actions')}
-Result: {data.get('results')}
-
-"""
-
-        client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": input_prompt}
-            ],
-            model="llama3-8b-8192",
-            temperature=0.7,
-            max_tokens=4000,
-            top_p=0.8,
-            stream=True
-        )
-
-        generated_response = ''
-        for chunk in chat_completion:
-            if chunk.choices[0].delta.content is not None:
-                generated_response += chunk.choices[0].delta.content
-
-        parsed_data = extract_json(generated_response)
-        
-        if parsed_data is None:
-            logging.error(f"Failed to parse recommendations. Raw response: {generated_response}")
-            return jsonify({"error": "Failed to parse recommendations"}), 500
-
-        return jsonify({"recommendations": parsed_data})
-
+        with stage('parse'):
+            data = request.json
+
+        cache_key = recommendations_cache_key(data)
+        cached = cached_lookup(cache_key, data)
+        if cached is not None:
+            speculator.speculate(data)
+            return cache_response(cached, 'HIT')
+
+        similar = semantic_lookup('recommendations', data)
+        if similar is not None:
+            speculator.speculate(data)
+            return cache_response(similar, 'SEMANTIC')
+
+        with stage('prompt'):
+            messages = build_recommendations_messages(data)
+        deltas = stream_chat(messages=messages, route='recommendations', **RECOMMENDATIONS_PARAMS)
+        generated_response, parsed_data = collect_json(deltas)
+
+        payload, status = recommendations_result(generated_response, parsed_data)
+        if status != 200:
+            return jsonify(payload), status
+        response_cache.set(cache_key, payload)
+        semantic_cache.add('recommendations', data, payload)
+        speculator.speculate(data)
+        return cache_response(payload, 'MISS')
+
+    except SchedulerRejected as e:
+        return rejected_response(e)
     except Exception as e:
         logging.error(f"Error generating recommendations: {str(e)}")
         logging.error(traceback.format_exc())
@@ -512,263 +485,270 @@ Result: {data.get('results')}
 
 @app.route('/api/star/bullets', methods=['POST', 'OPTIONS'])
 def generate_bullets():
+    if request.method == 'OPTIONS':
+        return '', 204
+    try:
+        with stage('parse'):
+            data = request.json
+        log_payload('bullets.request', data)
+
+        cache_key = bullets_cache_key(data)
+        cached = cached_lookup(cache_key, data)
+        if cached is not None:
+            if wants_event_stream(data):
+                return event_stream(cached_bullet_events(cached))
+            return cache_response(cached, 'HIT')
+
+        speculated = speculator.take(data, request.headers.get('Cache-Control', ''))
+        if speculated is not None:
+            response_cache.set(cache_key, speculated)
+            if wants_event_stream(data):
+                return event_stream(cached_bullet_events(speculated))
+            return cache_response(speculated, 'SPECULATIVE')
+
+        similar = semantic_lookup('bullets', data)
+        if similar is not None:
+            if wants_event_stream(data):
+                return event_stream(cached_bullet_events(similar))
+            return cache_response(similar, 'SEMANTIC')
+
+        with stage('prompt'):
+            messages = build_bullets_messages(data)
+        deltas = stream_chat(messages=messages, route='bullets', **BULLETS_PARAMS)
+
+        if wants_event_stream(data):
+            return event_stream(bullet_events(deltas, cache_key, 'bullets', data=data))
+
+        generated_response = ''.join(deltas)
+
+        log_payload('bullets.response', generated_response)
+
+        payload, status = bullets_result(generated_response, "Failed to parse generated bullets")
+        if status != 200:
+            return jsonify(payload), status
+        response_cache.set(cache_key, payload)
+        semantic_cache.add('bullets', data, payload)
+        return cache_response(payload, 'MISS')
+
+    except SchedulerRejected as e:
+        return rejected_response(e)
+    except Exception as e:
+        logging.error(f"Error in generate_bullets: {str(e)}")
+        logging.error(traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+      
+def generate_batch_item(index, item, cache_control):
+    """Generate bullets for one batch item; failures are reported in the result, not raised."""
+    try:
+        cache_key = bullets_cache_key(item)
+        cached = lookup_cached_response(cache_key, item, cache_control)
+        if cached is not None:
+            return {'index': index, 'cache': 'HIT', **cached}
+        similar = semantic_cache.lookup('bullets', item, cache_control)
+        if similar is not None:
+            return {'index': index, 'cache': 'SEMANTIC', **similar}
+
+        deltas = stream_chat(messages=build_bullets_messages(item), route='batch', **BULLETS_PARAMS)
+        payload, status = bullets_result(''.join(deltas), "Failed to parse generated bullets")
+        if status != 200:
+            return {'index': index, **payload}
+        response_cache.set(cache_key, payload)
+        semantic_cache.add('bullets', item, payload)
+        return {'index': index, 'cache': 'MISS', **payload}
+    except SchedulerRejected as e:
+        return {'index': index, 'error': str(e), 'retry_after': e.retry_after}
+    except Exception as e:
+        logging.error(f"Error generating batch item {index}: {str(e)}")
+        return {'index': index, 'error': str(e)}
+
+def generate_batch(items, cache_control):
+    """Yield batch item results in completion order, at most BATCH_MAX_PARALLEL at a time."""
+    with ThreadPoolExecutor(max_workers=min(BATCH_MAX_PARALLEL, len(items))) as executor:
+        # Pool threads start with an empty context; each item runs in a copy of the request's, so its
+        # logs keep the request id and its stages land in the request's timings
+        futures = [
+            executor.submit(contextvars.copy_context().run, generate_batch_item, index, item, cache_control)
+            for index, item in enumerate(items)
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+def batch_events(items, cache_control):
+    results = []
+    for result in generate_batch(items, cache_control):
+        results.append(result)
+        yield sse_event('item', result)
+    yield sse_event('done', batch_summary(results))
+
+@app.route('/api/star/bullets/batch', methods=['POST', 'OPTIONS'])
+def generate_bullets_batch():
     if request.method == 'OPTIONS':
         return '', 204
     try:
         data = request.json
-        logging.info(f"Received data: {data}")
-        
-        # Extract STAR content and basic info
-        basic_info = data.get('basic_info', {})
-        star_content = data.get('star_content', {})
-        
-        # Fix industry field handling
-        industry = basic_info.get('industry', [])
-        industry_str = ', '.join(industry) if isinstance(industry, list) else str(industry)
-
-        system_prompt = """You are an expert-level employment readiness specialist, behavioral therapist, and HR professional. Your task is to review, evaluate, and enhance provided resume content to make it impactful and effective. When given resume input, transform it into optimized, high-quality bullet points that highlight clarity, context, action, and results without introducing unrelated or invented information. Each bullet should maintain relevance, use powerful action verbs, and include measurable outcomes where applicable. Your output should reflect professional resume bullet formatting, emphasizing succinct and impactful wording. 
-
-Ensure that:
-- Basic or underdeveloped content is improved with context, specificity, and quantifiable outcomes.
-- Already refined input is further enhanced for clarity and maximum impact.
-- All responses should remain concise, powerful, and relevant to the job role.
-
-Example Enhancement:
-Input: "- Assisted customers with purchases and inquiries."
-Enhanced Bullet: "- Provided tailored customer assistance, addressing inquiries promptly and facilitating a seamless purchasing process, contributing to a 15% boost in customer satisfaction."
-
-Your response should maintain this format and approach.
- """
-
-        input_prompt = f"""Review and enhance the provided resume content, transforming it into a efficient, strong, concise, but very impactful resume bullets. If the content is basic, improve it with context, measurable results, and clarity. If it is already improved, refine it for conciseness and impact. Do not over-improve it. Focus on efficiency and impact but CLEAR STORYTELLING. Keep the response formatted as resume-style bullet points, no sub-bullets but still impactful and telling of the full story. Here is the data you are making changes to. Try not to change the original type of content too much like saying Spearheaded when they didnt say they lead anything unless there was undertones in there that they did:
-
-Company: {basic_info.get('company', '')}
-Position: {basic_info.get('position', '')}
-Industry: {industry_str}
-
-Situation: {star_content.get('situation', '')}
-Task: {star_content.get('task', '')}
-Action: {star_content.get('actions', '')}  
-Result: {star_content.get('results', '')}  
-
-Format the response as a JSON object with an array of 3-4 bullet points:
-{{{{
-    "bullets": [
-        "- Bullet point 1",
-        "- Bullet point 2",
-        "- Bullet point 3",
-        "- Bullet point 4"
-    ]
-}}}}"""
-
-        # Add logging to debug prompt
-        logging.info(f"Formatted prompt with data: {input_prompt}")
-
-        client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
-        
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": input_prompt
-                }
-            ],
-            model="llama3-8b-8192",
-            temperature=0.7,
-            max_tokens=2000,
-            top_p=0.8,
-            stream=True
-        )
-
-        generated_response = ''
-        for chunk in chat_completion:
-            if chunk.choices[0].delta.content is not None:
-                generated_response += chunk.choices[0].delta.content
-
-        logging.info(f"Generated response: {generated_response}")
-        
         try:
-            parsed_data = parse_bullets_response(generated_response)
-            return jsonify(parsed_data)
+            items = batch_items(data)
         except ValueError as e:
-            logging.error(f"Parsing error: {str(e)}")
-            return jsonify({
-                "error": "Failed to parse generated bullets",
-                "raw_response": generated_response
-            }), 500
+            return jsonify({"error": str(e)}), 400
+
+        cache_control = 'no-cache' if data.get('regenerate') else request.headers.get('Cache-Control', '')
+
+        if wants_event_stream(data):
+            return Response(
+                stream_with_context(batch_events(items, cache_control)),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+
+        results = sorted(generate_batch(items, cache_control), key=lambda result: result['index'])
+        return jsonify({'results': results, **batch_summary(results)})
 
+    except SchedulerRejected as e:
+        return rejected_response(e)
     except Exception as e:
-        logging.error(f"Error in generate_bullets: {str(e)}")
+        logging.error(f"Error in generate_bullets_batch: {str(e)}")
         logging.error(traceback.format_exc())
         return jsonify({"error": str(e)}), 500
-      
+
 @app.route('/api/star/tailor', methods=['POST', 'OPTIONS'])
 def tailor_bullets():
     if request.method == 'OPTIONS':
         return '', 204
     try:
-        data = request.json
-        logging.info(f"Received data: {data}")
-        
-        # Extract all necessary data
-        basic_info = data.get('basic_info', {})
-        current_bullets = data.get('currentBullets', [])
-        target_position = data.get('targetPosition', {})
-        
-        # Handle industry data
-        industry = basic_info.get('industry', [])
-        industry_str = ', '.join(industry) if isinstance(industry, list) else str(industry)
-
-        system_prompt = """You are an expert ATS optimization specialist and professional resume writer. Your task is to tailor existing resume bullets for a specific job position while:
-Please keep the bullets related to the original job, but also incorporate elements that would appeal to the position we desire. Avoid making it too obvious that we are tailoring the content for that job by not explicitly stating the specific position we are applying for or removing every detail from the original role. The adjustments should be subtle, with a moderate level of tailoring for that role.
-1. Maintaining the core achievements and experiences
-2. Incorporating relevant keywords from the job description
-3. Aligning the language with the target role and company
-4. Ensuring bullets pass ATS screening
-5. Following any specific tailoring instructions provided
-
-Guidelines:
-- Keep bullets concise but impactful (max 1 lines each & 4 bullets total unless instructed otherwise)
-- Include measurable results where present
-- Use industry-specific terminology from the target role
-- Maintain professional resume formatting
-Please remember the following text. 
-
-Add any words that I am missing without changing the original content. The changes should not exceed 3% and should not include any statements about company values or any additional information in the bullet points. Just make your changes.
-- Focus on transferable skills when changing industries
-- Prioritize keywords from the job description without keyword stuffing. If I provide special instructions, follow them and put them in the brackets do not say anything extra after just acheive the task in front of you."""
-
-        input_prompt = f"""Tailor these resume bullets for the following target position. Review and enhance the provided resume content, transforming it into a efficient, strong, concise, but very impactful resume bullets. If the content is basic, improve it with context, measurable results, and clarity. If it is already improved, refine it for conciseness and impact. Do not over-improve it. Focus on efficiency and impact but CLEAR STORYTELLING. Keep the response formatted as resume-style bullet points, no sub-bullets but still impactful and telling of the full story.:
-
-TARGET POSITION DETAILS:
-Title: {target_position.get('title', '')}
-Company: {target_position.get('company', '')}
-Industry: {target_position.get('industry', '')}
-Job Description: {target_position.get('description', '')}
-
-SPECIAL INSTRUCTIONS:
-{target_position.get('instructions', 'No special instructions provided')}
-
-CURRENT POSITION:
-Company: {basic_info.get('company', '')}
-Position: {basic_info.get('position', '')}
-Industry: {industry_str}
-
-CURRENT BULLETS:
-{current_bullets}
-
-Please remember the following text. 
-
-Add any words that I am missing without changing the original content. The changes should not exceed 3% and should not include any statements about company values or any additional information in the bullet points. Just make your changes.
-
-Please tailor these bullets to:
-1. Include key terms from the job description
-2. Highlight transferable skills
-3. Maintain the core achievements. Please keep the bullets related to the original job, but also incorporate elements that would appeal to the position we desire. Avoid making it too obvious that we are tailoring the content for that job by not explicitly stating the specific position we are applying for or removing every detail from the original role. The adjustments should be subtle, with a moderate level of tailoring.
-
-Format the response as a JSON object with an array of bullets without any extra text or notes. ONLY 4 BULLETS UNLESS INSTRUCTED OTHERWISE:
-{{{{
-    "bullets": [
-        "- Tailored bullet 1",
-        "- Tailored bullet 2",
-        "- Tailored bullet 3",
-        "- Tailored bullet 4"
-    ]
-}}}}"""
-
-        logging.info(f"Tailoring prompt: {input_prompt}")
-
-        client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
-        
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": input_prompt
-                }
-            ],
-            model="llama3-8b-8192",
-            temperature=0.5,  # Lower temperature for more focused output
-            max_tokens=2000,
-            top_p=0.7,
-            stream=True
-        )
-
-        generated_response = ''
-        for chunk in chat_completion:
-            if chunk.choices[0].delta.content is not None:
-                generated_response += chunk.choices[0].delta.content
-
-        logging.info(f"Generated tailored bullets: {generated_response}")
-        
-        try:
-            parsed_data = parse_bullets_response(generated_response)
-            return jsonify(parsed_data)
-        except ValueError as e:
-            logging.error(f"Parsing error: {str(e)}")
-            return jsonify({
-                "error": "Failed to parse tailored bullets",
-                "raw_response": generated_response
-            }), 500
+        with stage('parse'):
+            data = request.json
+        log_payload('tailor.request', data)
+
+        cache_key = tailor_cache_key(data)
+        cached = cached_lookup(cache_key, data)
+        if cached is not None:
+            if wants_event_stream(data):
+                return event_stream(cached_bullet_events(cached))
+            return cache_response(cached, 'HIT')
+
+        with stage('prompt'):
+            messages = build_tailor_messages(data)
+        deltas = stream_chat(messages=messages, route='tailor', **TAILOR_PARAMS)
+
+        if wants_event_stream(data):
+            return event_stream(bullet_events(deltas, cache_key, 'tailor', "Failed to parse tailored bullets"))
+
+        generated_response = ''.join(deltas)
+
+        log_payload('tailor.response', generated_response)
+
+        payload, status = bullets_result(generated_response, "Failed to parse tailored bullets")
+        if status != 200:
+            return jsonify(payload), status
+        response_cache.set(cache_key, payload)
+        return cache_response(payload, 'MISS')
 
+    except SchedulerRejected as e:
+        return rejected_response(e)
     except Exception as e:
         logging.error(f"Error in tailor_bullets: {str(e)}")
         logging.error(traceback.format_exc())
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/star/coverage', methods=['POST', 'OPTIONS'])
+def keyword_coverage_score():
+    """ATS keyword coverage of bullets against a job description, scored locally with no LLM call."""
+    if request.method == 'OPTIONS':
+        return '', 204
+    try:
+        data = request.json or {}
+        description = data.get('description') or (data.get('targetPosition') or {}).get('description')
+        bullets = data.get('bullets', data.get('currentBullets'))
+        if not isinstance(description, str) or not description.strip():
+            return jsonify({'error': 'A job description is required'}), 400
+        if not isinstance(bullets, list) or not all(isinstance(bullet, str) for bullet in bullets):
+            return jsonify({'error': 'bullets must be a list of strings'}), 400
+
+        analysis = get_jd_analyzer().analyze(description)
+        return jsonify({'description_hash': analysis['hash'], **keyword_coverage(analysis['keywords'], bullets)})
+    except Exception as e:
+        logging.error(f"Error scoring keyword coverage: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/ping', methods=['GET', 'OPTIONS'])
 def ping():
     if request.method == 'OPTIONS':
         return '', 204
     return jsonify({
         "status": "ok",
-        "message": "Server is running"
+        "message": "Server is running",
+        "upstream": metrics.upstream_percentiles(),
     }), 200
 
-# @app.teardown_appcontext
-# def shutdown_session(exception=None):
-#     db_session.remove()
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    # Each worker reports its own series; scrape workers individually when running more than one
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/scheduler/stats', methods=['GET'])
+def scheduler_stats():
+    return jsonify(scheduler.stats())
+
+@app.route('/api/budget/stats', methods=['GET'])
+def budget_stats():
+    return jsonify(prompt_budget.stats())
+
+@app.route('/api/providers/stats', methods=['GET'])
+def provider_stats():
+    return jsonify(router.stats())
 
-def parse_bullets_response(response_text: str) -> dict:
-    """Parse the LLM response for bullet points."""
+@app.route('/api/logging/stats', methods=['GET'])
+def log_stats():
+    return jsonify(logging_stats())
+
+@app.route('/api/jobs/stats', methods=['GET'])
+def jobs_stats():
+    return jsonify(job_runner.stats())
+
+@app.route('/api/speculation/stats', methods=['GET'])
+def speculation_stats():
+    return jsonify(speculator.stats())
+
+@app.route('/api/prompts', methods=['GET', 'POST'])
+def prompts():
+    # POST re-reads edited template files without a restart
+    if request.method == 'POST':
+        try:
+            prompt_registry.reload()
+        except Exception as e:
+            logging.error(f"Error reloading prompts: {str(e)}")
+            return jsonify({"error": str(e)}), 500
+    return jsonify(prompt_registry.describe())
+
+@app.route('/api/retrieval/search', methods=['GET'])
+def retrieval_search():
+    """Top-k indexed chunks for ?q=, optionally limited to one ?source= (upload, persona, document)."""
     try:
-        # Clean up the response text
-        cleaned_text = response_text.strip()
-        
-        # Try to extract JSON using regex first
-        json_match = re.search(r'\{[\s\S]*?\}(?=\s*$)', cleaned_text)
-        if json_match:
-            try:
-                json_data = json.loads(json_match.group(0))
-                if isinstance(json_data, dict) and "bullets" in json_data:
-                    bullets = []
-                    for bullet in json_data["bullets"]:
-                        clean_bullet = bullet.strip().replace('\\"', '"').replace('"', '')
-                        if not clean_bullet.startswith('-'):
-                            clean_bullet = f"- {clean_bullet}"
-                        bullets.append(clean_bullet)
-                    return {"bullets": bullets}
-            except json.JSONDecodeError:
-                pass
-        
-        # If JSON parsing fails, try to extract bullet points directly
-        bullet_points = re.findall(r'[-•]\s*([^\n]+)', cleaned_text)
-        if bullet_points:
-            return {"bullets": [f"- {b.strip()}" for b in bullet_points]}
-            
-        raise ValueError("No valid bullet points found in response")
-        
+        query = request.args.get('q', '')
+        k = max(1, min(int(request.args.get('k', 5)), 50))
+        results = get_retrieval_index().search(query, k=k, source=request.args.get('source'), source_id=request.args.get('source_id'))
+        return jsonify({'results': results})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        logging.error(f"Error parsing bullets: {str(e)}")
-        raise ValueError(f"Failed to parse bullets: {str(e)}")
+        app.logger.error(f"Error in retrieval_search: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        **response_cache.stats(),
+        'single_flight': single_flight.stats(),
+        'personas': persona_store.stats(),
+        'uploads': upload_store.stats(),
+        'retrieval': get_retrieval_index().stats(),
+        'semantic': semantic_cache.stats(),
+        'jd_analysis': get_jd_analyzer().stats(),
+    })
+
+# @app.teardown_appcontext
+# def shutdown_session(exception=None):
+#     db_session.remove()
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
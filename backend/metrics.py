@@ -0,0 +1,228 @@
+import os
+import time
+import bisect
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+# Seconds; spans sub-millisecond parsing up to multi-minute persona generations
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKENS_PER_SECOND_BUCKETS = (5, 10, 25, 50, 100, 200, 400, 800, 1600)
+# Distinct model label values kept before the rest are reported as "other"; the model comes from the request
+METRICS_MAX_MODELS = int(os.getenv('METRICS_MAX_MODELS', '16'))
+# Upstream calls remembered for the percentiles /api/ping reports
+UPSTREAM_WINDOW = int(os.getenv('UPSTREAM_WINDOW', '500'))
+
+# Requests whose stages are timed, by path, with the route label they report under
+TIMED_PATHS = {
+    '/generate_persona_stream': 'persona',
+    '/api/star/recommendations': 'recommendations',
+    '/api/star/bullets': 'bullets',
+    '/api/star/bullets/batch': 'batch',
+    '/api/star/tailor': 'tailor',
+}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    """A Prometheus histogram with fixed buckets, one series per label combination."""
+
+    def __init__(self, name, documentation, labelnames, buckets=STAGE_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                # Per-bucket counts plus +Inf, then the sum
+                series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            series = {labels: list(values) for labels, values in self.series.items()}
+        for labels, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {values[-1]}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels):
+        with self.lock:
+            self.series[labels] = self.series.get(labels, 0) + 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self.lock:
+            series = dict(self.series)
+        for labels, value in sorted(series.items()):
+            lines.append(f'{self.name}{_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+STAGE_SECONDS = Histogram('thrive_stage_seconds', 'Time spent in each stage of a generation request.',
+                          ('route', 'model', 'stage'))
+REQUEST_SECONDS = Histogram('thrive_request_seconds', 'Total time to produce a generation response.',
+                            ('route', 'model'))
+TOKENS_PER_SECOND = Histogram('thrive_tokens_per_second', 'Completion tokens per second after the first token.',
+                              ('route', 'model'), TOKENS_PER_SECOND_BUCKETS)
+REQUESTS = Counter('thrive_requests_total', 'Generation requests by response status.', ('route', 'model', 'status'))
+REGISTRY = [STAGE_SECONDS, REQUEST_SECONDS, TOKENS_PER_SECOND, REQUESTS]
+
+_models = set()
+_models_lock = threading.Lock()
+_upstream = deque(maxlen=UPSTREAM_WINDOW)
+
+request_timings = contextvars.ContextVar('request_timings', default=None)
+# Observed when the LLM call makes them rather than when the request finishes
+UPSTREAM_STAGES = {'queue', 'connect', 'ttft', 'generation'}
+
+
+def model_label(model):
+    """model, or "other" once METRICS_MAX_MODELS distinct values have been seen."""
+    if not model:
+        return 'unknown'
+    model = str(model)[:64]
+    with _models_lock:
+        if model in _models:
+            return model
+        if len(_models) < METRICS_MAX_MODELS:
+            _models.add(model)
+            return model
+    return 'other'
+
+
+class RequestTimings:
+    """Stage durations of one request, reported as Server-Timing and recorded to the histograms once done."""
+
+    def __init__(self, route):
+        self.route = route
+        self.model = None
+        self.started = time.perf_counter()
+        self.stages = []
+        self.finished = False
+
+    def record(self, stage, seconds):
+        self.stages.append((stage, seconds))
+
+    def server_timing(self):
+        entries = [f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in self.stages]
+        entries.append(f'total;dur={(time.perf_counter() - self.started) * 1000:.1f}')
+        return ', '.join(entries)
+
+    def finish(self, status):
+        """Observe everything recorded so far; called when the response has been sent."""
+        if self.finished:
+            return
+        self.finished = True
+        model = model_label(self.model)
+        for stage, seconds in self.stages:
+            # Upstream stages were observed as they happened, under the call's own route
+            if stage not in UPSTREAM_STAGES:
+                STAGE_SECONDS.observe(seconds, self.route, model, stage)
+        REQUEST_SECONDS.observe(time.perf_counter() - self.started, self.route, model)
+        REQUESTS.inc(self.route, model, str(status))
+
+
+def begin_request(path):
+    """Start timing a request if its path is one of TIMED_PATHS; returns its RequestTimings or None."""
+    route = TIMED_PATHS.get(path)
+    timings = RequestTimings(route) if route else None
+    request_timings.set(timings)
+    return timings
+
+
+def record_stage(stage, seconds):
+    timings = request_timings.get()
+    if timings is not None:
+        timings.record(stage, seconds)
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as one stage of the current request."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def set_model(model):
+    timings = request_timings.get()
+    if timings is not None and timings.model is None:
+        timings.model = model
+
+
+def observe_upstream(route, model, stage, seconds):
+    """Record one upstream stage (queue, connect, ttft, generation) of an LLM call."""
+    STAGE_SECONDS.observe(seconds, route or 'unknown', model_label(model), stage)
+    record_stage(stage, seconds)
+
+
+def observe_completion(route, model, ttft, generation, completion_tokens):
+    """Record a finished LLM call: total generation time and decode speed after the first token."""
+    observe_upstream(route, model, 'generation', generation)
+    decoding = generation - ttft
+    if completion_tokens > 1 and decoding > 0:
+        TOKENS_PER_SECOND.observe((completion_tokens - 1) / decoding, route or 'unknown', model_label(model))
+    _upstream.append((ttft, generation))
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(fraction * len(values)))], 4)
+
+
+def upstream_percentiles():
+    """p50/p99 in seconds of time to first token and total generation over the recent upstream calls."""
+    calls = list(_upstream)
+    first_tokens = [ttft for ttft, _ in calls]
+    totals = [generation for _, generation in calls]
+    return {
+        'calls': len(calls),
+        'ttft': {'p50': _percentile(first_tokens, 0.5), 'p99': _percentile(first_tokens, 0.99)},
+        'generation': {'p50': _percentile(totals, 0.5), 'p99': _percentile(totals, 0.99)},
+    }
+
+
+def render():
+    """Every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
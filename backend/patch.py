@@ -0,0 +1,136 @@
+import copy
+
+
+class PatchError(ValueError):
+    """A patch document that is malformed or cannot be applied to the target."""
+
+
+def _parse_pointer(pointer):
+    # RFC 6901: "" is the whole document, otherwise "/"-separated tokens with ~1 -> / and ~0 -> ~
+    if not isinstance(pointer, str) or (pointer and not pointer.startswith('/')):
+        raise PatchError(f"Invalid JSON pointer: {pointer!r}")
+    if not pointer:
+        return []
+    return [token.replace('~1', '/').replace('~0', '~') for token in pointer[1:].split('/')]
+
+
+def _array_index(container, token, allow_end=False):
+    if token == '-' and allow_end:
+        return len(container)
+    if not token.isdigit() or (len(token) > 1 and token.startswith('0')):
+        raise PatchError(f"Invalid array index: {token!r}")
+    index = int(token)
+    if index > len(container) or (index == len(container) and not allow_end):
+        raise PatchError(f"Array index out of range: {index}")
+    return index
+
+
+def _resolve(document, tokens):
+    for token in tokens:
+        if isinstance(document, dict):
+            if token not in document:
+                raise PatchError(f"Path not found: {token!r}")
+            document = document[token]
+        elif isinstance(document, list):
+            document = document[_array_index(document, token)]
+        else:
+            raise PatchError(f"Cannot descend into a scalar at {token!r}")
+    return document
+
+
+def _get(document, pointer):
+    return _resolve(document, _parse_pointer(pointer))
+
+
+def _add(document, pointer, value):
+    tokens = _parse_pointer(pointer)
+    if not tokens:
+        return value
+    parent = _resolve(document, tokens[:-1])
+    if isinstance(parent, dict):
+        parent[tokens[-1]] = value
+    elif isinstance(parent, list):
+        parent.insert(_array_index(parent, tokens[-1], allow_end=True), value)
+    else:
+        raise PatchError(f"Cannot add to a scalar at {pointer!r}")
+    return document
+
+
+def _remove(document, pointer):
+    tokens = _parse_pointer(pointer)
+    if not tokens:
+        raise PatchError("Cannot remove the whole document")
+    parent = _resolve(document, tokens[:-1])
+    if isinstance(parent, dict):
+        if tokens[-1] not in parent:
+            raise PatchError(f"Path not found: {pointer!r}")
+        return parent.pop(tokens[-1])
+    if isinstance(parent, list):
+        return parent.pop(_array_index(parent, tokens[-1]))
+    raise PatchError(f"Cannot remove from a scalar at {pointer!r}")
+
+
+def _replace(document, pointer, value):
+    tokens = _parse_pointer(pointer)
+    if not tokens:
+        return value
+    parent = _resolve(document, tokens[:-1])
+    if isinstance(parent, dict):
+        if tokens[-1] not in parent:
+            raise PatchError(f"Path not found: {pointer!r}")
+        parent[tokens[-1]] = value
+    elif isinstance(parent, list):
+        parent[_array_index(parent, tokens[-1])] = value
+    else:
+        raise PatchError(f"Cannot replace in a scalar at {pointer!r}")
+    return document
+
+
+def _operand(operation, name):
+    if name not in operation:
+        raise PatchError(f"Operation {operation.get('op')!r} is missing {name!r}")
+    return operation[name]
+
+
+def apply_json_patch(document, patch):
+    """Apply an RFC 6902 JSON Patch; the document is left untouched if any operation fails."""
+    if not isinstance(patch, list):
+        raise PatchError("A JSON Patch must be an array of operations")
+    document = copy.deepcopy(document)
+    for operation in patch:
+        if not isinstance(operation, dict):
+            raise PatchError("Each JSON Patch operation must be an object")
+        op = operation.get('op')
+        path = _operand(operation, 'path')
+        if op == 'add':
+            document = _add(document, path, copy.deepcopy(_operand(operation, 'value')))
+        elif op == 'remove':
+            _remove(document, path)
+        elif op == 'replace':
+            document = _replace(document, path, copy.deepcopy(_operand(operation, 'value')))
+        elif op == 'move':
+            source = _operand(operation, 'from')
+            if path != source and path.startswith(source + '/'):
+                raise PatchError(f"Cannot move {source!r} into its own child {path!r}")
+            document = _add(document, path, _remove(document, source))
+        elif op == 'copy':
+            document = _add(document, path, copy.deepcopy(_get(document, _operand(operation, 'from'))))
+        elif op == 'test':
+            if _get(document, path) != _operand(operation, 'value'):
+                raise PatchError(f"Test failed at {path!r}")
+        else:
+            raise PatchError(f"Unknown JSON Patch operation: {op!r}")
+    return document
+
+
+def apply_merge_patch(document, patch):
+    """Apply an RFC 7396 JSON Merge Patch: objects merge recursively and null removes a member."""
+    if not isinstance(patch, dict):
+        return copy.deepcopy(patch)
+    result = copy.deepcopy(document) if isinstance(document, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = apply_merge_patch(result.get(key), value)
+    return result
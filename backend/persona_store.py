@@ -0,0 +1,286 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import atexit
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+PERSONA_DB_PATH = os.getenv('PERSONA_DB_PATH', os.path.join('user_data', 'personas.sqlite'))
+# Decoded personas kept in each worker; the database holds the rest
+PERSONA_CACHE_SIZE = int(os.getenv('PERSONA_CACHE_SIZE', '512'))
+# Pending writes are committed together once this many accumulate or this many seconds pass
+PERSONA_WRITE_BATCH = int(os.getenv('PERSONA_WRITE_BATCH', '64'))
+PERSONA_FLUSH_INTERVAL = float(os.getenv('PERSONA_FLUSH_INTERVAL', '0.05'))
+# Slack for clock differences between workers when looking up what changed since the last check
+SYNC_MARGIN = 1.0
+# Rows fetched per query when listing personas
+PERSONA_SCAN_CHUNK = 500
+
+SELECT_PERSONA = 'SELECT data FROM personas WHERE id = ?'
+SELECT_CHANGED_IDS = 'SELECT id FROM personas WHERE updated_at >= ?'
+# Listing walks rowid, which follows insertion order and is unchanged by updates, so cursors stay stable
+SELECT_PAGE = 'SELECT rowid, id, {columns} FROM personas WHERE rowid > ? ORDER BY rowid LIMIT ?'
+UPDATE_PERSONA = 'UPDATE personas SET data = ?, updated_at = ? WHERE id = ?'
+UPSERT_PERSONA = (
+    'INSERT INTO personas (id, data, created_at, updated_at) VALUES (?, ?, ?, ?) '
+    'ON CONFLICT(id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at'
+)
+
+
+class PreconditionFailed(Exception):
+    """An If-Match update whose persona has changed since the client read it."""
+
+    def __init__(self, etag):
+        super().__init__('Persona has been modified')
+        self.etag = etag
+
+
+def make_etag(data: str) -> str:
+    """Strong validator for one stored persona, derived from its serialized form."""
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()[:20]
+
+
+class PersonaStore:
+    """Personas in SQLite shared by every worker, behind a bounded per-worker LRU and a batched writer."""
+
+    def __init__(self, path=PERSONA_DB_PATH, cache_size=PERSONA_CACHE_SIZE,
+                 write_batch=PERSONA_WRITE_BATCH, flush_interval=PERSONA_FLUSH_INTERVAL):
+        self.path = path
+        self.cache_size = cache_size
+        self.write_batch = write_batch
+        self.flush_interval = flush_interval
+        self.local = threading.local()
+        self.cache = OrderedDict()
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.writer = None
+        self.writer_pid = None
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.synced_at = time.time()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS personas ('
+            'id TEXT PRIMARY KEY, data TEXT NOT NULL, created_at REAL NOT NULL, updated_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS personas_updated_at ON personas (updated_at)')
+        conn.commit()
+        atexit.register(self.flush)
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            # Statements are prepared once per connection and reused from its statement cache
+            conn = sqlite3.connect(self.path, timeout=5, cached_statements=32)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+            self.local.data_version = None
+        return conn
+
+    def _sync(self, conn):
+        """Evict cached personas another connection has committed since this thread last looked."""
+        data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        if self.local.data_version is not None and data_version != self.local.data_version:
+            now = time.time()
+            with self.lock:
+                since = self.synced_at - SYNC_MARGIN
+            changed = conn.execute(SELECT_CHANGED_IDS, (since,)).fetchall()
+            with self.lock:
+                for (persona_id,) in changed:
+                    self.cache.pop(persona_id, None)
+                self.synced_at = max(self.synced_at, now)
+        self.local.data_version = data_version
+
+    def _remember(self, persona_id, persona, etag):
+        # Caller holds self.lock
+        self.cache[persona_id] = (persona, etag)
+        self.cache.move_to_end(persona_id)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def get(self, persona_id):
+        """The persona stored under persona_id, or None."""
+        return self.get_with_etag(persona_id)[0]
+
+    def get_with_etag(self, persona_id):
+        """(persona, etag) for persona_id, or (None, None)."""
+        conn = self._conn()
+        self._sync(conn)
+        with self.lock:
+            pending = self.pending.get(persona_id)
+            if pending is not None:
+                return dict(pending[0]), pending[2]
+            entry = self.cache.get(persona_id)
+            if entry is not None:
+                self.cache.move_to_end(persona_id)
+                self.hits += 1
+                return dict(entry[0]), entry[1]
+            self.misses += 1
+        row = conn.execute(SELECT_PERSONA, (persona_id,)).fetchone()
+        if row is None:
+            return None, None
+        persona, etag = json.loads(row[0]), make_etag(row[0])
+        with self.lock:
+            if persona_id not in self.pending:
+                self._remember(persona_id, persona, etag)
+        return dict(persona), etag
+
+    def put(self, persona_id, persona):
+        """Queue a full replacement of one persona; visible to this worker immediately."""
+        persona = dict(persona)
+        data = json.dumps(persona)
+        etag = make_etag(data)
+        with self.lock:
+            self.pending[persona_id] = (persona, data, etag, time.time())
+            self.pending.move_to_end(persona_id)
+            self._remember(persona_id, persona, etag)
+            full = len(self.pending) >= self.write_batch
+        self._ensure_writer()
+        if full:
+            self.wakeup.set()
+
+    def create(self, persona):
+        persona_id = uuid.uuid4().hex
+        self.put(persona_id, persona)
+        return persona_id
+
+    def update(self, persona_id, changes):
+        """Merge changes into an existing persona; returns False if there is none."""
+        return self.modify(persona_id, lambda persona: {**persona, **changes}) is not None
+
+    def modify(self, persona_id, change, if_match=None):
+        """Atomically replace a persona with change(persona) and return (persona, etag), or None if missing.
+
+        The read and write share one IMMEDIATE transaction, which holds SQLite's write lock, so concurrent
+        edits from any worker serialize instead of overwriting each other. With if_match (a collection of
+        acceptable etags), PreconditionFailed is raised when the stored persona no longer matches.
+        """
+        # Commit this worker's queued writes first so the transaction sees them
+        self.flush()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(SELECT_PERSONA, (persona_id,)).fetchone()
+            if row is None:
+                conn.rollback()
+                return None
+            current = make_etag(row[0])
+            if if_match is not None and current not in if_match:
+                raise PreconditionFailed(current)
+            persona = change(json.loads(row[0]))
+            data = json.dumps(persona)
+            conn.execute(UPDATE_PERSONA, (data, time.time(), persona_id))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        etag = make_etag(data)
+        self.local.data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        with self.lock:
+            if persona_id not in self.pending:
+                self._remember(persona_id, persona, etag)
+        return dict(persona), etag
+
+    def all(self):
+        """Every persona as (id, persona) pairs, in insertion order."""
+        return [(persona_id, persona) for _, persona_id, persona in self.scan()]
+
+    def scan(self, after=0, limit=None, fields=None, chunk=PERSONA_SCAN_CHUNK):
+        """Yield (position, id, persona) after position, reading chunk rows at a time.
+
+        With fields, SQLite extracts just those keys so the rest of each record is never decoded.
+        """
+        self.flush()
+        conn = self._conn()
+        if fields is None:
+            columns, params = 'data', ()
+        else:
+            columns = 'json_object(' + ', '.join('?, json_extract(data, ?)' for _ in fields) + ')'
+            params = tuple(value for field in fields for value in (field, f'$."{field}"'))
+        sql = SELECT_PAGE.format(columns=columns)
+        while limit is None or limit > 0:
+            size = chunk if limit is None else min(chunk, limit)
+            rows = conn.execute(sql, params + (after, size)).fetchall()
+            for position, persona_id, data in rows:
+                yield position, persona_id, json.loads(data)
+            if len(rows) < size:
+                return
+            after = rows[-1][0]
+            if limit is not None:
+                limit -= len(rows)
+
+    def flush(self):
+        """Commit every pending write in one transaction."""
+        # Serialized so an older snapshot can never commit over a newer one
+        with self.flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+            written = dict(self.pending)
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Stamped once the write lock is held, however long that took, so updated_at trails the
+            # commit by only the writes themselves and other workers' change scans still see the batch
+            now = time.time()
+            conn.executemany(UPSERT_PERSONA, [(persona_id, data, created_at, now)
+                                              for persona_id, (_, data, _, created_at) in written.items()])
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        self.local.data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        with self.lock:
+            for persona_id, entry in written.items():
+                if self.pending.get(persona_id) is entry:
+                    del self.pending[persona_id]
+            self.flushes += 1
+
+    def _ensure_writer(self):
+        if self.writer is not None and self.writer_pid == os.getpid():
+            return
+        with self.lock:
+            if self.writer is not None and self.writer_pid == os.getpid():
+                return
+            self.writer_pid = os.getpid()
+            self.writer = threading.Thread(target=self._write_loop, name='persona-writer', daemon=True)
+            self.writer.start()
+
+    def _write_loop(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Persona store flush failed: {str(e)}")
+
+    def __len__(self):
+        self.flush()
+        return self._conn().execute('SELECT COUNT(*) FROM personas').fetchone()[0]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'cached': len(self.cache),
+                'cache_size': self.cache_size,
+                'pending_writes': len(self.pending),
+                'flushes': self.flushes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,168 @@
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+
+PROMPTS_DIR = os.getenv('PROMPTS_DIR', os.path.join(os.path.dirname(__file__), 'prompts'))
+# Seconds between checks for edited template files; 0 disables hot reload
+PROMPTS_RELOAD_INTERVAL = float(os.getenv('PROMPTS_RELOAD_INTERVAL', '0'))
+
+# Only ${name} is a placeholder, so literal "$20 million" or JSON braces need no escaping
+_PLACEHOLDER = re.compile(r'\$\{(\w+)\}')
+
+# Placeholders each endpoint's user template must use, exactly
+TEMPLATE_FIELDS = {
+    'persona': {'input_text'},
+    'recommendations': {'company', 'position', 'industry', 'situation', 'task', 'actions', 'results'},
+    'bullets': {'company', 'position', 'industry', 'situation', 'task', 'actions', 'results'},
+    'tailor': {
+        'target_title', 'target_company', 'target_industry', 'target_keywords', 'instructions',
+        'company', 'position', 'industry', 'current_bullets',
+    },
+    'agent': {'input_text'},
+}
+
+
+class CompiledTemplate:
+    """A template split once into literal segments and placeholder names."""
+
+    def __init__(self, source):
+        self.source = source
+        self.segments = []
+        self.fields = []
+        position = 0
+        for match in _PLACEHOLDER.finditer(source):
+            self.segments.append(source[position:match.start()])
+            self.fields.append(match.group(1))
+            position = match.end()
+        self.tail = source[position:]
+        self.static_prefix = self.segments[0] if self.segments else source
+
+    def render(self, values):
+        parts = []
+        for literal, field in zip(self.segments, self.fields):
+            parts.append(literal)
+            parts.append(str(values[field]))
+        parts.append(self.tail)
+        return ''.join(parts)
+
+    def format_string(self):
+        """The template in str.format / ChatPromptTemplate syntax."""
+        escape = lambda text: text.replace('{', '{{').replace('}', '}}')
+        parts = []
+        for literal, field in zip(self.segments, self.fields):
+            parts.append(escape(literal))
+            parts.append('{' + field + '}')
+        parts.append(escape(self.tail))
+        return ''.join(parts)
+
+
+class PromptTemplate:
+    """An endpoint's system and user templates with a stable version hash."""
+
+    def __init__(self, name, system, user):
+        self.name = name
+        self.system = CompiledTemplate(system) if system is not None else None
+        self.user = CompiledTemplate(user)
+        digest = hashlib.sha256()
+        digest.update((system or '').encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(user.encode('utf-8'))
+        self.version = digest.hexdigest()[:12]
+        # Everything before the first per-request value; identical across calls to this endpoint
+        self.static_prefix = (system or '') + self.user.static_prefix
+        self.prefix_hash = hashlib.sha256(self.static_prefix.encode('utf-8')).hexdigest()[:12]
+
+    def validate(self):
+        expected = TEMPLATE_FIELDS.get(self.name)
+        if self.system is not None and self.system.fields:
+            raise ValueError(f"Prompt {self.name!r}: system template must not contain placeholders")
+        if expected is not None and set(self.user.fields) != expected:
+            missing = sorted(expected - set(self.user.fields))
+            unknown = sorted(set(self.user.fields) - expected)
+            raise ValueError(f"Prompt {self.name!r}: missing placeholders {missing}, unknown placeholders {unknown}")
+
+    def messages(self, **values):
+        """Chat messages for one request."""
+        messages = []
+        if self.system is not None:
+            messages.append({"role": "system", "content": self.system.source})
+        messages.append({"role": "user", "content": self.user.render(values)})
+        return messages
+
+
+def _read(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8', newline='') as f:
+        return f.read()
+
+
+class PromptRegistry:
+    """Templates loaded once from PROMPTS_DIR, reloadable without restarting the worker."""
+
+    def __init__(self, directory=PROMPTS_DIR, reload_interval=PROMPTS_RELOAD_INTERVAL):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self.templates = {}
+        self.mtimes = {}
+        self.checked = 0.0
+        self.lock = threading.Lock()
+        self.reload()
+
+    def _files(self, name):
+        return os.path.join(self.directory, name, 'system.txt'), os.path.join(self.directory, name, 'user.txt')
+
+    def _mtime(self, name):
+        return tuple(os.path.getmtime(path) if os.path.exists(path) else None for path in self._files(name))
+
+    def _load(self, name):
+        system_path, user_path = self._files(name)
+        user = _read(user_path)
+        if user is None:
+            raise ValueError(f"Prompt {name!r}: {user_path} not found")
+        template = PromptTemplate(name, _read(system_path), user)
+        template.validate()
+        return template
+
+    def reload(self):
+        """Load every template directory; an invalid edit keeps the previous version."""
+        with self.lock:
+            for name in sorted(os.listdir(self.directory)):
+                if not os.path.isdir(os.path.join(self.directory, name)):
+                    continue
+                mtime = self._mtime(name)
+                if self.mtimes.get(name) == mtime:
+                    continue
+                try:
+                    template = self._load(name)
+                except (OSError, ValueError) as e:
+                    if name not in self.templates:
+                        raise
+                    logging.error(f"Keeping previous prompt {name!r}: {str(e)}")
+                    continue
+                previous = self.templates.get(name)
+                self.templates[name] = template
+                self.mtimes[name] = mtime
+                if previous is not None and previous.version != template.version:
+                    logging.info(f"Reloaded prompt {name!r}: {previous.version} -> {template.version}")
+            self.checked = time.monotonic()
+
+    def get(self, name) -> PromptTemplate:
+        if self.reload_interval and time.monotonic() - self.checked > self.reload_interval:
+            self.reload()
+        return self.templates[name]
+
+    def version(self, name) -> str:
+        return self.get(name).version
+
+    def describe(self):
+        return {
+            name: {'version': template.version, 'prefix_hash': template.prefix_hash, 'fields': template.user.fields}
+            for name, template in self.templates.items()
+        }
+
+
+prompt_registry = PromptRegistry()
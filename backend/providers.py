@@ -0,0 +1,647 @@
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import TYPE_CHECKING
+from collections import OrderedDict
+
+import httpx
+
+from .streaming import iter_deltas, aiter_deltas
+from .scheduler import SchedulerRejected
+from .metrics import observe_upstream
+
+if TYPE_CHECKING:
+    from groq import Groq, AsyncGroq
+
+GROQ_MAX_CONNECTIONS = int(os.getenv('GROQ_MAX_CONNECTIONS', '20'))
+# One ASGI worker multiplexes many more concurrent streams than a threaded one
+GROQ_ASYNC_MAX_CONNECTIONS = int(os.getenv('GROQ_ASYNC_MAX_CONNECTIONS', '256'))
+GROQ_KEEPALIVE_EXPIRY = float(os.getenv('GROQ_KEEPALIVE_EXPIRY', '60'))
+GROQ_TIMEOUT = float(os.getenv('GROQ_TIMEOUT', '120'))
+# Upper bound on distinct per-request API keys kept alive at once
+GROQ_MAX_CLIENTS = int(os.getenv('GROQ_MAX_CLIENTS', '32'))
+# None uses the SDK's default endpoint; point it elsewhere for a proxy or the stub server
+GROQ_BASE_URL = os.getenv('GROQ_BASE_URL') or None
+
+# Local model used when a route falls back to Ollama; the Groq model name does not apply there
+OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', os.getenv('MODEL_NAME', 'llama3'))
+# How long Ollama keeps the model loaded after each request
+OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+# Seconds between background pings that keep the model resident while idle; 0 disables them
+OLLAMA_WARM_INTERVAL = float(os.getenv('OLLAMA_WARM_INTERVAL', '240'))
+OLLAMA_TIMEOUT = float(os.getenv('OLLAMA_TIMEOUT', '300'))
+OLLAMA_MAX_CONNECTIONS = int(os.getenv('OLLAMA_MAX_CONNECTIONS', '8'))
+
+# Providers in order of preference; the first takes traffic and the rest are fallbacks
+LLM_PROVIDERS = [name.strip() for name in os.getenv('LLM_PROVIDERS', 'groq,ollama').split(',') if name.strip()]
+# Per-route traffic weights, e.g. {"tailor": {"groq": 1, "ollama": 1}}; weight 0 means fallback only
+LLM_ROUTE_WEIGHTS = json.loads(os.getenv('LLM_ROUTE_WEIGHTS', '{}'))
+# Consecutive failures that open a provider's circuit, and how long it stays open
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', '3'))
+LLM_BREAKER_COOLDOWN = float(os.getenv('LLM_BREAKER_COOLDOWN', '30'))
+# A first token slower than this counts against the provider as if the call had failed
+LLM_SLOW_FIRST_TOKEN = float(os.getenv('LLM_SLOW_FIRST_TOKEN', '8'))
+# Weight of the newest observation in each provider's moving averages
+HEALTH_DECAY = 0.2
+
+# The Groq SDK's own retries; unset, the SDK default applies unless the router has another enabled provider
+# to fail over to, whose retry would only be delayed by the SDK's backoff
+GROQ_MAX_RETRIES = int(os.environ['GROQ_MAX_RETRIES']) if os.getenv('GROQ_MAX_RETRIES') else None
+GROQ_SDK_RETRIES = 2
+
+_clients = OrderedDict()
+# Async clients are bound to the event loop that created their connection pool
+_async_clients = OrderedDict()
+_clients_lock = threading.Lock()
+_clients_pid = os.getpid()
+
+
+class ProviderError(Exception):
+    """A provider call that failed; retryable errors fail over to the next provider."""
+
+    def __init__(self, message, provider, retryable=True, retry_after=None, status=None):
+        super().__init__(message)
+        self.provider = provider
+        self.retryable = retryable
+        self.retry_after = retry_after
+        self.status = status
+
+
+class ProvidersUnavailable(SchedulerRejected):
+    """Every provider for a route failed or has its circuit open."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message, 503, retry_after)
+
+
+def groq_sdk():
+    """The groq package, imported on first use since it is slow to import and idle until a call."""
+    import groq
+    return groq
+
+
+def client_key(api_key):
+    return hashlib.sha256((api_key or '').encode()).hexdigest()
+
+
+def _pool_limits(max_connections=GROQ_MAX_CONNECTIONS):
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=GROQ_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_groq_client(api_key=None, max_retries=GROQ_SDK_RETRIES) -> 'Groq':
+    """Return the process-wide pooled Groq client for an API key, creating it on first use."""
+    global _clients_pid
+    api_key = api_key or os.environ.get("GROQ_API_KEY")
+    key = (client_key(api_key), max_retries)
+    with _clients_lock:
+        if _clients_pid != os.getpid():
+            # Forked worker: connections inherited from the parent must not be shared
+            _clients.clear()
+            _async_clients.clear()
+            _clients_pid = os.getpid()
+        client = _clients.get(key)
+        if client is not None:
+            _clients.move_to_end(key)
+            return client
+        http_client = httpx.Client(limits=_pool_limits(), timeout=GROQ_TIMEOUT)
+        client = groq_sdk().Groq(api_key=api_key, base_url=GROQ_BASE_URL, max_retries=max_retries,
+                                 http_client=http_client)
+        _clients[key] = client
+        if len(_clients) > GROQ_MAX_CLIENTS:
+            # In-flight requests keep their own reference; the pool closes once unreferenced
+            _clients.popitem(last=False)
+        logging.info(f"Created pooled Groq client ({len(_clients)} cached)")
+        return client
+
+
+def get_async_groq_client(api_key=None, max_retries=GROQ_SDK_RETRIES) -> 'AsyncGroq':
+    """Return the pooled AsyncGroq client for an API key on the running event loop."""
+    api_key = api_key or os.environ.get("GROQ_API_KEY")
+    key = (client_key(api_key), max_retries, id(asyncio.get_running_loop()))
+    with _clients_lock:
+        client = _async_clients.get(key)
+        if client is not None:
+            _async_clients.move_to_end(key)
+            return client
+        http_client = httpx.AsyncClient(limits=_pool_limits(GROQ_ASYNC_MAX_CONNECTIONS), timeout=GROQ_TIMEOUT)
+        client = groq_sdk().AsyncGroq(api_key=api_key, base_url=GROQ_BASE_URL, max_retries=max_retries,
+                                      http_client=http_client)
+        _async_clients[key] = client
+        if len(_async_clients) > GROQ_MAX_CLIENTS:
+            _async_clients.popitem(last=False)
+        logging.info(f"Created pooled AsyncGroq client ({len(_async_clients)} cached)")
+        return client
+
+
+def _retry_after(headers):
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """Closed while a provider works; open after repeated failures; half-open lets one trial call through."""
+
+    def __init__(self, failures=LLM_BREAKER_FAILURES, cooldown=LLM_BREAKER_COOLDOWN):
+        self.threshold = failures
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_until = 0.0
+        self.trial = False
+        self.opens = 0
+        self.lock = threading.Lock()
+
+    def available(self):
+        """Whether a call could be admitted now, without reserving the half-open trial."""
+        with self.lock:
+            return self.state == 'closed' or (not self.trial and time.monotonic() >= self.opened_until)
+
+    def allow(self):
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open':
+                if time.monotonic() < self.opened_until:
+                    return False
+                self.state = 'half_open'
+                self.trial = False
+            if self.trial:
+                return False
+            self.trial = True
+            return True
+
+    def success(self):
+        with self.lock:
+            self.state = 'closed'
+            self.failures = 0
+            self.trial = False
+
+    def failure(self, retry_after=None):
+        with self.lock:
+            self.failures += 1
+            self.trial = False
+            if self.state == 'half_open' or self.failures >= self.threshold or retry_after:
+                if self.state != 'open':
+                    self.opens += 1
+                self.state = 'open'
+                # A rate limit's Retry-After outlasts the default cooldown when it is longer
+                self.opened_until = time.monotonic() + max(self.cooldown, retry_after or 0)
+
+    def retry_in(self):
+        with self.lock:
+            return max(0.0, self.opened_until - time.monotonic())
+
+    def stats(self):
+        with self.lock:
+            return {'state': self.state, 'consecutive_failures': self.failures, 'opens': self.opens,
+                    'retry_in': round(max(0.0, self.opened_until - time.monotonic()), 3)}
+
+
+class Provider:
+    """One LLM backend. open_stream returns deltas once the request has been accepted upstream."""
+
+    name = None
+
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+        # The other providers of the router this one belongs to
+        self.peers = []
+        self.lock = threading.Lock()
+        self.success_rate = 1.0
+        self.first_token = None
+        self.calls = 0
+        self.errors = 0
+        self.slow = 0
+
+    @property
+    def enabled(self):
+        return True
+
+    def open_stream(self, request, api_key, usage=None):
+        raise NotImplementedError
+
+    async def aopen_stream(self, request, api_key, usage=None):
+        raise NotImplementedError
+
+    def health(self):
+        """Share of recent calls that succeeded, discounted by how slow first tokens have been."""
+        with self.lock:
+            latency = self.first_token or 0.0
+            return self.success_rate / (1.0 + latency / LLM_SLOW_FIRST_TOKEN)
+
+    def record_first_token(self, seconds):
+        slow = seconds > LLM_SLOW_FIRST_TOKEN
+        with self.lock:
+            self.calls += 1
+            self.slow += slow
+            self.first_token = seconds if self.first_token is None else (
+                (1 - HEALTH_DECAY) * self.first_token + HEALTH_DECAY * seconds)
+            self.success_rate = (1 - HEALTH_DECAY) * self.success_rate + HEALTH_DECAY * (0.0 if slow else 1.0)
+        if slow:
+            logging.warning(f"{self.name} took {seconds:.1f}s to the first token")
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+
+    def record_failure(self, error):
+        with self.lock:
+            self.calls += 1
+            self.errors += 1
+            self.success_rate = (1 - HEALTH_DECAY) * self.success_rate
+        # Requests the provider rejected as invalid say nothing about its health
+        if getattr(error, 'retryable', True):
+            self.breaker.failure(getattr(error, 'retry_after', None))
+        else:
+            self.breaker.success()
+
+    def stats(self):
+        with self.lock:
+            stats = {
+                'enabled': self.enabled,
+                'calls': self.calls,
+                'errors': self.errors,
+                'slow': self.slow,
+                'success_rate': round(self.success_rate, 3),
+                'first_token_seconds': None if self.first_token is None else round(self.first_token, 3),
+            }
+        stats['health'] = round(self.health(), 3)
+        stats['breaker'] = self.breaker.stats()
+        return stats
+
+
+class GroqProvider(Provider):
+    name = 'groq'
+
+    def _error(self, e):
+        if isinstance(e, groq_sdk().APIStatusError):
+            status = e.status_code
+            retryable = status == 429 or status >= 500
+            return ProviderError(f"Groq returned {status}: {e.message}", self.name, retryable,
+                                 _retry_after(e.response.headers) if status == 429 else None, status)
+        if isinstance(e, ProviderError):
+            return e
+        # Connection failures and timeouts
+        return ProviderError(f"Groq request failed: {str(e)}", self.name)
+
+    def _create_args(self, request):
+        return dict(messages=request['messages'], model=request['model'], temperature=request['temperature'],
+                    max_tokens=request['max_tokens'], top_p=request['top_p'], stream=True)
+
+    @property
+    def max_retries(self):
+        """SDK retries for a call: none when an enabled peer can take it instead, else the SDK default."""
+        if GROQ_MAX_RETRIES is not None:
+            return GROQ_MAX_RETRIES
+        # Checked per call, since Ollama's base URL can be set after the router is built
+        return 0 if any(peer.enabled for peer in self.peers) else GROQ_SDK_RETRIES
+
+    def open_stream(self, request, api_key, usage=None):
+        try:
+            chat_completion = get_groq_client(api_key, self.max_retries).chat.completions.create(
+                **self._create_args(request))
+        except Exception as e:
+            raise self._error(e) from e
+        return self._relay(chat_completion, usage)
+
+    def _relay(self, chat_completion, usage):
+        try:
+            yield from iter_deltas(chat_completion, usage)
+        except Exception as e:
+            raise self._error(e) from e
+
+    async def aopen_stream(self, request, api_key, usage=None):
+        try:
+            chat_completion = await get_async_groq_client(api_key, self.max_retries).chat.completions.create(
+                **self._create_args(request))
+        except Exception as e:
+            raise self._error(e) from e
+        return self._arelay(chat_completion, usage)
+
+    async def _arelay(self, chat_completion, usage):
+        try:
+            async for delta in aiter_deltas(chat_completion, usage):
+                yield delta
+        except Exception as e:
+            raise self._error(e) from e
+
+
+class OllamaProvider(Provider):
+    """Ollama's /api/chat, streamed as newline-delimited JSON, with the model kept loaded between calls."""
+
+    name = 'ollama'
+
+    def __init__(self, base_url=None, model=OLLAMA_MODEL, keep_alive=OLLAMA_KEEP_ALIVE,
+                 warm_interval=OLLAMA_WARM_INTERVAL):
+        super().__init__()
+        self._base_url = base_url
+        self.model = model
+        self.keep_alive = keep_alive
+        self.warm_interval = warm_interval
+        self.client = None
+        self.client_pid = None
+        self.async_clients = {}
+        self.warmer = None
+        self.warmer_pid = None
+        self.last_used = 0.0
+        self.warmups = 0
+
+    @property
+    def base_url(self):
+        # Read on use: main loads .env.local after this module is imported
+        return (self._base_url or os.getenv('OLLAMA_BASE_URL') or '').rstrip('/')
+
+    @property
+    def enabled(self):
+        return bool(self.base_url)
+
+    def _client(self):
+        with self.lock:
+            if self.client is None or self.client_pid != os.getpid():
+                limits = httpx.Limits(max_connections=OLLAMA_MAX_CONNECTIONS,
+                                      max_keepalive_connections=OLLAMA_MAX_CONNECTIONS)
+                self.client = httpx.Client(limits=limits, timeout=OLLAMA_TIMEOUT)
+                self.client_pid = os.getpid()
+            return self.client
+
+    def _async_client(self):
+        loop_id = id(asyncio.get_running_loop())
+        with self.lock:
+            client = self.async_clients.get(loop_id)
+            if client is None:
+                limits = httpx.Limits(max_connections=OLLAMA_MAX_CONNECTIONS,
+                                      max_keepalive_connections=OLLAMA_MAX_CONNECTIONS)
+                client = self.async_clients[loop_id] = httpx.AsyncClient(limits=limits, timeout=OLLAMA_TIMEOUT)
+            return client
+
+    def _payload(self, request):
+        return {
+            'model': self.model,
+            'messages': request['messages'],
+            'stream': True,
+            'keep_alive': self.keep_alive,
+            'options': {
+                'temperature': request['temperature'],
+                'top_p': request['top_p'],
+                'num_predict': request['max_tokens'],
+            },
+        }
+
+    def _status_error(self, response, body):
+        retryable = response.status_code == 429 or response.status_code >= 500
+        detail = body.decode('utf-8', 'replace')[:200]
+        return ProviderError(f"Ollama returned {response.status_code}: {detail}", self.name, retryable,
+                             _retry_after(response.headers), response.status_code)
+
+    def _line_delta(self, line, usage):
+        data = json.loads(line)
+        if data.get('error'):
+            raise ProviderError(f"Ollama error: {data['error']}", self.name)
+        done = data.get('done', False)
+        if done and usage is not None:
+            # The final line carries the generated token count and why generation stopped
+            if data.get('eval_count') is not None:
+                usage['completion_tokens'] = data['eval_count']
+            if data.get('done_reason'):
+                usage['finish_reason'] = data['done_reason']
+        return (data.get('message') or {}).get('content') or '', done
+
+    def open_stream(self, request, api_key, usage=None):
+        if not self.enabled:
+            raise ProviderError("OLLAMA_BASE_URL is not set", self.name)
+        self._ensure_warmer()
+        self.last_used = time.monotonic()
+        client = self._client()
+        try:
+            response = client.send(client.build_request('POST', f"{self.base_url}/api/chat",
+                                                        json=self._payload(request)), stream=True)
+        except httpx.HTTPError as e:
+            raise ProviderError(f"Ollama request failed: {str(e)}", self.name) from e
+        if response.status_code >= 400:
+            body = response.read()
+            response.close()
+            raise self._status_error(response, body)
+        return self._relay(response, usage)
+
+    def _relay(self, response, usage):
+        try:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                content, done = self._line_delta(line, usage)
+                if content:
+                    yield content
+                if done:
+                    break
+        except httpx.HTTPError as e:
+            raise ProviderError(f"Ollama stream failed: {str(e)}", self.name) from e
+        finally:
+            response.close()
+
+    async def aopen_stream(self, request, api_key, usage=None):
+        if not self.enabled:
+            raise ProviderError("OLLAMA_BASE_URL is not set", self.name)
+        self._ensure_warmer()
+        self.last_used = time.monotonic()
+        client = self._async_client()
+        try:
+            response = await client.send(client.build_request('POST', f"{self.base_url}/api/chat",
+                                                              json=self._payload(request)), stream=True)
+        except httpx.HTTPError as e:
+            raise ProviderError(f"Ollama request failed: {str(e)}", self.name) from e
+        if response.status_code >= 400:
+            body = await response.aread()
+            await response.aclose()
+            raise self._status_error(response, body)
+        return self._arelay(response, usage)
+
+    async def _arelay(self, response, usage):
+        try:
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                content, done = self._line_delta(line, usage)
+                if content:
+                    yield content
+                if done:
+                    break
+        except httpx.HTTPError as e:
+            raise ProviderError(f"Ollama stream failed: {str(e)}", self.name) from e
+        finally:
+            await response.aclose()
+
+    def warm(self):
+        """Load the model, or extend its keep_alive, without generating anything."""
+        self._client().post(f"{self.base_url}/api/generate",
+                            json={'model': self.model, 'keep_alive': self.keep_alive}).raise_for_status()
+        with self.lock:
+            self.warmups += 1
+
+    def _ensure_warmer(self):
+        if not self.warm_interval or (self.warmer is not None and self.warmer_pid == os.getpid()):
+            return
+        with self.lock:
+            if self.warmer is not None and self.warmer_pid == os.getpid():
+                return
+            self.warmer_pid = os.getpid()
+            self.warmer = threading.Thread(target=self._warm_loop, name='ollama-warmer', daemon=True)
+            self.warmer.start()
+
+    def _warm_loop(self):
+        while True:
+            # Requests already keep the model loaded; only ping after a quiet spell
+            if time.monotonic() - self.last_used >= self.warm_interval / 2:
+                try:
+                    self.warm()
+                except Exception as e:
+                    logging.warning(f"Ollama warm-up failed: {str(e)}")
+            time.sleep(self.warm_interval)
+
+    def stats(self):
+        stats = super().stats()
+        stats['model'] = self.model
+        stats['warmups'] = self.warmups
+        return stats
+
+
+PROVIDER_TYPES = {'groq': GroqProvider, 'ollama': OllamaProvider}
+
+
+class ProviderRouter:
+    """Picks a provider per call from the route's weights and each provider's health, failing over on error.
+
+    Failover only happens before the first delta: once text has reached the client, switching providers
+    would splice two different generations, so a mid-stream failure is raised to the caller instead.
+    """
+
+    def __init__(self, names=LLM_PROVIDERS, route_weights=LLM_ROUTE_WEIGHTS):
+        self.providers = OrderedDict((name, PROVIDER_TYPES[name]()) for name in names)
+        for provider in self.providers.values():
+            provider.peers = [peer for peer in self.providers.values() if peer is not provider]
+        self.route_weights = route_weights
+        self.lock = threading.Lock()
+        self.failovers = 0
+
+    def weights(self, route):
+        configured = self.route_weights.get(route or '', {})
+        return {name: float(configured.get(name, 1.0 if index == 0 else 0.0))
+                for index, name in enumerate(self.providers)}
+
+    def candidates(self, route):
+        """Providers to try for route, in order: one weighted-random pick, then the rest by health."""
+        weights = self.weights(route)
+        usable = [p for p in self.providers.values() if p.enabled]
+        scored = {p.name: weights[p.name] * p.health() for p in usable if p.breaker.available()}
+        primary = [p for p in usable if scored.get(p.name, 0) > 0]
+        order = []
+        if primary:
+            order.append(random.choices(primary, weights=[scored[p.name] for p in primary])[0])
+        # Fallbacks: remaining weighted providers, then fallback-only ones, healthiest first
+        rest = [p for p in usable if p not in order]
+        rest.sort(key=lambda p: (weights[p.name] > 0, p.breaker.available(), p.health()), reverse=True)
+        return order + rest
+
+    def _exhausted(self, route, errors):
+        retry_after = min((p.breaker.retry_in() for p in self.providers.values() if p.enabled),
+                          default=LLM_BREAKER_COOLDOWN)
+        detail = '; '.join(str(e) for e in errors) or 'all circuits open'
+        logging.error(f"No LLM provider available for {route}: {detail}")
+        return ProvidersUnavailable(f"LLM providers unavailable: {detail}", retry_after or 1)
+
+    def _failed(self, provider, error, errors):
+        if not isinstance(error, ProviderError):
+            error = ProviderError(str(error), provider.name)
+        provider.record_failure(error)
+        errors.append(error)
+        if not error.retryable:
+            raise error
+        logging.warning(f"{provider.name} failed, trying the next provider: {str(error)}")
+        with self.lock:
+            self.failovers += 1
+
+    def stream(self, route, request, api_key=None, usage=None):
+        """Iterator over the deltas of the first provider that starts streaming for this route.
+
+        usage, if given, is filled with the completion_tokens and finish_reason the provider reports.
+        """
+        errors = []
+        for provider in self.candidates(route):
+            if not provider.breaker.allow():
+                continue
+            started = time.monotonic()
+            try:
+                deltas = provider.open_stream(request, api_key, usage)
+                observe_upstream(route, request['model'], 'connect', time.monotonic() - started)
+                first = next(deltas, None)
+            except Exception as e:
+                self._failed(provider, e, errors)
+                continue
+            provider.record_first_token(time.monotonic() - started)
+            return self._relay(provider, first, deltas)
+        raise self._exhausted(route, errors)
+
+    def _relay(self, provider, first, deltas):
+        if first is None:
+            return
+        yield first
+        try:
+            yield from deltas
+        except Exception as e:
+            provider.record_failure(e)
+            raise
+        finally:
+            deltas.close()
+
+    async def astream(self, route, request, api_key=None, usage=None):
+        """Async counterpart of stream."""
+        errors = []
+        for provider in self.candidates(route):
+            if not provider.breaker.allow():
+                continue
+            started = time.monotonic()
+            try:
+                deltas = await provider.aopen_stream(request, api_key, usage)
+                observe_upstream(route, request['model'], 'connect', time.monotonic() - started)
+                # Not anext(): the image runs Python 3.9
+                try:
+                    first = await deltas.__anext__()
+                except StopAsyncIteration:
+                    first = None
+            except Exception as e:
+                self._failed(provider, e, errors)
+                continue
+            provider.record_first_token(time.monotonic() - started)
+            return self._arelay(provider, first, deltas)
+        raise self._exhausted(route, errors)
+
+    async def _arelay(self, provider, first, deltas):
+        if first is None:
+            return
+        yield first
+        try:
+            async for delta in deltas:
+                yield delta
+        except Exception as e:
+            provider.record_failure(e)
+            raise
+        finally:
+            await deltas.aclose()
+
+    def stats(self):
+        with self.lock:
+            failovers = self.failovers
+        return {
+            'providers': {name: provider.stats() for name, provider in self.providers.items()},
+            'failovers': failovers,
+            'route_weights': self.route_weights,
+        }
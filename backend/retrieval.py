@@ -0,0 +1,392 @@
+import os
+import re
+import math
+import zlib
+import sqlite3
+import logging
+import threading
+from functools import lru_cache
+from collections import Counter, defaultdict
+
+import numpy as np
+
+RETRIEVAL_DIR = os.getenv('RETRIEVAL_DIR', os.path.join('user_data', 'index'))
+# 'hashing' needs no model; 'ollama' embeds with OLLAMA_BASE_URL / RETRIEVAL_EMBEDDING_MODEL
+RETRIEVAL_EMBEDDER = os.getenv('RETRIEVAL_EMBEDDER', 'hashing')
+RETRIEVAL_EMBEDDING_MODEL = os.getenv('RETRIEVAL_EMBEDDING_MODEL', 'nomic-embed-text')
+# 128 float32 dimensions keep 100k chunks at 51 MB, small enough to scan in a few milliseconds
+RETRIEVAL_DIMENSIONS = int(os.getenv('RETRIEVAL_DIMENSIONS', '128'))
+RETRIEVAL_CHUNK_WORDS = int(os.getenv('RETRIEVAL_CHUNK_WORDS', '120'))
+RETRIEVAL_CHUNK_OVERLAP = int(os.getenv('RETRIEVAL_CHUNK_OVERLAP', '20'))
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Terms in nearly every chunk (idf below this) cannot change the ranking but cost a full scan
+BM25_MIN_IDF = 0.05
+# Reciprocal rank fusion constant; 60 is the value from the original RRF paper
+RRF_K = 60
+# Appends add a postings segment per term; once a term has this many, its newer segments are merged
+MAX_SEGMENTS = 8
+
+SELECT_TERM_BYTES = 'SELECT SUM(LENGTH(ids)) FROM postings WHERE term = ?'
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    'a an and are as at be by for from has have i in is it its of on or that the their this to was were will with'.split()
+)
+
+
+def tokenize(text):
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def chunk_text(text, words=RETRIEVAL_CHUNK_WORDS, overlap=RETRIEVAL_CHUNK_OVERLAP):
+    """Split text into overlapping windows of words."""
+    tokens = text.split()
+    if not tokens:
+        return []
+    step = max(1, words - overlap)
+    return [' '.join(tokens[start:start + words]) for start in range(0, max(1, len(tokens) - overlap), step)]
+
+
+@lru_cache(maxsize=1 << 17)
+def _feature_hash(feature):
+    digest = zlib.crc32(feature.encode('utf-8'))
+    return digest, 1.0 if digest & 0x80000000 else -1.0
+
+
+class HashingEmbedder:
+    """Signed feature hashing of unigrams and bigrams: no model, identical in every process."""
+
+    name = 'hashing'
+
+    def __init__(self, dimensions=RETRIEVAL_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            hashed = [_feature_hash(feature) for feature in tokens + [f'{a} {b}' for a, b in zip(tokens, tokens[1:])]]
+            if hashed:
+                digests, signs = zip(*hashed)
+                vectors[row] = np.bincount(np.array(digests, dtype=np.int64) % self.dimensions,
+                                           weights=signs, minlength=self.dimensions)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class OllamaEmbedder:
+    """Embeddings from the Ollama server the Agent already talks to."""
+
+    name = 'ollama'
+
+    def __init__(self, model=RETRIEVAL_EMBEDDING_MODEL, base_url=None):
+        from langchain_ollama import OllamaEmbeddings
+        self.client = OllamaEmbeddings(model=model, base_url=base_url or os.getenv('OLLAMA_BASE_URL'))
+        self.name = f'ollama-{model}'
+        self.dimensions = len(self.client.embed_query('dimension probe'))
+
+    def embed(self, texts):
+        vectors = np.asarray(self.client.embed_documents(list(texts)), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+def create_embedder():
+    if RETRIEVAL_EMBEDDER == 'ollama':
+        return OllamaEmbedder()
+    if RETRIEVAL_EMBEDDER != 'hashing':
+        logging.warning(f"Unknown RETRIEVAL_EMBEDDER {RETRIEVAL_EMBEDDER!r}, using hashing")
+    return HashingEmbedder()
+
+
+class IndexView:
+    """Memory-mapped vectors and chunk lengths for the chunks committed at one point in time."""
+
+    def __init__(self, count, vectors, lengths):
+        self.count = count
+        self.vectors = vectors
+        self.lengths = lengths
+        average_length = float(lengths.mean()) if count else 1.0
+        # The length-normalization term of BM25, fixed for every query against this view
+        self.norm = (BM25_K1 * (1 - BM25_B + BM25_B * np.asarray(lengths, dtype=np.float32) / max(average_length, 1e-9))).astype(np.float32)
+
+
+class RetrievalIndex:
+    """Append-only hybrid index: dense vectors in a memory-mapped matrix plus BM25 postings in SQLite.
+
+    Chunk i's vector is row i of vectors.f32 and its token count is entry i of lengths.u32. Both files are
+    written before the SQLite transaction that adds the chunk commits, so a reader that only looks at
+    committed chunk ids never sees a half-written row. Nothing is read eagerly; the OS pages rows in on use.
+    """
+
+    def __init__(self, directory=RETRIEVAL_DIR, embedder=None):
+        self.directory = directory
+        self.embedder = embedder or create_embedder()
+        self.dimensions = self.embedder.dimensions
+        self.db_path = os.path.join(directory, 'chunks.sqlite')
+        self.vectors_path = os.path.join(directory, 'vectors.f32')
+        self.lengths_path = os.path.join(directory, 'lengths.u32')
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.view = IndexView(0, np.zeros((0, self.dimensions), dtype=np.float32), np.zeros(0, dtype=np.uint32))
+        os.makedirs(directory, exist_ok=True)
+        for path in (self.vectors_path, self.lengths_path):
+            open(path, 'ab').close()
+        conn = self._conn()
+        conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS chunks ('
+            'id INTEGER PRIMARY KEY, source TEXT NOT NULL, source_id TEXT NOT NULL, text TEXT NOT NULL, '
+            'live INTEGER NOT NULL DEFAULT 1)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source, source_id)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS postings ('
+            'term TEXT NOT NULL, first_id INTEGER NOT NULL, ids BLOB NOT NULL, tfs BLOB NOT NULL, '
+            'PRIMARY KEY (term, first_id)) WITHOUT ROWID'
+        )
+        signature = f'{self.embedder.name}:{self.dimensions}'
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('embedder', ?)", (signature,))
+        conn.commit()
+        stored = conn.execute("SELECT value FROM meta WHERE key = 'embedder'").fetchone()[0]
+        if stored != signature:
+            raise ValueError(f"Index at {directory} was built with {stored}, not {signature}; rebuild it or change RETRIEVAL_DIR")
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, cached_statements=64)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+            self.local.data_version = None
+        return conn
+
+    def _current_view(self, conn):
+        """The view of every committed chunk, re-mapped only when another connection has appended."""
+        data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        if data_version == self.local.data_version:
+            return self.view
+        count = conn.execute('SELECT COALESCE(MAX(id) + 1, 0) FROM chunks').fetchone()[0]
+        with self.lock:
+            if count != self.view.count:
+                vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(count, self.dimensions)) \
+                    if count else self.view.vectors
+                lengths = np.memmap(self.lengths_path, dtype=np.uint32, mode='r', shape=(count,)) \
+                    if count else self.view.lengths
+                self.view = IndexView(count, vectors, lengths)
+            view = self.view
+        self.local.data_version = data_version
+        return view
+
+    def has(self, source, source_id):
+        row = self._conn().execute(
+            'SELECT 1 FROM chunks WHERE source = ? AND source_id = ? AND live = 1 LIMIT 1', (source, source_id)
+        ).fetchone()
+        return row is not None
+
+    def add(self, source, source_id, text, replace=False):
+        """Chunk, embed and append a document; returns the number of chunks added.
+
+        A document already indexed under (source, source_id) is skipped unless replace is set, in which case
+        its old chunks stop being returned.
+        """
+        return self.add_many([(source, source_id, text)], replace)
+
+    def add_many(self, documents, replace=False):
+        """Append (source, source_id, text) documents in one transaction; returns the number of chunks added."""
+        prepared = []
+        for source, source_id, text in documents:
+            chunks = chunk_text(text)
+            if chunks and (replace or not self.has(source, source_id)):
+                prepared.append((source, source_id, chunks))
+        if not prepared:
+            return 0
+        all_chunks = [chunk for _, _, chunks in prepared for chunk in chunks]
+        vectors = self.embedder.embed(all_chunks)
+        token_lists = [tokenize(chunk) for chunk in all_chunks]
+
+        conn = self._conn()
+        # IMMEDIATE takes SQLite's write lock, which also serializes appends to the two data files
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows, keep = [], []
+            start = conn.execute('SELECT COALESCE(MAX(id) + 1, 0) FROM chunks').fetchone()[0]
+            offset = 0
+            for source, source_id, chunks in prepared:
+                positions = range(offset, offset + len(chunks))
+                offset += len(chunks)
+                # Re-checked under the write lock: another worker may have indexed it since has() ran
+                if conn.execute('SELECT 1 FROM chunks WHERE source = ? AND source_id = ? AND live = 1 LIMIT 1',
+                                (source, source_id)).fetchone():
+                    if not replace:
+                        continue
+                    conn.execute('UPDATE chunks SET live = 0 WHERE source = ? AND source_id = ?', (source, source_id))
+                for position in positions:
+                    rows.append((start + len(keep), source, source_id, all_chunks[position]))
+                    keep.append(position)
+            if not keep:
+                conn.rollback()
+                return 0
+            ids = range(start, start + len(keep))
+            conn.executemany('INSERT INTO chunks (id, source, source_id, text) VALUES (?, ?, ?, ?)', rows)
+            self._write_rows(self.vectors_path, start * self.dimensions * 4, vectors[keep].astype(np.float32))
+            self._write_rows(self.lengths_path, start * 4,
+                             np.array([len(token_lists[position]) for position in keep], dtype=np.uint32))
+            self._append_postings(conn, ids, [token_lists[position] for position in keep])
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        # A connection's own commits leave its data_version unchanged, so force the next search to re-map
+        self.local.data_version = None
+        return len(keep)
+
+    @staticmethod
+    def _write_rows(path, offset, array):
+        fd = os.open(path, os.O_WRONLY)
+        try:
+            os.pwrite(fd, array.tobytes(), offset)
+        finally:
+            os.close(fd)
+
+    def _append_postings(self, conn, ids, token_lists):
+        postings = defaultdict(lambda: ([], []))
+        for chunk_id, tokens in zip(ids, token_lists):
+            for term, tf in Counter(tokens).items():
+                postings[term][0].append(chunk_id)
+                postings[term][1].append(min(tf, 65535))
+        rows = [
+            (term, chunk_ids[0], np.array(chunk_ids, dtype=np.uint32).tobytes(), np.array(tfs, dtype=np.uint16).tobytes())
+            for term, (chunk_ids, tfs) in postings.items()
+        ]
+        conn.executemany('INSERT INTO postings (term, first_id, ids, tfs) VALUES (?, ?, ?, ?)', rows)
+        for term in postings:
+            self._merge_segments(conn, term)
+
+    @staticmethod
+    def _merge_segments(conn, term):
+        """Tiered merge: small recent segments fold together, and into the oldest only once they rival it.
+
+        Each posting is rewritten O(log n) times instead of on every append.
+        """
+        sizes = conn.execute('SELECT first_id, LENGTH(ids) FROM postings WHERE term = ? ORDER BY first_id', (term,)).fetchall()
+        if len(sizes) < MAX_SEGMENTS:
+            return
+        first_id = sizes[1][0]
+        if sum(size for _, size in sizes[1:]) >= sizes[0][1]:
+            first_id = sizes[0][0]
+        segments = conn.execute('SELECT ids, tfs FROM postings WHERE term = ? AND first_id >= ? ORDER BY first_id',
+                                (term, first_id)).fetchall()
+        conn.execute('DELETE FROM postings WHERE term = ? AND first_id >= ?', (term, first_id))
+        conn.execute('INSERT INTO postings (term, first_id, ids, tfs) VALUES (?, ?, ?, ?)',
+                     (term, first_id, b''.join(segment[0] for segment in segments), b''.join(segment[1] for segment in segments)))
+
+    def _postings(self, conn, term):
+        segments = conn.execute('SELECT ids, tfs FROM postings WHERE term = ? ORDER BY first_id', (term,)).fetchall()
+        if not segments:
+            return None, None
+        ids = np.frombuffer(b''.join(segment[0] for segment in segments), dtype=np.uint32)
+        tfs = np.frombuffer(b''.join(segment[1] for segment in segments), dtype=np.uint16)
+        return ids, tfs
+
+    def _bm25(self, conn, view, query, candidates):
+        scores = np.zeros(view.count, dtype=np.float32)
+        for term in set(tokenize(query)):
+            # Document frequency comes from the blob sizes, so skipped terms never have their postings read
+            df = min(view.count, (conn.execute(SELECT_TERM_BYTES, (term,)).fetchone()[0] or 0) // 4)
+            if not df:
+                continue
+            idf = math.log(1 + (view.count - df + 0.5) / (df + 0.5))
+            if idf < BM25_MIN_IDF:
+                continue
+            ids, tfs = self._postings(conn, term)
+            if ids[-1] >= view.count:
+                # Postings committed after this view was taken refer to rows it cannot see yet
+                visible = ids < view.count
+                ids, tfs = ids[visible], tfs[visible]
+            ids, tfs = ids.astype(np.int64), tfs.astype(np.float32)
+            scores[ids] += idf * (BM25_K1 + 1) * tfs / (tfs + view.norm[ids])
+        return scores if candidates is None else scores[candidates]
+
+    @staticmethod
+    def _top(scores, n):
+        n = min(n, len(scores))
+        if n <= 0:
+            return np.zeros(0, dtype=np.int64)
+        top = np.argpartition(-scores, n - 1)[:n]
+        return top[np.argsort(-scores[top], kind='stable')]
+
+    def search(self, query, k=5, source=None, source_id=None):
+        """Top-k chunks by reciprocal rank fusion of dense and BM25 rankings.
+
+        With source/source_id, only that document's chunks are ranked. Returns dicts with id, source,
+        source_id, text and score.
+        """
+        conn = self._conn()
+        view = self._current_view(conn)
+        if not view.count or not query.strip():
+            return []
+        candidates = None
+        if source is not None:
+            sql, params = 'SELECT id FROM chunks WHERE source = ? AND live = 1', [source]
+            if source_id is not None:
+                sql, params = sql + ' AND source_id = ?', params + [source_id]
+            candidates = np.array([row[0] for row in conn.execute(sql, params)], dtype=np.int64)
+            candidates = candidates[candidates < view.count]
+            if not len(candidates):
+                return []
+
+        query_vector = self.embedder.embed([query])[0]
+        dense = (view.vectors if candidates is None else view.vectors[candidates]) @ query_vector
+        lexical = self._bm25(conn, view, query, candidates)
+
+        # Over-fetch so chunks of replaced documents can be dropped without coming up short
+        depth = max(4 * k, 50)
+        fused = defaultdict(float)
+        for ranking, scores in ((self._top(dense, depth), dense), (self._top(lexical, depth), lexical)):
+            for rank, position in enumerate(ranking):
+                if scores[position] > 0:
+                    fused[int(position)] += 1.0 / (RRF_K + rank + 1)
+        if not fused:
+            return []
+        ordered = sorted(fused.items(), key=lambda item: -item[1])[:depth]
+        ids = [int(candidates[position]) if candidates is not None else position for position, _ in ordered]
+        scores = {chunk_id: score for chunk_id, (_, score) in zip(ids, ordered)}
+        rows = conn.execute(
+            f"SELECT id, source, source_id, text FROM chunks WHERE live = 1 AND id IN ({','.join('?' * len(ids))})", ids
+        ).fetchall()
+        results = [
+            {'id': row[0], 'source': row[1], 'source_id': row[2], 'text': row[3], 'score': scores[row[0]]}
+            for row in rows
+        ]
+        results.sort(key=lambda result: -result['score'])
+        return results[:k]
+
+    def stats(self):
+        conn = self._conn()
+        view = self._current_view(conn)
+        return {
+            'chunks': view.count,
+            'live_chunks': conn.execute('SELECT COUNT(*) FROM chunks WHERE live = 1').fetchone()[0],
+            'dimensions': self.dimensions,
+            'embedder': self.embedder.name,
+        }
+
+
+# Built on first use by get_retrieval_index(), so importing the app creates nothing on disk
+retrieval_index = None
+retrieval_index_lock = threading.Lock()
+
+
+def get_retrieval_index():
+    """The shared retrieval index, opened the first time something needs it."""
+    global retrieval_index
+    if retrieval_index is None:
+        with retrieval_index_lock:
+            if retrieval_index is None:
+                retrieval_index = RetrievalIndex()
+    return retrieval_index
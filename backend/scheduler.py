@@ -0,0 +1,343 @@
+import os
+import math
+import time
+import asyncio
+import logging
+import itertools
+import threading
+from collections import OrderedDict
+
+# Concurrent upstream generations per worker, and how many more may wait for a slot
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '256'))
+LLM_MAX_QUEUE = int(os.getenv('LLM_MAX_QUEUE', '512'))
+LLM_MAX_WAIT = float(os.getenv('LLM_MAX_WAIT', '30'))
+# Token-bucket budgets; 0 disables a budget
+LLM_RPM = float(os.getenv('LLM_RPM', '0'))
+LLM_TPM = float(os.getenv('LLM_TPM', '0'))
+LLM_KEY_RPM = float(os.getenv('LLM_KEY_RPM', '0'))
+LLM_KEY_TPM = float(os.getenv('LLM_KEY_TPM', '0'))
+# Per-key buckets kept before the least recently used idle ones are dropped; only full buckets go, so no budget is lost
+LLM_MAX_KEYS = int(os.getenv('LLM_MAX_KEYS', '10000'))
+
+# Lower runs first: short tailoring calls jump ahead of long persona generations; speculative work waits for everything
+ROUTE_PRIORITY = {'tailor': 0, 'bullets': 1, 'batch': 1, 'recommendations': 2, 'persona': 3, 'speculative': 4}
+DEFAULT_PRIORITY = 2
+
+
+class SchedulerRejected(Exception):
+    """An LLM call was refused admission; maps to an HTTP 429 or 503 with Retry-After."""
+
+    def __init__(self, message, status, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class TokenBucket:
+    """Per-minute budget refilled continuously; a rate of 0 means unlimited."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount is available (0 if it is now, inf if it never will be)."""
+        if not self.capacity:
+            return 0.0
+        if amount > self.capacity:
+            return math.inf
+        self._refill(now)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount):
+        if self.capacity:
+            self.level -= amount
+
+    def full(self, now):
+        """True when the bucket has refilled, so a new one would behave the same."""
+        if not self.capacity:
+            return True
+        self._refill(now)
+        return self.level >= self.capacity
+
+
+class Waiter:
+    def __init__(self, priority, seq, route, key_id, tokens):
+        self.priority = priority
+        self.seq = seq
+        self.route = route
+        self.key_id = key_id
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.rate_limited = False
+        self.event = threading.Event()
+        self.future = None
+        self.loop = None
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def grant(self):
+        self.granted = True
+        if self.future is not None:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+        else:
+            self.event.set()
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Ticket:
+    """An admitted LLM call; release() frees its concurrency slot."""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.scheduler._release()
+
+
+class Admission:
+    """The priority one call waits at, which callers sharing its result may raise while it is queued."""
+
+    def __init__(self, scheduler, route):
+        self.scheduler = scheduler
+        self.priority = ROUTE_PRIORITY.get(route, DEFAULT_PRIORITY)
+        self.waiter = None
+
+    def promote(self, priority):
+        self.scheduler._promote(self, priority)
+
+
+class AdmissionScheduler:
+    """Priority admission queue with concurrency and token-bucket budgets in front of the LLM provider."""
+
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, max_queue=LLM_MAX_QUEUE, max_wait=LLM_MAX_WAIT,
+                 rpm=LLM_RPM, tpm=LLM_TPM, key_rpm=LLM_KEY_RPM, key_tpm=LLM_KEY_TPM, max_keys=LLM_MAX_KEYS):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.key_rpm = key_rpm
+        self.key_tpm = key_tpm
+        self.key_buckets = OrderedDict()
+        self.max_keys = max_keys
+        self.unlimited = TokenBucket(0)
+        self.lock = threading.Lock()
+        self.waiters = []
+        self.active = 0
+        self.seq = itertools.count()
+        self.admitted = {}
+        self.rejected = {}
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.queue_peak = 0
+        self.promoted = 0
+
+    def admission(self, route):
+        return Admission(self, route)
+
+    def _buckets_for(self, key_id):
+        if not self.key_rpm and not self.key_tpm:
+            return self.requests, self.tokens, self.unlimited, self.unlimited
+        buckets = self.key_buckets.get(key_id)
+        if buckets is None:
+            buckets = (TokenBucket(self.key_rpm), TokenBucket(self.key_tpm))
+            self.key_buckets[key_id] = buckets
+            if len(self.key_buckets) > self.max_keys:
+                self._evict_idle_keys()
+        else:
+            self.key_buckets.move_to_end(key_id)
+        return (self.requests, self.tokens) + buckets
+
+    def _evict_idle_keys(self):
+        """Drop least recently used keys whose buckets have refilled. Caller holds the lock.
+
+        Stops at the first key still within its window: keys used in the last minute stay, so the
+        map is bounded by max_keys plus the keys active in that minute.
+        """
+        now = time.monotonic()
+        while len(self.key_buckets) > self.max_keys:
+            key_id, buckets = next(iter(self.key_buckets.items()))
+            if not all(bucket.full(now) for bucket in buckets):
+                break
+            del self.key_buckets[key_id]
+
+    def _budget_wait(self, waiter, now):
+        global_requests, global_tokens, key_requests, key_tokens = self._buckets_for(waiter.key_id)
+        return max(
+            global_requests.wait_time(1, now),
+            global_tokens.wait_time(waiter.tokens, now),
+            key_requests.wait_time(1, now),
+            key_tokens.wait_time(waiter.tokens, now),
+        )
+
+    def _dispatch(self):
+        """Grant queued waiters in priority order while slots and budgets allow. Caller holds the lock."""
+        now = time.monotonic()
+        next_check = math.inf
+        for waiter in sorted(self.waiters):
+            if self.active >= self.max_concurrency:
+                break
+            wait = self._budget_wait(waiter, now)
+            if wait > 0:
+                waiter.rate_limited = True
+                next_check = min(next_check, wait)
+                continue
+            for bucket, amount in zip(self._buckets_for(waiter.key_id), (1, waiter.tokens, 1, waiter.tokens)):
+                bucket.take(amount)
+            self.waiters.remove(waiter)
+            self.active += 1
+            self._record_admit(waiter, now)
+            waiter.grant()
+        return next_check
+
+    def _record_admit(self, waiter, now):
+        waited = now - waiter.enqueued
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        self.admitted[waiter.route] = self.admitted.get(waiter.route, 0) + 1
+
+    def _reject(self, route, message, status, retry_after):
+        self.rejected[route] = self.rejected.get(route, 0) + 1
+        logging.warning(f"Rejected {route} LLM call: {message}")
+        return SchedulerRejected(message, status, retry_after)
+
+    def _enqueue(self, route, key_id, tokens, admission=None):
+        """Queue a waiter, granting it immediately if possible. Caller holds the lock."""
+        priority = admission.priority if admission is not None else ROUTE_PRIORITY.get(route, DEFAULT_PRIORITY)
+        waiter = Waiter(priority, next(self.seq), route, key_id, tokens)
+        if admission is not None:
+            admission.waiter = waiter
+        if self._budget_wait(waiter, time.monotonic()) == math.inf:
+            raise self._reject(route, "Request exceeds the per-minute token budget", 429, 60)
+        if len(self.waiters) >= self.max_queue:
+            raise self._reject(route, "LLM queue is full", 503, self._retry_estimate())
+        self.waiters.append(waiter)
+        self.queue_peak = max(self.queue_peak, len(self.waiters))
+        return waiter, self._dispatch()
+
+    def _abandon(self, waiter):
+        """Give up on a waiter that timed out. Caller holds the lock."""
+        if waiter.granted:
+            return True
+        self.waiters.remove(waiter)
+        if waiter.rate_limited:
+            raise self._reject(waiter.route, "LLM rate budget exhausted", 429, self._budget_wait(waiter, time.monotonic()))
+        raise self._reject(waiter.route, "Timed out waiting for an LLM slot", 503, self._retry_estimate())
+
+    def _withdraw(self, waiter):
+        """Undo a wait interrupted by cancellation: give back the slot if it was granted, else the place in line."""
+        with self.lock:
+            if waiter.granted:
+                self.active -= 1
+            elif waiter in self.waiters:
+                self.waiters.remove(waiter)
+            self._dispatch()
+
+    def _retry_estimate(self):
+        admitted = sum(self.admitted.values())
+        return self.wait_total / admitted if admitted else 1.0
+
+    def _promote(self, admission, priority):
+        with self.lock:
+            if priority >= admission.priority:
+                return
+            admission.priority = priority
+            waiter = admission.waiter
+            if waiter is None or waiter.granted:
+                return
+            waiter.priority = priority
+            self.promoted += 1
+            self._dispatch()
+
+    def acquire(self, route, key_id, tokens, admission=None) -> Ticket:
+        """Block until the call may run; raise SchedulerRejected if it cannot be admitted in time."""
+        with self.lock:
+            waiter, next_check = self._enqueue(route, key_id, tokens, admission)
+        deadline = waiter.enqueued + self.max_wait
+        try:
+            while not waiter.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self.lock:
+                        if self._abandon(waiter):
+                            break
+                waiter.event.wait(min(remaining, next_check) if remaining > 0 else 0)
+                with self.lock:
+                    next_check = self._dispatch()
+        except SchedulerRejected:
+            raise
+        except BaseException:
+            self._withdraw(waiter)
+            raise
+        return Ticket(self)
+
+    async def acquire_async(self, route, key_id, tokens, admission=None) -> Ticket:
+        """Async counterpart of acquire for the ASGI path."""
+        with self.lock:
+            waiter, next_check = self._enqueue(route, key_id, tokens, admission)
+            if not waiter.granted:
+                waiter.loop = asyncio.get_running_loop()
+                waiter.future = waiter.loop.create_future()
+        deadline = waiter.enqueued + self.max_wait
+        try:
+            while not waiter.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self.lock:
+                        if self._abandon(waiter):
+                            break
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter.future),
+                                           min(remaining, next_check) if remaining > 0 else 0)
+                except asyncio.TimeoutError:
+                    pass
+                with self.lock:
+                    next_check = self._dispatch()
+        except SchedulerRejected:
+            raise
+        except BaseException:
+            # Cancelled while queued, e.g. every client of the call went away
+            self._withdraw(waiter)
+            raise
+        return Ticket(self)
+
+    def _release(self):
+        with self.lock:
+            self.active -= 1
+            self._dispatch()
+
+    def stats(self):
+        with self.lock:
+            admitted = sum(self.admitted.values())
+            return {
+                'active': self.active,
+                'max_concurrency': self.max_concurrency,
+                'queue_depth': len(self.waiters),
+                'queue_peak': self.queue_peak,
+                'rate_limited_keys': len(self.key_buckets),
+                'max_queue': self.max_queue,
+                'admitted': dict(self.admitted),
+                'rejected': dict(self.rejected),
+                'promoted': self.promoted,
+                'wait_seconds_avg': self.wait_total / admitted if admitted else 0.0,
+                'wait_seconds_max': self.wait_max,
+            }
+
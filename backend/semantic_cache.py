@@ -0,0 +1,215 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .cache import RESPONSE_CACHE_TTL, normalize_fields
+from .retrieval import HashingEmbedder
+from .prompt_registry import prompt_registry
+from .log import log_payload
+
+# off, shadow (log the hits it would serve, serve nothing) or on
+SEMANTIC_CACHE = os.getenv('SEMANTIC_CACHE', 'off')
+# Cosine similarity of the STAR text a request needs to reuse a stored response, per route; e.g. {"bullets": 0.95}
+SEMANTIC_CACHE_THRESHOLDS = {
+    'recommendations': 0.97, 'bullets': 0.97, **json.loads(os.getenv('SEMANTIC_CACHE_THRESHOLDS', '{}')),
+}
+# Vectors, inputs and responses held per worker before the least recently used are evicted
+SEMANTIC_CACHE_MAX_BYTES = int(os.getenv('SEMANTIC_CACHE_MAX_BYTES', str(64 << 20)))
+# Wider than the retrieval index: near-duplicates differ by a few words, which 128 buckets would blur
+SEMANTIC_CACHE_DIMENSIONS = int(os.getenv('SEMANTIC_CACHE_DIMENSIONS', '512'))
+
+STAR_FIELDS = ('situation', 'task', 'actions', 'results')
+# Lower edges of the top-1 similarity histogram reported for threshold tuning
+SIMILARITY_BUCKETS = (0.0, 0.8, 0.85, 0.9, 0.95, 0.97, 0.99)
+_NUMBER = re.compile(r'\d+(?:[.,]\d+)*')
+# Bookkeeping per entry beyond its vector, text and response
+ENTRY_OVERHEAD = 256
+
+
+def _star_request(route, data):
+    """(basic info, STAR content) of a request body, for the routes the cache covers."""
+    if route == 'recommendations':
+        return data, data
+    return data.get('basic_info') or {}, data.get('star_content') or {}
+
+
+def semantic_input(route, data):
+    """(text to embed, partition id) of a request.
+
+    Only the STAR text is compared by meaning. Company, position, industry and every figure in
+    the text must match exactly, so a response never carries someone else's employer or numbers.
+    """
+    basic_info, star = _star_request(route, data or {})
+    text = '\n'.join(normalize_fields(str(star.get(field) or '')) for field in STAR_FIELDS).strip()
+    industry = basic_info.get('industry') or ''
+    scope = {
+        'route': route,
+        'prompt_version': prompt_registry.version(route),
+        'company': normalize_fields(str(basic_info.get('company') or '')).lower(),
+        'position': normalize_fields(str(basic_info.get('position') or '')).lower(),
+        'industry': normalize_fields(', '.join(industry) if isinstance(industry, list) else str(industry)).lower(),
+        'figures': sorted(_NUMBER.findall(text)),
+    }
+    digest = hashlib.sha256(json.dumps(scope, sort_keys=True).encode('utf-8')).digest()
+    return text, int.from_bytes(digest[:8], 'little', signed=True)
+
+
+class SemanticCache:
+    """Serves a stored response to a request whose STAR text is a near-duplicate of an earlier one.
+
+    Vectors live in one float32 matrix, so a lookup is a single matrix-vector product over
+    every entry; rows of other partitions or past their expiry are masked out before the
+    top-1 is taken. Entries are evicted least recently used once their total size passes
+    max_bytes. In shadow mode lookups are logged and counted but never served.
+    """
+
+    def __init__(self, mode=SEMANTIC_CACHE, thresholds=None, max_bytes=SEMANTIC_CACHE_MAX_BYTES,
+                 ttl=RESPONSE_CACHE_TTL, embedder=None):
+        if mode not in ('off', 'shadow', 'on'):
+            logging.warning(f"Unknown SEMANTIC_CACHE {mode!r}, using off")
+            mode = 'off'
+        self.mode = mode
+        self.thresholds = SEMANTIC_CACHE_THRESHOLDS if thresholds is None else thresholds
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.embedder = embedder or HashingEmbedder(SEMANTIC_CACHE_DIMENSIONS)
+        self.vectors = np.zeros((0, self.embedder.dimensions), dtype=np.float32)
+        self.partitions = np.zeros(0, dtype=np.int64)
+        self.expires = np.zeros(0, dtype=np.float64)
+        # Rows in use, least recently used first: row -> (exact key, text, response, size)
+        self.entries = OrderedDict()
+        self.rows = {}
+        self.free = []
+        self.used = 0
+        self.bytes = 0
+        self.evictions = 0
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def covers(self, route):
+        return self.mode != 'off' and route in self.thresholds
+
+    def lookup(self, route, data, cache_control=''):
+        """The response stored for the nearest earlier input above the route's threshold, or None."""
+        if not self.covers(route) or 'no-cache' in cache_control or (data or {}).get('regenerate'):
+            return None
+        text, partition = semantic_input(route, data)
+        if not text:
+            return None
+        vector = self.embedder.embed([text])[0]
+        with self.lock:
+            counts = self._counts(route)
+            counts['lookups'] += 1
+            if not self.entries:
+                counts['misses'] += 1
+                return None
+            scores = self.vectors[:self.used] @ vector
+            scores[(self.partitions[:self.used] != partition) | (self.expires[:self.used] < time.time())] = -1.0
+            row = int(np.argmax(scores))
+            similarity = float(scores[row])
+            if similarity >= 0:
+                bucket = max(edge for edge in SIMILARITY_BUCKETS if similarity >= edge)
+                counts['similarity'][str(bucket)] += 1
+            if similarity < self.thresholds[route]:
+                counts['misses'] += 1
+                return None
+            self.entries.move_to_end(row)
+            _, cached_text, payload, _ = self.entries[row]
+            counts['shadow_hits' if self.mode == 'shadow' else 'hits'] += 1
+        if self.mode == 'shadow':
+            logging.info(f"Semantic cache would serve {route} at similarity {similarity:.4f}")
+            log_payload('semantic_cache.would_hit', {
+                'route': route, 'similarity': similarity, 'input': text, 'cached_input': cached_text,
+            })
+            return None
+        return payload
+
+    def add(self, route, data, payload):
+        """Store a generated response under its request's STAR text."""
+        if not self.covers(route):
+            return
+        text, partition = semantic_input(route, data)
+        if not text:
+            return
+        vector = self.embedder.embed([text])[0]
+        key = (partition, text)
+        size = vector.nbytes + len(text) + len(json.dumps(payload)) + ENTRY_OVERHEAD
+        with self.lock:
+            now = time.time()
+            self._drop_expired(now)
+            row = self.rows.get(key)
+            if row is not None:
+                self._drop(row)
+            row = self.free.pop() if self.free else self._append_row()
+            self.vectors[row] = vector
+            self.partitions[row] = partition
+            self.expires[row] = now + self.ttl
+            self.entries[row] = (key, text, payload, size)
+            self.rows[key] = row
+            self.bytes += size
+            while self.bytes > self.max_bytes and len(self.entries) > 1:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _append_row(self):
+        # Caller holds self.lock; capacity doubles so appends stay amortized O(1)
+        if self.used == len(self.partitions):
+            capacity = max(256, 2 * self.used)
+            self.vectors = np.resize(self.vectors, (capacity, self.vectors.shape[1]))
+            self.partitions = np.resize(self.partitions, capacity)
+            self.expires = np.resize(self.expires, capacity)
+            self.partitions[self.used:] = 0
+            self.expires[self.used:] = 0.0
+        self.used += 1
+        return self.used - 1
+
+    def _drop(self, row):
+        # Caller holds self.lock; an expiry in the past keeps the row from ever matching again
+        key, _, _, size = self.entries.pop(row)
+        del self.rows[key]
+        self.expires[row] = 0.0
+        self.bytes -= size
+        self.free.append(row)
+
+    def _drop_expired(self, now):
+        for row in np.nonzero(self.expires[:self.used] < now)[0].tolist():
+            if row in self.entries:
+                self._drop(row)
+
+    def _counts(self, route):
+        if route not in self.counts:
+            self.counts[route] = {
+                'lookups': 0, 'hits': 0, 'shadow_hits': 0, 'misses': 0,
+                'similarity': {str(edge): 0 for edge in SIMILARITY_BUCKETS},
+            }
+        return self.counts[route]
+
+    def stats(self):
+        with self.lock:
+            routes = {}
+            for route, counts in self.counts.items():
+                served = counts['hits'] + counts['shadow_hits']
+                routes[route] = {
+                    **counts,
+                    'similarity': dict(counts['similarity']),
+                    'threshold': self.thresholds.get(route),
+                    'hit_rate': served / counts['lookups'] if counts['lookups'] else 0.0,
+                }
+            return {
+                'mode': self.mode,
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions,
+                'routes': routes,
+            }
+
+
+semantic_cache = SemanticCache()
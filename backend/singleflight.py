@@ -0,0 +1,238 @@
+import json
+import asyncio
+import hashlib
+import logging
+import threading
+
+
+def flight_key(**request) -> str:
+    """Canonical hash of an upstream generation request."""
+    canonical = json.dumps(request, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class SharedStream:
+    """Fan one upstream delta iterator out to any number of subscribers.
+
+    There is no background thread: whichever subscriber runs out of buffered
+    chunks pulls the next one from upstream while the others wait, so the
+    stream keeps flowing as long as at least one subscriber is reading. The
+    upstream request itself is only started by the first pull.
+    """
+
+    def __init__(self, start, on_finish=None, admission=None):
+        self.start = start
+        self.source = None
+        self.on_finish = on_finish
+        self.admission = admission
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.pulling = False
+        self.subscribers = 0
+        self.cond = threading.Condition()
+
+    def subscribe(self):
+        with self.cond:
+            self.subscribers += 1
+        return self._iterate()
+
+    def _iterate(self):
+        index = 0
+        try:
+            while True:
+                with self.cond:
+                    while index >= len(self.chunks) and not self.done and self.pulling:
+                        self.cond.wait()
+                    if index < len(self.chunks):
+                        chunk = self.chunks[index]
+                    elif self.done:
+                        if self.error is not None:
+                            raise self.error
+                        return
+                    else:
+                        chunk = None
+                        self.pulling = True
+                if chunk is None:
+                    self._pull()
+                    continue
+                index += 1
+                yield chunk
+        finally:
+            self._unsubscribe()
+
+    def _pull(self):
+        try:
+            if self.source is None:
+                self.source = iter(self.start())
+            chunk = next(self.source)
+        except StopIteration:
+            self._finish()
+        except Exception as e:
+            self._finish(e)
+        except BaseException:
+            # Interrupted mid-read: the source cannot resume, so end the flight rather than leave the
+            # other subscribers waiting on a pull that never completes
+            self._finish(RuntimeError("Generation interrupted"))
+            raise
+        else:
+            with self.cond:
+                self.chunks.append(chunk)
+                self.pulling = False
+                self.cond.notify_all()
+
+    def _finish(self, error=None):
+        with self.cond:
+            self.done = True
+            self.error = error
+            self.pulling = False
+            self.cond.notify_all()
+        if self.on_finish:
+            self.on_finish(self)
+
+    def _unsubscribe(self):
+        with self.cond:
+            self.subscribers -= 1
+            abandoned = self.subscribers == 0 and not self.done
+        if abandoned:
+            # Every client went away mid-generation; stop reading from upstream
+            close = getattr(self.source, 'close', None) if self.source is not None else None
+            if close:
+                close()
+            self._finish(RuntimeError("Generation abandoned by all subscribers"))
+
+
+class SingleFlight:
+    """Coalesce concurrent identical generations onto one upstream stream."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.started = 0
+        self.coalesced = 0
+
+    def stream(self, key, start, admission=None):
+        """Join the in-flight stream for key, or call start() to begin a new one.
+
+        admission is the scheduler priority start() will wait at; a more urgent caller
+        joining a flight that is still queued raises the flight to its own priority.
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                logging.info(f"Coalesced generation {key[:12]} onto in-flight request")
+            else:
+                flight = SharedStream(start, on_finish=lambda f: self._forget(key, f), admission=admission)
+                self.flights[key] = flight
+                self.started += 1
+        if flight.admission is not None and admission is not None and flight.admission is not admission:
+            flight.admission.promote(admission.priority)
+        return flight.subscribe()
+
+    def _forget(self, key, flight):
+        with self.lock:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+
+    def stats(self):
+        with self.lock:
+            return {'in_flight': len(self.flights), 'started': self.started, 'coalesced': self.coalesced}
+
+
+class AsyncSharedStream:
+    """asyncio counterpart of SharedStream for the ASGI serving path.
+
+    Each upstream read runs in its own task rather than in the subscriber that asked for it, so a
+    subscriber cancelled mid-read (its client disconnected) leaves the read running for the others.
+    """
+
+    def __init__(self, start, on_finish=None, admission=None):
+        self.start = start
+        self.source = None
+        self.on_finish = on_finish
+        self.admission = admission
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.pull = None
+        self.subscribers = 0
+        self.cond = asyncio.Condition()
+
+    def subscribe(self):
+        self.subscribers += 1
+        return self._iterate()
+
+    async def _iterate(self):
+        index = 0
+        try:
+            while True:
+                async with self.cond:
+                    while index >= len(self.chunks) and not self.done:
+                        if self.pull is None:
+                            self.pull = asyncio.ensure_future(self._pull())
+                        await self.cond.wait()
+                    if index < len(self.chunks):
+                        chunk = self.chunks[index]
+                    else:
+                        if self.error is not None:
+                            raise self.error
+                        return
+                index += 1
+                yield chunk
+        finally:
+            await self._unsubscribe()
+
+    async def _pull(self):
+        try:
+            if self.source is None:
+                self.source = (await self.start()).__aiter__()
+            chunk = await self.source.__anext__()
+        except StopAsyncIteration:
+            await self._finish()
+        except Exception as e:
+            await self._finish(e)
+        else:
+            async with self.cond:
+                self.chunks.append(chunk)
+                self.pull = None
+                self.cond.notify_all()
+
+    async def _finish(self, error=None):
+        async with self.cond:
+            self.done = True
+            self.error = error
+            self.pull = None
+            self.cond.notify_all()
+        if self.on_finish:
+            self.on_finish(self)
+
+    async def _unsubscribe(self):
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.done:
+            if self.pull is not None:
+                # Stops the read where it waits: in the scheduler queue, connecting, or on the next delta
+                self.pull.cancel()
+                await asyncio.gather(self.pull, return_exceptions=True)
+            aclose = getattr(self.source, 'aclose', None) if self.source is not None else None
+            if aclose:
+                await aclose()
+            await self._finish(RuntimeError("Generation abandoned by all subscribers"))
+
+
+class AsyncSingleFlight(SingleFlight):
+    """Coalesce concurrent identical generations within one event loop."""
+
+    def stream(self, key, start, admission=None):
+        """Join the in-flight stream for key, or await start() to begin a new one."""
+        flight = self.flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            logging.info(f"Coalesced generation {key[:12]} onto in-flight request")
+            if flight.admission is not None and admission is not None:
+                flight.admission.promote(admission.priority)
+        else:
+            flight = AsyncSharedStream(start, on_finish=lambda f: self._forget(key, f), admission=admission)
+            self.flights[key] = flight
+            self.started += 1
+        return flight.subscribe()
@@ -0,0 +1,172 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import ResponseCache, MemoryCacheBackend, SQLiteCacheBackend, RESPONSE_CACHE_BACKEND, make_cache_key
+from .budget import count_message_tokens, count_tokens
+from .generation import (
+    response_cache, BULLETS_PARAMS, bullets_cache_key, build_bullets_messages, bullets_result, _industry_str,
+)
+from .prompt_registry import prompt_registry
+from .llm import stream_chat
+
+# Opt-in: once recommendations are served, generate bullets for the same STAR content in the background,
+# since the STAR builder almost always asks for them next
+SPECULATIVE_BULLETS = os.getenv('SPECULATIVE_BULLETS', '0') == '1'
+# Unclaimed speculative results are dropped after this long
+SPECULATION_TTL = float(os.getenv('SPECULATION_TTL', '900'))
+SPECULATION_CACHE_SIZE = int(os.getenv('SPECULATION_CACHE_SIZE', '256'))
+SPECULATION_CACHE_PATH = os.getenv('SPECULATION_CACHE_PATH', os.path.join('user_data', 'speculation.sqlite'))
+# Cap on speculative spend: concurrent speculative calls per worker, and tokens per worker per rolling hour
+SPECULATION_MAX_INFLIGHT = int(os.getenv('SPECULATION_MAX_INFLIGHT', '2'))
+SPECULATION_TOKENS_PER_HOUR = int(os.getenv('SPECULATION_TOKENS_PER_HOUR', '200000'))
+# Completion tokens held against the cap while a call runs, until its real size is known
+SPECULATION_COMPLETION_ESTIMATE = 400
+SPEND_WINDOW = 3600
+
+
+def star_bullets_request(data):
+    """The /api/star/bullets body the STAR builder sends after a /api/star/recommendations body."""
+    industry = data.get('industry')
+    return {
+        'basic_info': {
+            'company': data.get('company') or '',
+            'position': data.get('position') or '',
+            'industry': [industry] if industry else [],
+        },
+        'star_content': {key: data.get(key) or '' for key in ('situation', 'task', 'actions', 'results')},
+    }
+
+
+def speculation_key(data):
+    """Key of a bullets request by what goes into its prompt, so the two request shapes line up."""
+    basic_info = data.get('basic_info') or {}
+    star_content = data.get('star_content') or {}
+    return make_cache_key('speculative-bullets', {**BULLETS_PARAMS, 'prompt_version': prompt_registry.version('bullets')}, {
+        'company': basic_info.get('company') or '',
+        'position': basic_info.get('position') or '',
+        'industry': _industry_str(basic_info),
+        **{key: star_content.get(key) or '' for key in ('situation', 'task', 'actions', 'results')},
+    })
+
+
+def create_speculation_cache():
+    # Shared between workers whenever the response cache is, since the bullets call may land on another worker
+    if RESPONSE_CACHE_BACKEND == 'sqlite':
+        return ResponseCache(SQLiteCacheBackend(SPECULATION_CACHE_PATH, SPECULATION_CACHE_SIZE), SPECULATION_TTL)
+    return ResponseCache(MemoryCacheBackend(SPECULATION_CACHE_SIZE), SPECULATION_TTL)
+
+
+class Speculator:
+    """Pre-generates bullets at the scheduler's lowest priority, within a concurrency and token cap."""
+
+    def __init__(self, enabled=SPECULATIVE_BULLETS, max_inflight=SPECULATION_MAX_INFLIGHT,
+                 tokens_per_hour=SPECULATION_TOKENS_PER_HOUR):
+        self.enabled = enabled
+        self.max_inflight = max_inflight
+        self.tokens_per_hour = tokens_per_hour
+        self.cache = create_speculation_cache() if enabled else None
+        self.executor = None
+        self.executor_pid = None
+        self.inflight = set()
+        self.spend = deque()
+        self.lock = threading.Lock()
+        self.counts = {'launched': 0, 'completed': 0, 'failed': 0, 'skipped': 0, 'over_budget': 0,
+                       'hits': 0, 'joined': 0, 'misses': 0}
+
+    def _executor(self):
+        # Forked workers need their own threads
+        if self.executor_pid != os.getpid():
+            self.executor = ThreadPoolExecutor(max_workers=self.max_inflight, thread_name_prefix='speculate')
+            self.executor_pid = os.getpid()
+        return self.executor
+
+    def _spent(self, now):
+        # Caller holds self.lock
+        while self.spend and self.spend[0][0] < now - SPEND_WINDOW:
+            self.spend.popleft()
+        return sum(tokens for _, tokens in self.spend)
+
+    def speculate(self, recommendations_data):
+        """Queue bullets for the STAR content of a recommendations request that was just served."""
+        if not self.enabled or not recommendations_data:
+            return
+        data = star_bullets_request(recommendations_data)
+        key = speculation_key(data)
+        if self.cache.peek(key) is not None or response_cache.peek(bullets_cache_key(data)) is not None:
+            with self.lock:
+                self.counts['skipped'] += 1
+            return
+        messages = build_bullets_messages(data)
+        reserved = count_message_tokens(messages) + SPECULATION_COMPLETION_ESTIMATE
+        with self.lock:
+            if key in self.inflight:
+                self.counts['skipped'] += 1
+                return
+            now = time.time()
+            if len(self.inflight) >= self.max_inflight or self._spent(now) + reserved > self.tokens_per_hour:
+                self.counts['over_budget'] += 1
+                return
+            self.inflight.add(key)
+            self.spend.append((now, reserved))
+            self.counts['launched'] += 1
+        self._executor().submit(self._run, key, messages, reserved)
+
+    def _run(self, key, messages, reserved):
+        generated = ''
+        try:
+            # The real bullets call, if it comes while this runs, attaches to this generation through single-flight,
+            # which moves it up to the bullets priority if it is still queued
+            generated = ''.join(stream_chat(messages=messages, route='speculative', **BULLETS_PARAMS))
+            payload, status = bullets_result(generated)
+            if status == 200:
+                self.cache.set(key, payload)
+            outcome = 'completed' if status == 200 else 'failed'
+        except Exception as e:
+            logging.warning(f"Speculative bullets failed: {str(e)}")
+            outcome = 'failed'
+        with self.lock:
+            self.inflight.discard(key)
+            self.counts[outcome] += 1
+            # Settle the reservation at what the call actually cost
+            actual = count_message_tokens(messages) + count_tokens(generated)
+            self.spend.append((time.time(), actual - reserved))
+
+    def take(self, data, cache_control=''):
+        """A speculated response for a bullets request, if one is ready for the same content."""
+        if not self.enabled or 'no-cache' in cache_control or (data or {}).get('regenerate'):
+            return None
+        key = speculation_key(data or {})
+        payload = self.cache.peek(key)
+        with self.lock:
+            if payload is not None:
+                self.counts['hits'] += 1
+            elif key in self.inflight:
+                self.counts['joined'] += 1
+            else:
+                self.counts['misses'] += 1
+        return payload
+
+    def stats(self):
+        with self.lock:
+            counts = dict(self.counts)
+            spent = self._spent(time.time())
+            inflight = len(self.inflight)
+        requests = counts['hits'] + counts['joined'] + counts['misses']
+        return {
+            'enabled': self.enabled,
+            **counts,
+            'inflight': inflight,
+            # Bullets requests answered by speculation, in full or by joining a running generation
+            'hit_rate': (counts['hits'] + counts['joined']) / requests if requests else 0.0,
+            # Speculative generations a bullets request went on to use
+            'used_rate': (counts['hits'] + counts['joined']) / counts['launched'] if counts['launched'] else 0.0,
+            'tokens_last_hour': spent,
+            'tokens_per_hour': self.tokens_per_hour,
+        }
+
+
+speculator = Speculator()
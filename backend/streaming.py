@@ -0,0 +1,40 @@
+import json
+
+
+def sse_event(event: str, data, event_id=None) -> str:
+    """Format a single Server-Sent Event frame; event_id is what a reconnecting client sends as Last-Event-ID."""
+    payload = data if isinstance(data, str) else json.dumps(data)
+    lines = ''.join(f"data: {line}\n" for line in payload.split('\n'))
+    frame_id = f"id: {event_id}\n" if event_id is not None else ''
+    return f"{frame_id}event: {event}\n{lines}\n"
+
+
+def _chunk_usage(chunk, usage):
+    """Copy the provider's own completion count and finish reason off a chunk into usage."""
+    if chunk.choices and chunk.choices[0].finish_reason:
+        usage['finish_reason'] = chunk.choices[0].finish_reason
+    # Groq reports usage on the final chunk under x_groq; OpenAI-compatible servers on the chunk itself
+    x_groq = getattr(chunk, 'x_groq', None)
+    reported = getattr(x_groq, 'usage', None) or getattr(chunk, 'usage', None)
+    if reported is not None and reported.completion_tokens is not None:
+        usage['completion_tokens'] = reported.completion_tokens
+
+
+def iter_deltas(chat_completion, usage=None):
+    """Yield the text content of each streamed chat completion chunk; usage, if given, collects what was reported."""
+    for chunk in chat_completion:
+        if usage is not None:
+            _chunk_usage(chunk, usage)
+        content = chunk.choices[0].delta.content if chunk.choices else None
+        if content:
+            yield content
+
+
+async def aiter_deltas(chat_completion, usage=None):
+    """Async counterpart of iter_deltas."""
+    async for chunk in chat_completion:
+        if usage is not None:
+            _chunk_usage(chunk, usage)
+        content = chunk.choices[0].delta.content if chunk.choices else None
+        if content:
+            yield content
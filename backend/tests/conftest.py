@@ -0,0 +1,10 @@
+import os
+import atexit
+import shutil
+import tempfile
+
+# The app opens its stores under user_data/ in the working directory when first imported; the suite runs
+# from a scratch directory so it never leaves one in the checkout
+SCRATCH = tempfile.mkdtemp(prefix='backend-tests-')
+os.chdir(SCRATCH)
+atexit.register(shutil.rmtree, SCRATCH, True)
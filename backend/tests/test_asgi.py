@@ -0,0 +1,79 @@
+"""The native ASGI handlers: what reaches the client when a handler fails, and what runs off the event loop."""
+import asyncio
+import threading
+
+import pytest
+
+from backend import asgi
+
+
+def call(path, body=b'{}', headers=()):
+    """Run one POST through the ASGI app; returns the messages it sent."""
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': 'POST', 'path': path, 'query_string': b'',
+             'headers': [(b'content-type', b'application/json'), *headers]}
+    asyncio.run(asgi.app(scope, receive, send))
+    return sent
+
+
+@pytest.fixture
+def route(monkeypatch):
+    def register(handler):
+        monkeypatch.setitem(asgi.ROUTES, '/test', handler)
+    return register
+
+
+def test_error_before_the_response_is_a_json_500(route):
+    async def handler(request, send):
+        raise RuntimeError('boom')
+    route(handler)
+    sent = call('/test')
+    assert [message['type'] for message in sent] == ['http.response.start', 'http.response.body']
+    assert sent[0]['status'] == 500 and b'boom' in sent[1]['body']
+
+
+def test_error_mid_stream_ends_the_body_without_new_headers(route):
+    async def events():
+        yield 'event: bullet\ndata: {}\n\n'
+        raise RuntimeError('boom')
+
+    async def handler(request, send):
+        await asgi.send_event_stream(send, request, events())
+    route(handler)
+    sent = call('/test')
+    assert [message['type'] for message in sent].count('http.response.start') == 1
+    assert sent[0]['status'] == 200
+    assert sent[-1] == {'type': 'http.response.body', 'body': b''}
+
+
+def test_cache_lookups_and_stores_run_off_the_event_loop(monkeypatch):
+    threads = []
+
+    def lookup(cache_key, data, cache_control=''):
+        threads.append(threading.current_thread())
+        return None
+
+    def store(cache_key, payload):
+        threads.append(threading.current_thread())
+
+    async def generate():
+        return {'bullets': ['- a']}, 200
+
+    monkeypatch.setattr(asgi, 'lookup_cached_response', lookup)
+    monkeypatch.setattr(asgi.response_cache, 'set', store)
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    request = asgi.Request({'type': 'http', 'path': '/test', 'headers': []}, b'{}')
+    assert asyncio.run(asgi._cached_generation(request, send, 'key', {}, generate, route='bullets'))
+    assert len(threads) == 2 and threading.main_thread() not in threads
+    assert dict(sent[0]['headers'])[b'x-cache'] == b'MISS'
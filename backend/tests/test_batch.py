@@ -0,0 +1,17 @@
+"""The threaded batch endpoint of the Flask app."""
+import contextvars
+
+from backend import main
+from backend.log import begin_request, request_context
+
+
+def test_batch_items_run_in_the_request_context(monkeypatch):
+    monkeypatch.setattr(main, 'generate_batch_item',
+                        lambda index, item, cache_control: {'index': index, 'context': request_context.get()})
+
+    def handle_request():
+        begin_request({'X-Request-ID': 'batch-request'})
+        return list(main.generate_batch([{}, {}, {}], ''))
+    # Its own context, so the request id does not leak into later tests
+    results = contextvars.copy_context().run(handle_request)
+    assert [result['context'].get('request_id') for result in results] == ['batch-request'] * 3
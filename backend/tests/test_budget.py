@@ -0,0 +1,29 @@
+"""Adaptive max_tokens: sized only from the completion counts the provider reports."""
+from backend.budget import PromptBudget, BUDGET_MIN_SAMPLES, BUDGET_HEADROOM
+
+MODEL = 'llama3-8b-8192'
+
+
+def test_local_estimates_never_lower_the_ceiling():
+    budget = PromptBudget()
+    for _ in range(BUDGET_MIN_SAMPLES * 2):
+        budget.record('bullets', 100, 300, 2000)
+    assert budget.max_tokens_for('bullets', 2000, MODEL, 100) == 2000
+
+
+def test_reported_counts_size_max_tokens():
+    budget = PromptBudget()
+    for _ in range(BUDGET_MIN_SAMPLES):
+        budget.record('bullets', 100, 400, 2000, reported=True, finish_reason='stop')
+    assert budget.max_tokens_for('bullets', 2000, MODEL, 100) == int(400 * BUDGET_HEADROOM)
+
+
+def test_length_stop_counts_as_truncated_and_raises_the_next_cap():
+    budget = PromptBudget()
+    for _ in range(BUDGET_MIN_SAMPLES):
+        budget.record('bullets', 100, 400, 2000, reported=True, finish_reason='stop')
+    cap = budget.max_tokens_for('bullets', 2000, MODEL, 100)
+    # The provider stopped one call at the cap even though its count came in under it
+    budget.record('bullets', 100, cap - 3, cap, reported=True, finish_reason='length')
+    assert budget.stats()['bullets']['truncated'] == 1
+    assert budget.max_tokens_for('bullets', 2000, MODEL, 100) > cap
@@ -0,0 +1,18 @@
+"""Cold-start budget: importing the app stays fast and leaves the LLM SDKs for first use."""
+import pytest
+
+from backend.benchmarks.import_time import IMPORT_BUDGET_MS, fastest, failures
+
+
+@pytest.mark.parametrize('module', ['backend.main', 'backend.asgi'])
+def test_import_within_budget(module):
+    found = failures(fastest(module), module)
+    assert not found, found
+
+
+def test_failures_report_deferred_modules_and_time():
+    rows = [('langchain_core.messages', 2, 100, 100), ('backend.main', 1, 10, IMPORT_BUDGET_MS * 1000 + 1000)]
+    found = failures(rows, 'backend.main')
+    assert len(found) == 2
+    assert 'langchain_core' in found[0]
+    assert 'over the' in found[1]
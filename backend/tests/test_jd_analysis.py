@@ -0,0 +1,71 @@
+"""Job description keywords and the ATS coverage of bullets against them."""
+from backend import jd_analysis
+from backend.jd_analysis import JDAnalyzer, JD_STOPWORDS, LEADING_VERBS, MODIFIERS, keyword_coverage
+
+POSTING = """Data Analyst - Acme Analytics
+
+About the role
+Acme is growing fast and we need a data analyst to join our analytics team. You will write SQL queries against
+our warehouse, build dashboards in Tableau, and maintain ETL pipelines scheduled with Airflow.
+
+Responsibilities:
+- Write SQL queries against the data warehouse to answer product questions
+- Build and maintain ETL pipelines in Python and Airflow
+- Design Tableau dashboards for marketing and finance stakeholders
+- Partner with product managers to define metrics and run A/B tests
+
+Requirements:
+- 3+ years of experience as a data analyst
+- Strong SQL and Python skills
+- Experience with ETL tools such as Airflow or dbt
+- Familiarity with Tableau or Looker
+- Nice to have: experience with Snowflake and statistics
+"""
+
+BULLETS = [
+    "Wrote Python ETL pipelines orchestrated with Airflow, cutting warehouse load time by 40%",
+    "Built Tableau dashboards on SQL queries that finance used for weekly revenue reviews",
+    "Ran A/B tests with product managers and reported metrics to marketing stakeholders",
+]
+
+
+def analyze(tmp_path, description=POSTING):
+    return JDAnalyzer(path=str(tmp_path / 'jd_analysis.sqlite')).analyze(description)['keywords']
+
+
+def test_keywords_name_the_skills(tmp_path):
+    terms = [keyword['term'] for keyword in analyze(tmp_path)]
+    for skill in ('python', 'sql', 'etl', 'airflow', 'tableau', 'etl pipelines', 'sql queries'):
+        assert skill in terms
+    for term in terms:
+        words = term.split()
+        assert any(character.isalpha() for character in term), term
+        assert not set(words) & JD_STOPWORDS, term
+        assert words[0] not in LEADING_VERBS and words[0] not in MODIFIERS and words[-1] not in MODIFIERS, term
+    assert 'analyst acme' not in terms
+
+
+def test_phrases_do_not_hide_their_words(tmp_path):
+    terms = [keyword['term'] for keyword in analyze(tmp_path, 'Maintain ETL pipelines. Build ETL pipelines.')]
+    assert 'etl pipelines' in terms and 'etl' in terms and 'pipelines' in terms
+
+
+def test_matching_bullets_cover_the_posting(tmp_path):
+    coverage = keyword_coverage(analyze(tmp_path), BULLETS)
+    missing = [keyword['term'] for keyword in coverage['missing']]
+    for skill in ('python', 'sql', 'etl', 'airflow', 'tableau'):
+        assert skill not in missing
+    assert coverage['weighted_coverage'] > 0.5
+    assert keyword_coverage(analyze(tmp_path), ['Managed a retail store team'])['weighted_coverage'] < 0.1
+
+
+def test_tailor_prompt_gets_keywords_instead_of_the_description(tmp_path, monkeypatch):
+    from backend import generation
+    monkeypatch.setattr(jd_analysis, 'jd_analyzer', JDAnalyzer(path=str(tmp_path / 'jd_analysis.sqlite')))
+    prompt = generation.build_tailor_messages({
+        'basic_info': {'company': 'Globex', 'position': 'Analyst'},
+        'currentBullets': BULLETS,
+        'targetPosition': {'title': 'Data Analyst', 'company': 'Acme', 'description': POSTING},
+    })[-1]['content']
+    assert 'etl pipelines' in prompt and 'airflow' in prompt
+    assert 'Familiarity with Tableau or Looker' not in prompt
@@ -0,0 +1,83 @@
+"""The SQLite job queue and the event stream that follows a job."""
+import threading
+
+import pytest
+
+from backend import jobs
+from backend.jobs import JobStore, follow
+
+
+class ProbedConnection:
+    """A connection that calls probe() just before it logs an event."""
+
+    def __init__(self, conn, probe):
+        self.conn = conn
+        self.probe = probe
+
+    def execute(self, sql, *args):
+        if sql == jobs.INSERT_EVENT:
+            self.probe()
+        return self.conn.execute(sql, *args)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+class ProbedJobStore(JobStore):
+    probe = None
+
+    def _conn(self):
+        conn = super()._conn()
+        if self.probe is None or threading.current_thread() is not threading.main_thread():
+            return conn
+        return ProbedConnection(conn, self.probe)
+
+
+def snapshot(store, job_id):
+    """(status, events) as another process would read them right now."""
+    seen = {}
+
+    def read():
+        seen['status'] = store.get(job_id)['status']
+        seen['events'] = [event for _, event, _ in store.events(job_id)]
+    thread = threading.Thread(target=read)
+    thread.start()
+    thread.join()
+    return seen['status'], seen['events']
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ProbedJobStore(str(tmp_path / 'jobs.sqlite'), max_attempts=2)
+
+
+@pytest.mark.parametrize('finish, final', [
+    (lambda store, job_id: store.complete(job_id, {'persona': {}}), 'persona'),
+    (lambda store, job_id: store.fail(job_id, {'error': 'boom'}), 'error'),
+    (lambda store, job_id: store.retry(job_id, 0, {'error': 'busy'}), 'error'),
+], ids=['complete', 'fail', 'retry out of attempts'])
+def test_final_status_and_event_commit_together(store, finish, final):
+    job_id = store.submit('persona', {})
+    store.claim()
+    store.retry(job_id, 0, {'error': 'busy'})
+    store.claim()
+    seen = []
+    store.probe = lambda: seen.append(snapshot(store, job_id))
+    finish(store, job_id)
+    store.probe = None
+    # Whatever another reader saw while the final event was being written, it was never a finished job without it
+    assert seen and all(status not in jobs.TERMINAL for status, _ in seen)
+    frames = list(follow(store, job_id, poll_interval=0.01))
+    assert frames[-1].startswith('id: ') and f'event: {final}' in frames[-1]
+
+
+def test_retry_requeues_with_its_event(store):
+    job_id = store.submit('persona', {})
+    store.claim()
+    seen = []
+    store.probe = lambda: seen.append(snapshot(store, job_id))
+    store.retry(job_id, 0, {'error': 'busy'})
+    store.probe = None
+    assert seen == [('running', ['status'])]
+    assert store.get(job_id)['status'] == 'queued'
+    assert [event for _, event, _ in store.events(job_id)] == ['status', 'status']
@@ -0,0 +1,28 @@
+"""The SQLite persona store shared by every worker."""
+import time
+import sqlite3
+import threading
+
+from backend.persona_store import PersonaStore, SYNC_MARGIN
+
+
+def test_flush_stamps_updated_at_once_it_holds_the_write_lock(tmp_path):
+    path = str(tmp_path / 'personas.sqlite')
+    store = PersonaStore(path=path, flush_interval=60)
+    store.put('p', {'name': 'first'})
+
+    # Another worker holds the write lock for longer than the sync margin
+    blocker = sqlite3.connect(path, isolation_level=None)
+    blocker.execute('BEGIN IMMEDIATE')
+    flushing = threading.Thread(target=store.flush, daemon=True)
+    flushing.start()
+    time.sleep(SYNC_MARGIN + 0.5)
+    released = time.time()
+    blocker.execute('COMMIT')
+    flushing.join(timeout=5)
+    assert not flushing.is_alive()
+
+    (updated_at,) = blocker.execute('SELECT updated_at FROM personas WHERE id = ?', ('p',)).fetchone()
+    # A change scan from a worker that synced while the batch waited must still find it
+    assert updated_at >= released - SYNC_MARGIN
+    blocker.close()
@@ -0,0 +1,44 @@
+"""Provider routing and failover against the local Groq and Ollama stub."""
+import os
+import sys
+import subprocess
+
+import pytest
+
+from backend.benchmarks.stub_llm import CHECK_CASES
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The image runs Python 3.9, so the checks run without the builtins later versions added
+RUN_CHECK = '''
+import sys, runpy, builtins
+for name in ('aiter', 'anext'):
+    builtins.__dict__.pop(name, None)
+sys.argv = ['stub_llm', '--check', sys.argv[1]]
+runpy.run_module('backend.benchmarks.stub_llm', run_name='__main__', alter_sys=True)
+'''
+
+
+@pytest.mark.parametrize('case', CHECK_CASES)
+def test_stub_check(case, tmp_path):
+    # A fresh interpreter per case: the providers read their base URLs and timeouts from the environment at import
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')]))}
+    result = subprocess.run(
+        [sys.executable, '-c', RUN_CHECK, case],
+        cwd=tmp_path, env=env, capture_output=True, text=True, timeout=120,
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+
+
+def test_groq_sdk_retries_only_without_an_enabled_fallback(monkeypatch):
+    from backend import providers
+    monkeypatch.setattr(providers, 'GROQ_MAX_RETRIES', None)
+    monkeypatch.delenv('OLLAMA_BASE_URL', raising=False)
+    router = providers.ProviderRouter(names=['groq', 'ollama'])
+    groq = router.providers['groq']
+    # Ollama is listed but has no base URL, so Groq is all there is and keeps the SDK's backoff
+    assert groq.max_retries == providers.GROQ_SDK_RETRIES
+    monkeypatch.setenv('OLLAMA_BASE_URL', 'http://127.0.0.1:11434')
+    assert groq.max_retries == 0
+    assert providers.ProviderRouter(names=['groq']).providers['groq'].max_retries == providers.GROQ_SDK_RETRIES
+    monkeypatch.setattr(providers, 'GROQ_MAX_RETRIES', 5)
+    assert groq.max_retries == 5
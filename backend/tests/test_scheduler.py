@@ -0,0 +1,50 @@
+"""Admission scheduler: slots, per-key budgets, and callers that give up while queued."""
+import asyncio
+
+from backend.scheduler import AdmissionScheduler
+
+
+def test_cancelled_waiter_gives_its_place_back():
+    async def scenario():
+        scheduler = AdmissionScheduler(max_concurrency=1, max_wait=5)
+        ticket = await scheduler.acquire_async('tailor', 'key', 10)
+        queued = asyncio.ensure_future(scheduler.acquire_async('bullets', 'key', 10))
+        await asyncio.sleep(0.01)
+        assert scheduler.stats()['queue_depth'] == 1
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        assert scheduler.stats()['queue_depth'] == 0
+        ticket.release()
+        # The slot is free again, rather than handed to a caller that is gone
+        assert scheduler.stats()['active'] == 0
+        (await asyncio.wait_for(scheduler.acquire_async('bullets', 'key', 10), 1)).release()
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_after_grant_releases_the_slot():
+    async def scenario():
+        scheduler = AdmissionScheduler(max_concurrency=1, max_wait=5)
+        ticket = await scheduler.acquire_async('tailor', 'key', 10)
+        queued = asyncio.ensure_future(scheduler.acquire_async('bullets', 'key', 10))
+        await asyncio.sleep(0.01)
+        # Granted by the release, but cancelled before it could run
+        ticket.release()
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        assert scheduler.stats()['active'] == 0
+
+    asyncio.run(scenario())
+
+
+def test_idle_key_buckets_are_evicted():
+    scheduler = AdmissionScheduler(key_rpm=600, max_keys=10)
+    for key in range(100):
+        scheduler.acquire('tailor', f'key-{key}', 1).release()
+    # Every key is still inside its window, so none can be dropped without losing budget
+    assert scheduler.stats()['rate_limited_keys'] == 100
+    for buckets in scheduler.key_buckets.values():
+        for bucket in buckets:
+            bucket.level = bucket.capacity
+    scheduler.acquire('tailor', 'key-new', 1).release()
+    assert scheduler.stats()['rate_limited_keys'] == 10
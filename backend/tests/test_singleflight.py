@@ -0,0 +1,110 @@
+"""Coalescing identical generations onto one upstream stream, and what happens when subscribers leave."""
+import asyncio
+import threading
+
+import pytest
+
+from backend.singleflight import SingleFlight, AsyncSingleFlight
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, 5))
+
+
+async def collect(deltas):
+    return [delta async for delta in deltas]
+
+
+class Upstream:
+    """An async generation that waits at its start (scheduler queue, connect) and between deltas."""
+
+    def __init__(self, deltas=('a', 'b', 'c')):
+        self.deltas = deltas
+        self.admitted = asyncio.Event()
+        self.next_delta = asyncio.Event()
+        self.starts = 0
+        self.closed = False
+
+    async def start(self):
+        self.starts += 1
+        await self.admitted.wait()
+        return self.stream()
+
+    async def stream(self):
+        try:
+            for delta in self.deltas:
+                await self.next_delta.wait()
+                yield delta
+        finally:
+            self.closed = True
+
+
+@pytest.mark.parametrize('where', ['start', 'delta'])
+def test_async_subscriber_cancelled_mid_read_leaves_the_rest_streaming(where):
+    async def scenario():
+        upstream = Upstream()
+        flights = AsyncSingleFlight()
+        first = asyncio.ensure_future(collect(flights.stream('key', upstream.start)))
+        second = asyncio.ensure_future(collect(flights.stream('key', upstream.start)))
+        if where == 'delta':
+            upstream.admitted.set()
+        await asyncio.sleep(0.01)
+        first.cancel()
+        await asyncio.sleep(0.01)
+        upstream.admitted.set()
+        upstream.next_delta.set()
+        return await second, upstream, flights
+
+    deltas, upstream, flights = run(scenario())
+    assert deltas == ['a', 'b', 'c']
+    assert upstream.starts == 1
+    assert flights.stats()['in_flight'] == 0
+
+
+def test_async_flight_abandoned_by_everyone_stops_upstream():
+    async def scenario():
+        upstream = Upstream()
+        flights = AsyncSingleFlight()
+        subscribers = [asyncio.ensure_future(collect(flights.stream('key', upstream.start))) for _ in range(2)]
+        upstream.admitted.set()
+        await asyncio.sleep(0.01)
+        for subscriber in subscribers:
+            subscriber.cancel()
+        await asyncio.gather(*subscribers, return_exceptions=True)
+        return upstream, flights
+
+    upstream, flights = run(scenario())
+    assert upstream.closed
+    assert flights.stats()['in_flight'] == 0
+
+
+def test_sync_interrupted_pull_ends_the_flight_for_the_others():
+    reading = threading.Event()
+    release = threading.Event()
+
+    def start():
+        reading.set()
+        release.wait(5)
+        raise KeyboardInterrupt
+        yield
+
+    flights = SingleFlight()
+    outcomes = {}
+
+    def consume(name):
+        try:
+            outcomes[name] = list(flights.stream('key', start))
+        except BaseException as e:
+            outcomes[name] = type(e)
+
+    first = threading.Thread(target=consume, args=('first',), daemon=True)
+    first.start()
+    reading.wait(5)
+    second = threading.Thread(target=consume, args=('second',), daemon=True)
+    second.start()
+    second.join(0.05)
+    release.set()
+    first.join(5)
+    second.join(5)
+    assert not second.is_alive()
+    assert outcomes == {'first': KeyboardInterrupt, 'second': RuntimeError}